@@ -0,0 +1,6 @@
+"""Benchmarks of plot_isoline and plot_isosurface over a matrix of reference functions and settings.
+
+Run `python -m benchmarks` from the root of the repository (see __main__ for the options). Each run of a
+function with a setting records the wall time, the peak memory allocated, the calls and evaluations of fn,
+and the Hausdorff distance of the output to a dense reference, and the results are saved as JSON so that
+another version can be compared against them with --compare."""
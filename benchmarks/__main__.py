@@ -0,0 +1,55 @@
+"""python -m benchmarks [--quick] [--case NAME ...] [--repeat N] [--output PATH] [--compare PATH [--threshold F]]
+
+Runs the benchmarks, prints each result as it comes, and saves them all as JSON to --output. With --compare,
+also prints how each measure changed from the results saved in that file, and exits with status 1 if any of
+them got worse by more than --threshold (as a fraction). Also exits with status 1 if any of checks.CHECKS fails."""
+
+from __future__ import annotations
+
+import argparse
+import sys
+
+from .checks import run_checks
+from .functions import CASES, SETTINGS
+from .run import Result, compare, describe, load, run_suite, save
+
+
+def print_result(result: Result) -> None:
+    hausdorff = "none" if result["hausdorff"] is None else f"{result['hausdorff']:.3g}"
+    print(
+        f"{describe(result)}: {result['time']:.3f}s, {result['peak_memory'] / 1e6:.1f} MB, "
+        f"{result['calls']} calls, {result['evaluations']} evaluations, hausdorff {hausdorff}",
+        flush=True,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[2])
+    parser.add_argument("--quick", action="store_true", help="only the first settings for each dimension")
+    parser.add_argument("--case", action="append", help="only the given cases (repeat for several)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of each, of which the best is kept")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+    parser.add_argument("--compare", help="results saved by an earlier run, to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="growth of a measure that is a regression")
+    args = parser.parse_args()
+    cases = [case for case in CASES if args.case is None or case.name in args.case]
+    unknown = set(args.case or ()) - {case.name for case in CASES}
+    if unknown:
+        parser.error(f"unknown cases {', '.join(sorted(unknown))}, expected some of {[c.name for c in CASES]}")
+    settings = {dim: options[:1] if args.quick else options for dim, options in SETTINGS.items()}
+    results = run_suite(cases, settings, args.repeat, print_result)
+    save(results, args.output)
+    failures = run_checks(cases, settings)
+    if failures:
+        print("\n".join(["", f"{len(failures)} failed checks:", *failures]))
+    if args.compare is None:
+        return 1 if failures else 0
+    lines, regressions = compare(load(args.compare), results, args.threshold)
+    print("\n".join(["", *lines]))
+    if regressions:
+        print("\n".join(["", f"{len(regressions)} regressions:", *regressions]))
+    return 1 if failures or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
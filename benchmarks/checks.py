@@ -0,0 +1,48 @@
+"""Checks that options which only change how the output is computed leave it unchanged, run along with the
+benchmarks so that a change cannot break one of those paths without being noticed."""
+
+from __future__ import annotations
+
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from isosurfaces import plot_isoline, plot_isosurface_mesh
+
+from .functions import Case, Settings
+
+
+def same_output(case: Case, settings: Settings, **options) -> bool:
+    """Whether plotting case with settings and options gives exactly the same output as without options"""
+    pmin, pmax = np.array(case.pmin, dtype=np.float64), np.array(case.pmax, dtype=np.float64)
+    tol = (pmax - pmin) * settings.tol
+    args = (case.fn, pmin, pmax, settings.min_depth, settings.max_cells, tol, settings.vectorized)
+    if case.dim == 2:
+        expected, actual = plot_isoline(*args), plot_isoline(*args, **options)
+        return len(expected) == len(actual) and all(np.array_equal(a, b) for a, b in zip(expected, actual))
+    expected, actual = plot_isosurface_mesh(*args), plot_isosurface_mesh(*args, **options)
+    return np.array_equal(expected.vertices, actual.vertices) and np.array_equal(expected.faces, actual.faces)
+
+
+def check_compact(case: Case, settings: Settings) -> bool:
+    """A compact tree (see isosurfaces.array_tree) gives the same output as a tree of Cell objects"""
+    return same_output(case, settings, compact=True)
+
+
+CHECKS: Dict[str, Callable[[Case, Settings], bool]] = {"compact": check_compact}
+
+
+def run_checks(cases: List[Case], settings: Dict[int, List[Settings]]) -> List[str]:
+    """Descriptions of the checks that failed for each case with the first of the settings for its dimension"""
+    failures = []
+    for case in cases:
+        case_settings = settings[case.dim][0]
+        for name, check in CHECKS.items():
+            try:
+                passed = check(case, case_settings)
+            except Exception as error:
+                failures.append(f"{case.name}: {name} raised {error!r}")
+                continue
+            if not passed:
+                failures.append(f"{case.name}: {name} output differs")
+    return failures
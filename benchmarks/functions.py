@@ -0,0 +1,99 @@
+"""Reference functions to benchmark, and the settings to plot them with.
+
+Every function takes points along the last axis, so it works on a single point as well as on an (N, dim)
+array of points, and is plotted both ways."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    fn: Callable[[np.ndarray], np.ndarray]
+    pmin: Tuple[float, ...]
+    pmax: Tuple[float, ...]
+
+    @property
+    def dim(self) -> int:
+        return len(self.pmin)
+
+
+@dataclass(frozen=True)
+class Settings:
+    min_depth: int
+    max_cells: int
+    # tol, as a fraction of the size of the domain along each axis
+    tol: float
+    vectorized: bool
+
+
+def cubic(u: np.ndarray) -> np.ndarray:
+    """The curve of isoline_demo.py"""
+    x, y = u[..., 0], u[..., 1]
+    return y * (x - y) ** 2 - 4 * x - 8
+
+
+def tanm(u: np.ndarray) -> np.ndarray:
+    """Rings of zeros between rings of asymptotes, ever closer together away from the origin"""
+    return np.tan(u[..., 0] ** 2 + u[..., 1] ** 2) - 1
+
+
+def cone(u: np.ndarray) -> np.ndarray:
+    """A double cone, with a singularity at the origin"""
+    return u[..., 0] ** 2 + u[..., 1] ** 2 - u[..., 2] ** 2
+
+
+@dataclass(frozen=True)
+class Metaballs:
+    centers: Tuple[Tuple[float, ...], ...]
+
+    def __call__(self, u: np.ndarray) -> np.ndarray:
+        return sum(1 / np.linalg.norm(u - np.array(c), axis=-1) for c in self.centers) - 1
+
+
+class Noise:
+    """A smooth random field: a sum of waves of random directions and phases, with frequencies up to
+    max_frequency, the same for every run with the same arguments"""
+
+    def __init__(self, dim: int, waves: int = 24, max_frequency: float = 4.0, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        directions = rng.normal(size=(waves, dim))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        self.wave_vectors = directions * rng.uniform(0.5, max_frequency, size=(waves, 1))
+        self.phases = rng.uniform(0, 2 * np.pi, size=waves)
+        # Lower frequencies are stronger, as in natural noise
+        self.amplitudes = 1 / np.linalg.norm(self.wave_vectors, axis=1)
+
+    def __call__(self, u: np.ndarray) -> np.ndarray:
+        return np.sin(u @ self.wave_vectors.T + self.phases) @ self.amplitudes
+
+
+CASES = [
+    Case("cubic", cubic, (-8, -6), (8, 6)),
+    Case("tanm", tanm, (-8, -6), (8, 6)),
+    Case("metaballs-2d", Metaballs(((0, 1.6), (0, -1.6))), (-4, -4), (4, 4)),
+    Case("noise-2d", Noise(2), (-4, -4), (4, 4)),
+    Case("cone", cone, (-4, -4, -4), (4, 4, 4)),
+    Case("metaballs-3d", Metaballs(((0, 1.6, 0), (0, -1.6, 0))), (-4, -4, -4), (4, 4, 4)),
+    Case("noise-3d", Noise(3), (-4, -4, -4), (4, 4, 4)),
+]
+
+# By dimension. The first of each is the one run with --quick
+SETTINGS = {
+    2: [
+        Settings(5, 1000, 1e-3, False),
+        Settings(5, 10000, 1e-3, False),
+        Settings(6, 10000, 1e-4, True),
+        Settings(7, 50000, 1e-4, True),
+    ],
+    3: [
+        Settings(3, 1000, 1e-3, False),
+        Settings(4, 10000, 1e-3, True),
+        Settings(5, 40000, 1e-4, True),
+    ],
+}
@@ -0,0 +1,130 @@
+"""Distance between the output of a plot and a dense reference, measured between points sampled along each.
+
+Curves are sampled along their segments, and surfaces over their triangles, at most spacing apart, so the
+distances are exact for the samples and within about spacing of the distances between the curves or surfaces."""
+
+from __future__ import annotations
+
+from itertools import product
+
+import numpy as np
+
+# Distances computed at once by the brute-force search
+CHUNK = 1 << 22
+
+
+def sample_curves(curves: list[list[np.ndarray]], spacing: float) -> np.ndarray:
+    """Points (N, dim) along the segments of the curves, at most spacing apart"""
+    segments = [np.asarray(curve, dtype=np.float64) for curve in curves if len(curve) > 1]
+    if not segments:
+        points = [np.asarray(curve, dtype=np.float64).reshape(-1, 2) for curve in curves]
+        return np.concatenate(points) if points else np.zeros((0, 2))
+    starts = np.concatenate([s[:-1] for s in segments])
+    ends = np.concatenate([s[1:] for s in segments])
+    counts = np.maximum(np.ceil(np.linalg.norm(ends - starts, axis=1) / spacing), 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(starts)), counts)
+    t = (np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[segment]
+    points = starts[segment] + t[:, np.newaxis] * (ends[segment] - starts[segment])
+    return thin(np.concatenate([points, [s[-1] for s in segments]]), spacing)
+
+
+def sample_triangles(triangles: np.ndarray, spacing: float) -> np.ndarray:
+    """Points (N, 3) over the triangles (F, 3, 3) from their corners and centers, after splitting each one into 4
+    until all of their sides are shorter than spacing"""
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+    done = []
+    while len(triangles) > 0:
+        sides = np.linalg.norm(triangles - np.roll(triangles, 1, axis=1), axis=2).max(axis=1)
+        # Degenerate (NaN) triangles are dropped
+        done.append(triangles[sides <= spacing])
+        large = triangles[sides > spacing]
+        a, b, c = large[:, 0], large[:, 1], large[:, 2]
+        ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+        triangles = np.concatenate([np.stack(t, axis=1) for t in [(a, ab, ca), (ab, b, bc), (ca, bc, c), (ab, bc, ca)]])
+    triangles = np.concatenate(done)
+    return thin(np.concatenate([triangles.reshape(-1, 3), triangles.mean(axis=1)]), spacing)
+
+
+def thin(points: np.ndarray, spacing: float) -> np.ndarray:
+    """One of points in each cube of side spacing / 2, which keeps all of points within spacing of those kept
+    while dropping those that are much closer together (such as the corners shared by neighbouring triangles)"""
+    if len(points) == 0:
+        return points
+    cells = np.floor((points - points.min(axis=0)) / (spacing / 2)).astype(np.int64)
+    strides = np.cumprod(np.concatenate([[1], cells.max(axis=0)[:-1] + 1]))
+    _, kept = np.unique(cells @ strides, return_index=True)
+    return points[np.sort(kept)]
+
+
+def nearest_distances(points: np.ndarray, targets: np.ndarray, radius: float) -> np.ndarray:
+    """Distance from each of points to the nearest of targets.
+
+    Targets are bucketed into cubes of side radius, so that each point only needs to look at the targets of the
+    cubes around its own to find any within radius. Points with none that close are searched by brute force"""
+    if len(targets) == 0:
+        return np.full(len(points), np.inf)
+    origin = targets.min(axis=0)
+    target_cells = np.floor((targets - origin) / radius).astype(np.int64)
+    shape = target_cells.max(axis=0) + 3
+    # Cells are numbered in a grid padded by one on each side, where there are no targets, so that the
+    # neighbours of a cell in the grid that wrap around to another row are empty too
+    strides = np.cumprod(np.concatenate([[1], shape[:-1]]))
+    ids = (target_cells + 1) @ strides
+    order = np.argsort(ids, kind="stable")
+    targets = targets[order]
+    ids = ids[order]
+    # About CHUNK distances at once, if each cube holds the average number of targets of the cubes that have any
+    occupancy = len(ids) / len(np.unique(ids))
+    step = max(1, int(CHUNK / (3 ** points.shape[1] * occupancy)))
+    best = np.concatenate(
+        [
+            nearby_distances(points[start : start + step], targets, ids, origin, radius, shape, strides)
+            for start in range(0, len(points), step)
+        ]
+    )
+    far = np.nonzero(best > radius)[0]
+    step = max(1, CHUNK // len(targets))
+    for start in range(0, len(far), step):
+        chunk = far[start : start + step]
+        distances = np.linalg.norm(points[chunk, np.newaxis] - targets[np.newaxis], axis=2)
+        best[chunk] = distances.min(axis=1)
+    return best
+
+
+def nearby_distances(
+    points: np.ndarray,
+    targets: np.ndarray,
+    ids: np.ndarray,
+    origin: np.ndarray,
+    radius: float,
+    shape: np.ndarray,
+    strides: np.ndarray,
+) -> np.ndarray:
+    """Distance from each of points to the nearest of the targets in the cubes around it (inf if there are none),
+    for nearest_distances, given the targets sorted by the ids of their cubes"""
+    best = np.full(len(points), np.inf)
+    point_cells = np.floor((points - origin) / radius).astype(np.int64) + 1
+    # Points further out have no targets within radius
+    inside = np.nonzero(np.all((point_cells >= 0) & (point_cells < shape), axis=1))[0]
+    for offset in product((-1, 0, 1), repeat=points.shape[1]):
+        cell_ids = (point_cells[inside] + offset) @ strides
+        starts = np.searchsorted(ids, cell_ids, "left")
+        counts = np.searchsorted(ids, cell_ids, "right") - starts
+        found = counts > 0
+        if not np.any(found):
+            continue
+        query, starts, counts = inside[found], starts[found], counts[found]
+        first = np.cumsum(counts) - counts
+        index = np.repeat(starts - first, counts) + np.arange(counts.sum())
+        difference = np.repeat(points[query], counts, axis=0) - targets[index]
+        squared = np.einsum("ij,ij->i", difference, difference)
+        best[query] = np.minimum(best[query], np.minimum.reduceat(squared, first))
+    return np.sqrt(best)
+
+
+def hausdorff_distance(a: np.ndarray, b: np.ndarray, radius: float) -> float:
+    """Hausdorff distance between the point sets a and b, where radius is about the distance expected
+    between the two at most points"""
+    if len(a) == 0 or len(b) == 0:
+        return 0.0 if len(a) == len(b) else np.inf
+    return float(max(nearest_distances(a, b, radius).max(), nearest_distances(b, a, radius).max()))
@@ -0,0 +1,189 @@
+"""Running the benchmarks, and saving and comparing their results."""
+
+from __future__ import annotations
+
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterable
+
+import numpy as np
+
+import isosurfaces
+from isosurfaces import PlotStats, observe, plot_isoline, plot_isosurface, plot_isosurface_mesh
+
+from .functions import Case, Settings
+from .quality import hausdorff_distance, sample_curves, sample_triangles
+
+# The reference of each case is every cell of this depth, marched by the "grid" engine
+REFERENCE_DEPTH = {2: 10, 3: 7}
+# Samples along the output and the reference are this fraction of a reference cell apart
+SAMPLE_SPACING = 1.0
+# Measures compared by compare, where larger is worse
+MEASURES = ("time", "peak_memory", "calls", "evaluations", "hausdorff")
+
+# One run, as saved in the JSON results
+Result = Dict[str, Any]
+
+
+def plot(case: Case, settings: Settings, fn: Callable[[np.ndarray], Any]) -> np.ndarray:
+    """Points sampled along the output of plotting fn (the function of case) with settings"""
+    pmin, pmax = np.array(case.pmin, dtype=np.float64), np.array(case.pmax, dtype=np.float64)
+    tol = (pmax - pmin) * settings.tol
+    args = (fn, pmin, pmax, settings.min_depth, settings.max_cells, tol, settings.vectorized)
+    spacing = sample_spacing(case)
+    if case.dim == 2:
+        return sample_curves(plot_isoline(*args), spacing)
+    _, faces = plot_isosurface(*args)
+    return sample_triangles(np.array(faces, dtype=np.float64), spacing)
+
+
+def reference(case: Case) -> np.ndarray:
+    """Points sampled along the reference output of case"""
+    pmin, pmax = np.array(case.pmin, dtype=np.float64), np.array(case.pmax, dtype=np.float64)
+    depth = REFERENCE_DEPTH[case.dim]
+    tol = (pmax - pmin) * 1e-6
+    spacing = sample_spacing(case)
+    if case.dim == 2:
+        curves = plot_isoline(case.fn, pmin, pmax, depth, tol=tol, vectorized=True, engine="grid")
+        return sample_curves(curves, spacing)
+    mesh = plot_isosurface_mesh(case.fn, pmin, pmax, depth, tol=tol, vectorized=True, engine="grid")
+    return sample_triangles(mesh.vertices[mesh.faces], spacing)
+
+
+def sample_spacing(case: Case) -> float:
+    cell = (np.array(case.pmax, dtype=np.float64) - case.pmin) / (1 << REFERENCE_DEPTH[case.dim])
+    return float(SAMPLE_SPACING * cell.min())
+
+
+def run_case(case: Case, settings: Settings, reference_points: np.ndarray, repeat: int = 3) -> Result:
+    """Measures of plotting case with settings: the best wall time of repeat runs, the peak memory allocated
+    (with tracemalloc), the calls of fn and its evaluations by purpose (see isosurfaces.PlotStats), and the
+    Hausdorff distance between the output and reference_points"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plot(case, settings, case.fn)
+        times.append(time.perf_counter() - start)
+    calls = 0
+
+    def counted_fn(p: np.ndarray) -> Any:
+        nonlocal calls
+        calls += 1
+        return case.fn(p)
+
+    stats = PlotStats()
+    with observe(stats):
+        points = plot(case, settings, counted_fn)
+    tracemalloc.start()
+    try:
+        plot(case, settings, case.fn)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    hausdorff = hausdorff_distance(points, reference_points, sample_spacing(case))
+    return {
+        "case": case.name,
+        "dim": case.dim,
+        **asdict(settings),
+        "time": min(times),
+        "stage_times": stats.stage_times,
+        "peak_memory": peak_memory,
+        "calls": calls,
+        "evaluations": sum(stats.evaluations.values()),
+        "evaluations_by_purpose": dict(stats.evaluations),
+        "leaves": sum(stats.leaves.values()),
+        # None for an empty output, where the reference has points (JSON has no infinity)
+        "hausdorff": hausdorff if np.isfinite(hausdorff) else None,
+    }
+
+
+def run_suite(
+    cases: Iterable[Case],
+    settings: dict[int, list[Settings]],
+    repeat: int = 3,
+    progress: Callable[[Result], None] | None = None,
+) -> dict[str, Any]:
+    """Results of run_case for each case with each of the settings for its dimension, together with the
+    versions they were measured with"""
+    results = []
+    for case in cases:
+        reference_points = reference(case)
+        for case_settings in settings[case.dim]:
+            result = run_case(case, case_settings, reference_points, repeat)
+            if progress is not None:
+                progress(result)
+            results.append(result)
+    return {"environment": environment(), "results": results}
+
+
+def environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "isosurfaces": isosurfaces.__version__,
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def result_key(result: Result) -> tuple:
+    return (result["case"], result["min_depth"], result["max_cells"], result["tol"], result["vectorized"])
+
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float = 0.1) -> tuple[list[str], list[str]]:
+    """Lines describing the change of each measure from old to new results (as saved by save), for the runs in
+    both, and the lines of those that got worse by more than the fraction threshold"""
+    old_results = {result_key(result): result for result in old["results"]}
+    lines = []
+    regressions = []
+    for result in new["results"]:
+        before = old_results.get(result_key(result))
+        if before is None:
+            continue
+        for measure in MEASURES:
+            a, b = before[measure], result[measure]
+            line = f"{describe(result)} {measure}: {format_measure(a)} -> {format_measure(b)}"
+            if a is not None and b is not None and a > 0:
+                line += f" ({b / a - 1:+.1%})"
+            lines.append(line)
+            # An output that went missing is a regression, and so is any growth from 0
+            if b is None and a is not None or (a is not None and b is not None and b > a * (1 + threshold)):
+                regressions.append(line)
+    return lines, regressions
+
+
+def describe(result: Result) -> str:
+    vectorized = ", vectorized" if result["vectorized"] else ""
+    return (
+        f"{result['case']} (min_depth={result['min_depth']}, max_cells={result['max_cells']}, "
+        f"tol={result['tol']:g}{vectorized})"
+    )
+
+
+def format_measure(value: float | None) -> str:
+    if value is None:
+        return "none"
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def save(results: dict[str, Any], path: str) -> None:
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load(path: str) -> dict[str, Any]:
+    with open(path) as file:
+        return json.load(file)
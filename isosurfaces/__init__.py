@@ -1,6 +1,39 @@
 __version__ = "0.1.2"
 
-__all__ = ["plot_isoline", "plot_isosurface"]
+__all__ = [
+    "plot_isoline",
+    "plot_contours",
+    "plot_isosurface",
+    "plot_isosurface_mesh",
+    "iter_isosurface_faces",
+    "plot_isoline_async",
+    "plot_isosurface_async",
+    "plot_isosurface_mesh_async",
+    "IsosurfaceMesh",
+    "RefinementCriterion",
+    "LinearityTest",
+    "GradientTest",
+    "IsolineSession",
+    "EvaluationCache",
+    "write_isosurface_tiled",
+    "MeshSink",
+    "PlySink",
+    "ObjSink",
+    "compile_expression",
+    "CompiledExpression",
+    "PlotStats",
+    "PlotObserver",
+    "observe",
+]
 
+from .asynchronous import plot_isoline_async, plot_isosurface_async, plot_isosurface_mesh_async
+from .cache import EvaluationCache
+from .cell import RefinementCriterion
+from .contours import plot_contours
+from .criteria import GradientTest, LinearityTest
+from .expression import CompiledExpression, compile_expression
 from .isoline import plot_isoline
-from .isosurface import plot_isosurface
+from .isosurface import IsosurfaceMesh, iter_isosurface_faces, plot_isosurface, plot_isosurface_mesh
+from .session import IsolineSession
+from .stats import PlotObserver, PlotStats, observe
+from .tiled import MeshSink, ObjSink, PlySink, write_isosurface_tiled
@@ -0,0 +1,287 @@
+"""Compact structure-of-arrays alternative to a tree of Cell objects.
+
+Cells are numbered in breadth-first order, with the root as cell 0 and the children of each cell
+stored contiguously. For cell k:
+
+- depth[k] is its depth
+- morton[k] is the Morton code of its integer coordinates at its own depth
+- first_child[k] is the number of its first child, or -1 if it is a leaf
+- parent[k] is the number of its parent, or -1 for the root
+- cell_vertices[k] are the indices of its vertices in the shared vertex table
+
+The vertex table holds the integer coordinates, positions, and values of every distinct vertex.
+Vertices are identified by the Morton code of their coordinates on a lattice max_depth levels deep,
+so the whole table can be searched and extended with array operations."""
+
+from __future__ import annotations
+
+import numpy as np
+
+from .cell import Cell, CellIndex
+from .point import LATTICE_DEPTH, Func, LatticeKey, Point, ValuedPoint, VertexStore
+
+
+def max_array_depth(dim: int) -> int:
+    """Deepest level of cells whose vertices can be identified by a 64-bit Morton code"""
+    return 64 // dim - 1
+
+
+def interleave(coords: np.ndarray, bits: int) -> np.ndarray:
+    """Morton codes (N,) of the non-negative integer coordinates (N, dim), each below 2**bits"""
+    coords = coords.astype(np.uint64)
+    dim = coords.shape[1]
+    codes = np.zeros(len(coords), dtype=np.uint64)
+    for b in range(bits):
+        for d in range(dim):
+            codes |= ((coords[:, d] >> np.uint64(b)) & np.uint64(1)) << np.uint64(b * dim + d)
+    return codes
+
+
+def spread_bits(byte: int, dim: int) -> int:
+    """Moves bit b of byte to bit b * dim"""
+    return sum((byte >> b & 1) << (b * dim) for b in range(8))
+
+
+# SPREAD_BYTE[dim][byte] == spread_bits(byte, dim)
+SPREAD_BYTE = {dim: [spread_bits(byte, dim) for byte in range(256)] for dim in (1, 2, 3)}
+
+
+def interleave_one(coords: tuple[int, ...]) -> int:
+    """interleave for a single point, a byte at a time without the overhead of numpy"""
+    dim = len(coords)
+    spread = SPREAD_BYTE[dim] if dim in SPREAD_BYTE else [spread_bits(byte, dim) for byte in range(256)]
+    code = 0
+    for d, c in enumerate(coords):
+        shift = d
+        while c:
+            code |= spread[c & 255] << shift
+            c >>= 8
+            shift += 8 * dim
+    return code
+
+
+class ArrayTree:
+    def __init__(self, dim: int, store: VertexStore) -> None:
+        self.dim = dim
+        self.store = store
+        self.max_depth = max_array_depth(dim)
+        # Vertex coordinates are scaled by this to get lattice keys of the store
+        self.key_shift = LATTICE_DEPTH - self.max_depth
+        # (i >> d & 1) for vertex i of a cell, as in MinimalCell.vertices
+        self.corner_offsets = np.array([[i >> d & 1 for d in range(dim)] for i in range(1 << dim)], dtype=np.int64)
+
+        self.depth = np.zeros(0, dtype=np.uint8)
+        self.morton = np.zeros(0, dtype=np.uint64)
+        self.first_child = np.zeros(0, dtype=np.int64)
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.cell_vertices = np.zeros((0, 1 << dim), dtype=np.int64)
+
+        self.vertex_coords = np.zeros((0, dim), dtype=np.int64)
+        self.positions = np.zeros((0, dim), dtype=np.float64)
+        self.values = np.zeros(0, dtype=np.float64)
+        # Morton codes of all vertices in sorted order, and the corresponding vertex indices
+        self.sorted_keys = np.zeros(0, dtype=np.uint64)
+        self.sorted_ids = np.zeros(0, dtype=np.int64)
+
+    def build(self, min_depth: int, max_cells: int, tol: np.ndarray) -> None:
+        """Refine breadth-first exactly as build_tree, but one whole level at a time using array operations"""
+        if min_depth > self.max_depth:
+            raise ValueError(f"min_depth can be at most {self.max_depth} for a {self.dim}-dimensional ArrayTree")
+        branching_factor = 1 << self.dim
+        # min_depth takes precedence over max_quads
+        max_cells = max(branching_factor**min_depth, max_cells)
+        level_coords = np.zeros((1, self.dim), dtype=np.int64)
+        level_parent = np.full(1, -1, dtype=np.int64)
+        depth = 0
+        # Arrays for each level, concatenated at the end
+        levels: list[tuple[np.ndarray, ...]] = []
+        next_id = 1
+        leaf_count = 1
+
+        while True:
+            level_vertices = self.add_vertices(level_coords, depth)
+            level_first_child = np.full(len(level_coords), -1, dtype=np.int64)
+            levels.append((level_coords, level_parent, level_first_child, level_vertices))
+            if leaf_count >= max_cells:
+                break
+            split = self.should_split(level_vertices, depth, min_depth, tol)
+            # Same budget as build_tree: cells are split in order until leaf_count reaches max_cells
+            allowed = -(-(max_cells - leaf_count) // (branching_factor - 1))
+            split_index = np.nonzero(split)[0][:allowed]
+            if len(split_index) == 0:
+                break
+            level_first_child[split_index] = next_id + branching_factor * np.arange(len(split_index))
+            leaf_count += (branching_factor - 1) * len(split_index)
+            level_start = next_id - len(level_coords)
+            next_id += branching_factor * len(split_index)
+            # Child i of a cell with coordinates c has coordinates 2c + (i >> d & 1)
+            level_coords = (2 * level_coords[split_index, np.newaxis, :] + self.corner_offsets).reshape(-1, self.dim)
+            level_parent = np.repeat(level_start + split_index, branching_factor)
+            depth += 1
+
+        self.depth = np.concatenate([np.full(len(level[0]), d, dtype=np.uint8) for d, level in enumerate(levels)])
+        self.morton = np.concatenate([interleave(level[0], d) for d, level in enumerate(levels)])
+        self.parent = np.concatenate([level[1] for level in levels])
+        self.first_child = np.concatenate([level[2] for level in levels])
+        self.cell_vertices = np.concatenate([level[3] for level in levels])
+
+    def should_split(self, level_vertices: np.ndarray, depth: int, min_depth: int, tol: np.ndarray) -> np.ndarray:
+        """Vectorized should_split over the cells of one level, given the indices of their vertices"""
+        if depth >= self.max_depth:
+            return np.zeros(len(level_vertices), dtype=bool)
+        if depth < min_depth:
+            return np.ones(len(level_vertices), dtype=bool)
+        width = self.positions[level_vertices[:, -1]] - self.positions[level_vertices[:, 0]]
+        # too small of a cell to be worth descending
+        large = ~np.all(width < 10 * tol, axis=1)
+        vals = self.values[level_vertices]
+        nan = np.isnan(vals)
+        signs = np.sign(vals)
+        # only descend if we cross the isoline, or straddle defined and undefined
+        crossing = np.any(nan, axis=1) | np.any(signs[:, 1:] != signs[:, :1], axis=1)
+        return large & ~np.all(nan, axis=1) & crossing
+
+    def add_vertices(self, cell_coords: np.ndarray, depth: int) -> np.ndarray:
+        """Returns the vertex indices (N, 2**dim) of the cells at depth with the given coordinates,
+        adding and evaluating any vertices not already in the table"""
+        corners = (cell_coords[:, np.newaxis, :] + self.corner_offsets) << (self.max_depth - depth)
+        corners = corners.reshape(-1, self.dim)
+        keys = interleave(corners, self.max_depth + 1)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        found_at = np.searchsorted(self.sorted_keys, unique_keys)
+        found = found_at < len(self.sorted_keys)
+        found[found] = self.sorted_keys[found_at[found]] == unique_keys[found]
+        ids = np.empty(len(unique_keys), dtype=np.int64)
+        ids[found] = self.sorted_ids[found_at[found]]
+        new = np.nonzero(~found)[0]
+        ids[new] = len(self.values) + np.arange(len(new))
+
+        new_coords = corners[first[new]]
+        new_positions = self.store.pmin + (new_coords << self.key_shift) * self.store.scale
+        new_values = self.store.evaluate(new_positions)
+        self.vertex_coords = np.concatenate([self.vertex_coords, new_coords])
+        self.positions = np.concatenate([self.positions, new_positions])
+        self.values = np.concatenate([self.values, new_values])
+
+        all_keys = np.concatenate([self.sorted_keys, unique_keys[new]])
+        all_ids = np.concatenate([self.sorted_ids, ids[new]])
+        order = np.argsort(all_keys, kind="stable")
+        self.sorted_keys = all_keys[order]
+        self.sorted_ids = all_ids[order]
+        return ids[inverse.reshape(-1)].reshape(-1, 1 << self.dim)
+
+    def find_vertex(self, key: LatticeKey) -> int | None:
+        """Index of the vertex at the lattice key of the store, if there is one"""
+        mask = (1 << self.key_shift) - 1
+        if any(k & mask for k in key):
+            return None
+        code = np.uint64(interleave_one(tuple(k >> self.key_shift for k in key)))
+        i = np.searchsorted(self.sorted_keys, code)
+        if i < len(self.sorted_keys) and self.sorted_keys[i] == code:
+            return int(self.sorted_ids[i])
+        return None
+
+    def find_point(self, key: LatticeKey) -> ValuedPoint | None:
+        id = self.find_vertex(key)
+        return None if id is None else self.vertex(id)
+
+    def vertex(self, id: int) -> ValuedPoint:
+        key = tuple(c << self.key_shift for c in self.vertex_coords[id].tolist())
+        return ValuedPoint(self.positions[id], self.values[id], key)
+
+    def root(self) -> ArrayCell:
+        return ArrayCell(self, 0)
+
+    def nbytes(self) -> int:
+        """Total size of the arrays backing the tree"""
+        arrays = [self.depth, self.morton, self.first_child, self.parent, self.cell_vertices]
+        arrays += [self.vertex_coords, self.positions, self.values, self.sorted_keys, self.sorted_ids]
+        return sum(a.nbytes for a in arrays)
+
+
+class ArrayCellIndex(CellIndex):
+    """CellIndex of an ArrayTree, searching sorted location codes (Morton codes with a leading 1 bit
+    marking the depth) instead of hashing Python objects for every cell"""
+
+    def __init__(self, tree: ArrayTree) -> None:
+        self.tree = tree
+        locations = self.tree.morton | (np.uint64(1) << (tree.dim * tree.depth.astype(np.uint64)))
+        order = np.argsort(locations)
+        self.sorted_locations = locations[order]
+        self.sorted_ids = order
+
+    def find(self, depth: int, coords: tuple[int, ...]) -> Cell | None:
+        location = np.uint64(interleave_one(coords) | 1 << (self.tree.dim * depth))
+        i = np.searchsorted(self.sorted_locations, location)
+        if i < len(self.sorted_locations) and self.sorted_locations[i] == location:
+            return ArrayCell(self.tree, int(self.sorted_ids[i]))
+        return None
+
+
+class ArrayCell(Cell):
+    """A view of one cell of an ArrayTree, usable wherever a Cell is.
+
+    Views are created on demand, so the tree itself never holds any Python objects per cell"""
+
+    def __init__(self, tree: ArrayTree, index: int) -> None:
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"ArrayCell({self.index})"
+
+    def build_index(self) -> CellIndex:
+        return ArrayCellIndex(self.tree)
+
+    @property
+    def dim(self) -> int:
+        return self.tree.dim
+
+    @property
+    def vertices(self) -> list[ValuedPoint]:
+        return [self.tree.vertex(id) for id in self.tree.cell_vertices[self.index]]
+
+    @property
+    def depth(self) -> int:
+        return int(self.tree.depth[self.index])
+
+    @property
+    def children(self) -> list[ArrayCell]:
+        first = self.tree.first_child[self.index]
+        if first < 0:
+            return []
+        return [ArrayCell(self.tree, first + i) for i in range(1 << self.tree.dim)]
+
+    @property
+    def parent(self) -> ArrayCell | None:
+        parent = self.tree.parent[self.index]
+        return None if parent < 0 else ArrayCell(self.tree, parent)
+
+    @property
+    def child_direction(self) -> int:
+        # Siblings are stored contiguously after the root
+        return 0 if self.index == 0 else (self.index - 1) % (1 << self.tree.dim)
+
+
+def build_array_tree(
+    dim: int,
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    vectorized: bool = False,
+    store: VertexStore | None = None,
+) -> ArrayTree:
+    """Same tree as build_tree, as an ArrayTree. Use tree.root() to get a Cell to pass to
+    Triangulator or SimplexGenerator, along with tree.store.
+
+    Vertices are evaluated with store (a fresh VertexStore by default), but kept in the tree's
+    vertex table, where store.find looks them up"""
+    if store is None:
+        store = VertexStore(fn, pmin, pmax, vectorized)
+    tree = ArrayTree(dim, store)
+    store.lookup = tree.find_point
+    tree.build(min_depth, max_cells, tol)
+    return tree
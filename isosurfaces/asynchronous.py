@@ -0,0 +1,92 @@
+"""Plotting functions for an async fn, such as one backed by requests to a server.
+
+Each one runs its synchronous counterpart in a thread (with an AsyncStore), while fn is awaited in the
+calling event loop. The new vertices of each level of the tree, and the steps of the searches for zeros,
+are awaited together, at most max_in_flight at a time, so the number of round trips in sequence grows
+with the depth of the tree rather than the number of points."""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+import numpy as np
+
+from .cell import Cell, build_tree
+from .isoline import plot_isoline
+from .isosurface import IsosurfaceMesh, plot_isosurface, plot_isosurface_mesh
+from .parallel import MAX_IN_FLIGHT, AsyncFunc, AsyncFunction, AsyncStore
+from .point import Point
+from .roots import RootMethod, find_zeros
+
+T = TypeVar("T")
+
+
+async def run_in_thread(function: Callable[..., T], *args, **kwargs) -> T:
+    """function(*args, **kwargs) in a thread, in a copy of the calling context (so with the same stats.observe)"""
+    call = partial(contextvars.copy_context().run, function, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+async def plot_isoline_async(
+    fn: AsyncFunc, pmin: Point, pmax: Point, *args, max_in_flight: int = MAX_IN_FLIGHT, **kwargs
+) -> list[list[Point]]:
+    """Same as plot_isoline (taking the same arguments), for an async fn"""
+    afn = AsyncFunction(fn, asyncio.get_running_loop(), max_in_flight)
+    return await run_in_thread(plot_isoline, afn, pmin, pmax, *args, **kwargs)
+
+
+async def plot_isosurface_async(
+    fn: AsyncFunc, pmin: Point, pmax: Point, *args, max_in_flight: int = MAX_IN_FLIGHT, **kwargs
+) -> Any:
+    """Same as plot_isosurface (taking the same arguments), for an async fn"""
+    afn = AsyncFunction(fn, asyncio.get_running_loop(), max_in_flight)
+    return await run_in_thread(plot_isosurface, afn, pmin, pmax, *args, **kwargs)
+
+
+async def plot_isosurface_mesh_async(
+    fn: AsyncFunc, pmin: Point, pmax: Point, *args, max_in_flight: int = MAX_IN_FLIGHT, **kwargs
+) -> IsosurfaceMesh:
+    """Same as plot_isosurface_mesh (taking the same arguments), for an async fn"""
+    afn = AsyncFunction(fn, asyncio.get_running_loop(), max_in_flight)
+    return await run_in_thread(plot_isosurface_mesh, afn, pmin, pmax, *args, **kwargs)
+
+
+async def build_tree_async(
+    dim: int,
+    fn: AsyncFunc,
+    pmin: Point,
+    pmax: Point,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    vectorized: bool = False,
+    *args,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    **kwargs,
+) -> Cell:
+    """Same as build_tree (taking the same arguments after vectorized, except store), for an async fn"""
+    afn = AsyncFunction(fn, asyncio.get_running_loop(), max_in_flight)
+    with AsyncStore(afn, np.asarray(pmin), np.asarray(pmax), vectorized) as store:
+        return await run_in_thread(
+            build_tree, dim, afn, pmin, pmax, min_depth, max_cells, tol, vectorized, store, *args, **kwargs
+        )
+
+
+async def find_zeros_async(
+    pos1: np.ndarray,
+    val1: np.ndarray,
+    pos2: np.ndarray,
+    val2: np.ndarray,
+    fn: AsyncFunc,
+    tol: np.ndarray,
+    method: RootMethod = "bisect",
+    vectorized: bool = False,
+    max_in_flight: int = MAX_IN_FLIGHT,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Same as find_zeros, for an async fn. Each step evaluates all unfinished edges together,
+    in a single call if vectorized"""
+    afn = AsyncFunction(fn, asyncio.get_running_loop(), max_in_flight)
+    return await run_in_thread(find_zeros, pos1, val1, pos2, val2, afn if vectorized else afn.map, tol, method)
@@ -0,0 +1,157 @@
+"""Saving values of fn to disk, so that they can be reused by later plots, in this process or others."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from typing import Callable
+
+import numpy as np
+
+from .point import BatchFunc, Func
+from .stats import current_observer
+
+# Default number of values a cache file holds
+CAPACITY = 1 << 20
+# When full, the least recently used 1/EVICT_FRACTION of the values are dropped at once
+EVICT_FRACTION = 16
+
+
+class ValueCache(ABC):
+    """Values of fn by position, looked up before calling fn (see VertexStore). Subclasses keep the values:
+    EvaluationCache on disk, or contours.LevelCache in memory"""
+
+    @abstractmethod
+    def evaluate(self, positions: np.ndarray, compute: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Values (N,) at positions (N, dim), taken from the cache where present and otherwise from
+        compute(missing positions), which are then added to the cache"""
+
+    def flush(self) -> None:
+        """Write pending changes to wherever the values are kept"""
+
+    def wrap(self, fn: Func, vectorized: bool = False) -> Func:
+        """fn (a BatchFunc if vectorized) with its values looked up in and saved to this cache"""
+        if vectorized:
+            batch_fn: BatchFunc = fn
+            return lambda positions: self.evaluate(positions, batch_fn)
+        return lambda p: self.evaluate(p[np.newaxis], lambda ps: np.array([fn(q) for q in ps]))[0]
+
+
+class EvaluationCache(ValueCache):
+    """Values of a function, kept in a memory-mapped NumPy (.npy) file of at most capacity entries,
+    dropping the least recently used entries when full.
+
+    Entries are keyed by name, which identifies the function, and by the exact position evaluated.
+    Since vertices and duals lie on a lattice fixed by pmin and pmax, replotting the same domain
+    (with another max_quads or tol, say) finds them again. One file can hold several functions under
+    different names, but its capacity and number of dimensions are fixed when it is created.
+
+    Pass it as cache to the plotting functions. Only the process that opened a cache adds to it
+    (worker processes read from it), and only one process should write to a file at a time"""
+
+    def __init__(self, path: str, name: str, capacity: int = CAPACITY, read_only: bool = False) -> None:
+        self.path = path
+        self.name = name
+        self.capacity = capacity
+        self.read_only = read_only
+        self.owner = os.getpid()
+        # Stable across runs, unlike hash()
+        self.fn_id = int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], "little", signed=True)
+        self.table: np.ndarray | None = None
+        # Slot in table of each entry (of any function), by the bytes of its key (see keys)
+        self.index: dict[bytes, int] = {}
+        self.free: list[int] = []
+        self.clock = 1
+
+    def __reduce__(self):
+        # Processes other than the owner (e.g. spawned workers) only read
+        return EvaluationCache, (self.path, self.name, self.capacity, True)
+
+    @property
+    def writable(self) -> bool:
+        return not self.read_only and os.getpid() == self.owner
+
+    def open(self, dim: int) -> None:
+        if os.path.exists(self.path):
+            self.table = np.lib.format.open_memmap(self.path, mode="r" if self.read_only else "r+")
+            if self.table.dtype["pos"].shape != (dim,):
+                raise ValueError(f"Cache {self.path} holds {self.table.dtype['pos'].shape[0]}-dimensional points")
+            self.capacity = len(self.table)
+        elif self.read_only:
+            self.table = np.zeros(0, entry_dtype(dim))
+        else:
+            self.table = np.lib.format.open_memmap(self.path, "w+", entry_dtype(dim), (self.capacity,))
+        used = self.table["used"] > 0
+        slots = np.flatnonzero(used)
+        self.index = dict(zip(self.keys(self.table["fn"][slots], self.table["pos"][slots]), slots.tolist()))
+        self.free = np.flatnonzero(~used)[::-1].tolist()
+        self.clock = int(self.table["used"].max(initial=0)) + 1
+
+    def keys(self, fn_ids: np.ndarray | int, positions: np.ndarray) -> list[bytes]:
+        rows = np.empty((len(positions), 1 + positions.shape[1]), dtype=np.int64)
+        rows[:, 0] = fn_ids
+        rows[:, 1:] = np.ascontiguousarray(positions, dtype=np.float64).view(np.int64)
+        return [row.tobytes() for row in rows]
+
+    def evaluate(self, positions: np.ndarray, compute: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.float64)
+        if self.table is None:
+            self.open(positions.shape[1])
+        keys = self.keys(self.fn_id, positions)
+        slots = np.array([self.index.get(key, -1) for key in keys], dtype=np.int64)
+        hit = slots >= 0
+        if np.any(hit):
+            # Another process may have reused the slot since the index was built
+            entries = self.table[slots[hit]]
+            hit[hit] = (entries["fn"] == self.fn_id) & np.all(entries["pos"] == positions[hit], axis=1)
+        observer = current_observer()
+        if observer is not None:
+            hits = int(np.count_nonzero(hit))
+            observer.cache_accessed("evaluations", hits, len(hit) - hits)
+        vals = np.empty(len(positions), dtype=np.float64)
+        vals[hit] = self.table["val"][slots[hit]]
+        if self.writable and np.any(hit):
+            self.table["used"][slots[hit]] = self.clock
+            self.clock += 1
+        if not np.all(hit):
+            missing = ~hit
+            vals[missing] = compute(positions[missing])
+            if self.writable:
+                self.insert([key for key, miss in zip(keys, missing) if miss], positions[missing], vals[missing])
+        return vals
+
+    def insert(self, keys: list[bytes], positions: np.ndarray, vals: np.ndarray) -> None:
+        new = {key: i for i, key in enumerate(keys) if key not in self.index}
+        rows = list(new.values())[-self.capacity :]
+        if len(rows) > len(self.free):
+            self.evict(max(len(rows) - len(self.free), self.capacity // EVICT_FRACTION))
+        slots = [self.free.pop() for _ in rows]
+        self.table["fn"][slots] = self.fn_id
+        self.table["pos"][slots] = positions[rows]
+        self.table["val"][slots] = vals[rows]
+        self.table["used"][slots] = self.clock
+        self.clock += 1
+        self.index.update((keys[row], slot) for row, slot in zip(rows, slots))
+
+    def evict(self, count: int) -> None:
+        """Free the count least recently used slots"""
+        used = self.table["used"]
+        count = min(count, int(np.count_nonzero(used)))
+        if count == 0:
+            return
+        # Empty slots go last
+        slots = np.argpartition(np.where(used > 0, used, np.iinfo(np.int64).max), count - 1)[:count]
+        for key in self.keys(self.table["fn"][slots], self.table["pos"][slots]):
+            self.index.pop(key, None)
+        self.table["used"][slots] = 0
+        self.free.extend(slots.tolist())
+
+    def flush(self) -> None:
+        if self.writable and isinstance(self.table, np.memmap):
+            self.table.flush()
+
+
+def entry_dtype(dim: int) -> np.dtype:
+    # used is the clock value of the last use, or 0 for an empty slot
+    return np.dtype([("fn", np.int64), ("pos", np.float64, (dim,)), ("val", np.float64), ("used", np.int64)])
@@ -1,21 +1,25 @@
 # to support Cell type inside Cell
 from __future__ import annotations
 
+import heapq
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
 from collections import deque
 from dataclasses import dataclass
-from typing import Iterator
+from typing import Callable, Iterator, Literal, Sequence, Tuple
 
 import numpy as np
 
-from .point import Func, Point, ValuedPoint
+from .grid import prefetch_grid
+from .point import LATTICE_DEPTH, Func, LatticeKey, Point, ValuedPoint, VertexStore
 
-
-def vertices_from_extremes(dim: int, pmin: Point, pmax: Point, fn: Func) -> list[ValuedPoint]:
-    """Requires pmin.x ≤ pmax.x, pmin.y ≤ pmax.y"""
-    w = pmax - pmin
-    return [
-        ValuedPoint(np.array([pmin[d] + (i >> d & 1) * w[d] for d in range(dim)])).calc(fn) for i in range(1 << dim)
-    ]
+# - "breadth": split every cell that should be split, one depth at a time, until the budget runs out
+# - "priority": after min_depth, split the cells with the largest refinement_priorities first
+Refinement = Literal["breadth", "priority"]
+REFINEMENTS = ("breadth", "priority")
+# Takes the lower and upper corners (N, dim) of N boxes, and returns lower and upper bounds (N,) on the values of fn
+# within each box. NaN bounds mean that nothing is known
+BoundsFunc = Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]
 
 
 @dataclass
@@ -29,8 +33,8 @@ class MinimalCell:
         m = 1 << axis
         return MinimalCell(self.dim - 1, [v for i, v in enumerate(self.vertices) if (i & m > 0) == dir])
 
-    def get_dual(self, fn: Func) -> ValuedPoint:
-        return ValuedPoint.midpoint(self.vertices[0], self.vertices[-1], fn)
+    def get_dual(self, store: VertexStore) -> ValuedPoint:
+        return store.dual(self.vertices[0], self.vertices[-1])
 
 
 @dataclass
@@ -41,12 +45,12 @@ class Cell(MinimalCell):
     parent: Cell
     child_direction: int
 
-    def compute_children(self, fn: Func) -> None:
+    def compute_children(self, store: VertexStore, defer: bool = False) -> None:
+        """If defer is True, new vertices are not evaluated until store.flush()"""
         assert self.children == []
         for i, vertex in enumerate(self.vertices):
-            pmin = (self.vertices[0].pos + vertex.pos) / 2
-            pmax = (self.vertices[-1].pos + vertex.pos) / 2
-            vertices = vertices_from_extremes(self.dim, pmin, pmax, fn)
+            # Vertex j of child i is the midpoint of vertices i and j of the parent
+            vertices = [store.midpoint(vertex, other, defer) for other in self.vertices]
             new_quad = Cell(self.dim, vertices, self.depth + 1, [], self, i)
             self.children.append(new_quad)
 
@@ -92,12 +96,111 @@ class Cell(MinimalCell):
     def walk_leaves_in_direction(self, axis: int, dir: int) -> Iterator[Cell | None]:
         walked = self.walk_in_direction(axis, dir)
         if walked is not None:
-            yield from walked.get_leaves_in_direction(axis, dir)
+            # The leaves of walked that touch self are on its side facing back towards self
+            yield from walked.get_leaves_in_direction(axis, 1 - dir)
         else:
             yield None
 
+    def build_index(self) -> CellIndex:
+        """Index of all cells in the tree rooted at self"""
+        return CellIndex(self)
+
+    def get_coords(self) -> tuple[int, ...]:
+        """Integer coordinates of the cell among all cells of its depth"""
+        shift = LATTICE_DEPTH - self.depth
+        return tuple(k >> shift for k in self.vertices[0].key)
+
+
+class CellIndex:
+    """Hash of cells by their depth and integer coordinates, so that the cell across a face
+    can be found with a few lookups instead of walking up and down the tree"""
+
+    def __init__(self, root: Cell) -> None:
+        self.cells: dict[tuple[int, tuple[int, ...]], Cell] = {}
+        cells = [root]
+        while cells:
+            cell = cells.pop()
+            self.cells[cell.depth, cell.get_coords()] = cell
+            cells.extend(cell.children)
+
+    def find(self, depth: int, coords: tuple[int, ...]) -> Cell | None:
+        return self.cells.get((depth, coords))
+
+    def walk_in_direction(self, cell: Cell, axis: int, dir: int) -> Cell | None:
+        """Same as cell.walk_in_direction(axis, dir), with one lookup per level of difference in depth"""
+        coords = list(cell.get_coords())
+        coords[axis] += 1 if dir else -1
+        depth = cell.depth
+        if not 0 <= coords[axis] < 1 << depth:
+            # e.g. this is the rightmost cell with direction to the right
+            return None
+        while True:
+            found = self.find(depth, tuple(coords))
+            if found is not None:
+                return found
+            # The neighbour is larger, so look at the next depth up
+            depth -= 1
+            coords = [c >> 1 for c in coords]
+
+
+def iter_leaves(root: Cell) -> Iterator[Cell]:
+    """Leaves of the tree rooted at root, in depth-first order of children"""
+    cells = [root]
+    while cells:
+        cell = cells.pop()
+        if cell.children:
+            cells.extend(reversed(cell.children))
+        else:
+            yield cell
 
-def should_descend_deep_cell(cell: Cell, tol: np.ndarray) -> bool:
+
+def iter_adjacent_leaves(root: Cell) -> Iterator[tuple[Cell, Cell, int]]:
+    """Pairs (a, b, axis) of leaves of the tree rooted at root that share a (dim-1)-cell, where b is across the
+    side of a towards +axis. The pairs within each cell come after those within each of its children, in order,
+    followed by those crossing between its children, along each axis in turn.
+
+    Runs in a single loop over a stack of cells to look within (with b None) and of pairs of cells to look
+    between, so deep trees cost no recursion"""
+    dim = root.dim
+    # Children of a cell on the near (-axis) and far (+axis) sides of each axis, in the same order
+    near = [[i for i in range(1 << dim) if not i >> axis & 1] for axis in range(dim)]
+    far = [[i | 1 << axis for i in near[axis]] for axis in range(dim)]
+    # The stack is popped from the end, so everything is pushed in reverse
+    within = [(i, j, axis) for axis in range(dim) for i, j in zip(near[axis], far[axis])][::-1]
+    across = [list(zip(far[axis], near[axis]))[::-1] for axis in range(dim)]
+    near = [indices[::-1] for indices in near]
+    far = [indices[::-1] for indices in far]
+    stack: list[tuple[Cell, Cell | None, int]] = [(root, None, 0)]
+    push = stack.append
+    while stack:
+        a, b, axis = stack.pop()
+        if b is None:
+            children = a.children
+            if children:
+                for i, j, k in within:
+                    push((children[i], children[j], k))
+                for child in reversed(children):
+                    push((child, None, 0))
+        elif a.children:
+            if b.children:
+                for i, j in across[axis]:
+                    push((a.children[i], b.children[j], axis))
+            else:
+                for i in far[axis]:
+                    push((a.children[i], b, axis))
+        elif b.children:
+            for j in near[axis]:
+                push((a, b.children[j], axis))
+        else:
+            yield a, b, axis
+
+
+def should_descend_deep_cell(
+    cell: Cell, tol: np.ndarray, ranges: IntervalBounds | None = None, levels: Sequence[float] | None = None
+) -> bool:
+    """With ranges, cells with no sign change are also descended into if fn may still be 0 within them,
+    which finds components that fit between the vertices. With levels (sorted), cells are descended into
+    where fn crosses any of them instead of 0"""
     if np.all(cell.vertices[-1].pos - cell.vertices[0].pos < 10 * tol):
         # too small of a cell to be worth descending
         # We compare to 10*tol instead of tol because the simplices are smaller than the quads
@@ -111,9 +214,141 @@ def should_descend_deep_cell(cell: Cell, tol: np.ndarray) -> bool:
         return True
     else:
         # simple approach: only descend if we cross the isoline
-        # TODO: This could very much be improved, e.g. by incorporating gradient or second-derivative
-        # tests, etc., to cancel descending in approximately linear regions
+        # (should_split can additionally apply criteria to cancel descending in approximately linear regions)
+        return crosses_level(cell, levels) or (ranges is not None and ranges.may_contain_zero(cell))
+
+
+def crosses_level(cell: Cell, levels: Sequence[float] | None = None) -> bool:
+    """Whether the values at the vertices of cell (none of them NaN) are on different sides of 0, or of any of
+    levels (sorted) if given"""
+    if levels is None:
         return any(np.sign(v.val) != np.sign(cell.vertices[0].val) for v in cell.vertices[1:])
+    # Values on the same side of every level have the same numbers of levels below them, and at or below them
+    sides = {(bisect_left(levels, v.val), bisect_right(levels, v.val)) for v in cell.vertices}
+    return len(sides) > 1
+
+
+class IntervalBounds:
+    """Whether fn may be 0 within each cell, from bounds on its values over the cell (such as
+    CompiledExpression.bounds), kept by cell so that each cell is bounded once"""
+
+    def __init__(self, bounds: BoundsFunc) -> None:
+        self.bounds = bounds
+        self.ranges: dict[tuple[int, LatticeKey], tuple[float, float]] = {}
+
+    def prefetch(self, cells: list[Cell]) -> None:
+        """Bound all of cells together"""
+        cells = [cell for cell in cells if (cell.depth, cell.vertices[0].key) not in self.ranges]
+        if cells:
+            lo, hi = self.bounds(
+                np.array([cell.vertices[0].pos for cell in cells]), np.array([cell.vertices[-1].pos for cell in cells])
+            )
+            for cell, cell_lo, cell_hi in zip(cells, lo.tolist(), hi.tolist()):
+                self.ranges[cell.depth, cell.vertices[0].key] = (cell_lo, cell_hi)
+
+    def may_contain_zero(self, cell: Cell) -> bool:
+        key = (cell.depth, cell.vertices[0].key)
+        if key not in self.ranges:
+            self.prefetch([cell])
+        lo, hi = self.ranges[key]
+        # (Also True if either is NaN)
+        return not (lo > 0 or hi < 0)
+
+
+def make_ranges(bounds: BoundsFunc | None) -> IntervalBounds | None:
+    return None if bounds is None else IntervalBounds(bounds)
+
+
+class RefinementCriterion(ABC):
+    """Extra test for whether to split a cell that should_descend_deep_cell would split.
+    See the criteria module for the built-in tests"""
+
+    def prefetch(self, cells: list[Cell], store: VertexStore) -> None:
+        """Evaluate any points that is_flat will need for cells, all together.
+        Called before is_flat by the builders that evaluate points in batches"""
+
+    @abstractmethod
+    def is_flat(self, cell: Cell, store: VertexStore) -> bool:
+        """Whether fn is simple enough within cell that splitting it would not improve the result"""
+
+
+def should_split(
+    cell: Cell,
+    min_depth: int,
+    tol: np.ndarray,
+    store: VertexStore | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    ranges: IntervalBounds | None = None,
+    levels: Sequence[float] | None = None,
+) -> bool:
+    """If there are any criteria, a cell past min_depth is not split when all of them find it flat.
+    With ranges, a cell where fn cannot be 0 is never split, even before min_depth.
+    levels are passed on to should_descend_deep_cell"""
+    if cell.depth >= LATTICE_DEPTH - 1:
+        # the duals of the children would not lie on the lattice
+        return False
+    if ranges is not None and not ranges.may_contain_zero(cell):
+        return False
+    if cell.depth < min_depth:
+        return True
+    if not should_descend_deep_cell(cell, tol, ranges, levels):
+        return False
+    if not criteria or any(np.isnan(v.val) for v in cell.vertices):
+        return True
+    return not all(criterion.is_flat(cell, store) for criterion in criteria)
+
+
+def prefetch_criteria(
+    cells: list[Cell],
+    store: VertexStore,
+    min_depth: int,
+    tol: np.ndarray,
+    criteria: Sequence[RefinementCriterion],
+    ranges: IntervalBounds | None = None,
+    levels: Sequence[float] | None = None,
+) -> None:
+    """Bound all cells with ranges, and let each criterion evaluate what it needs for the cells that should_split
+    would ask it about"""
+    if ranges is not None:
+        ranges.prefetch(cells)
+    if criteria:
+        cells = [
+            cell for cell in cells if cell.depth >= min_depth and should_descend_deep_cell(cell, tol, ranges, levels)
+        ]
+        for criterion in criteria:
+            criterion.prefetch(cells, store)
+
+
+def center_deviation(cell: Cell, center: ValuedPoint) -> float:
+    """How far fn is from multilinear across cell, from 0 to 1.
+
+    The value at the center of the cell is compared to the average of its vertices (the multilinear
+    interpolation of the vertices at the center), and the difference is converted to a distance relative
+    to the size of the cell, using the gradient across the cell. Distances beyond the cell count as 1"""
+    width = cell.vertices[-1].pos - cell.vertices[0].pos
+    vals = np.array([v.val for v in cell.vertices], dtype=np.float64)
+    if np.isnan(center.val) or np.any(np.isnan(vals)):
+        return 1.0
+    # Average difference along the edges parallel to each axis
+    diffs = [np.mean([vals[i | 1 << d] - vals[i] for i in range(len(vals)) if not i >> d & 1]) for d in range(cell.dim)]
+    slope = np.linalg.norm(np.array(diffs) / width)
+    deviation = abs(center.val - np.mean(vals))
+    # e.g. where the gradient vanishes
+    if deviation >= slope * np.max(width):
+        return 1.0
+    return float(deviation / (slope * np.max(width)))
+
+
+def tree_store(root: Cell, fn: Func) -> VertexStore:
+    """Returns a VertexStore containing all of the vertices of a tree"""
+    store = VertexStore(fn, root.vertices[0].pos, root.vertices[-1].pos)
+    cells = [root]
+    while cells:
+        cell = cells.pop()
+        for v in cell.vertices:
+            store.points.setdefault(v.key, v)
+        cells.extend(cell.children)
+    return store
 
 
 def build_tree(
@@ -124,21 +359,207 @@ def build_tree(
     min_depth: int,
     max_cells: int,
     tol: np.ndarray,
+    vectorized: bool = False,
+    store: VertexStore | None = None,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    bounds: BoundsFunc | None = None,
+    levels: Sequence[float] | None = None,
 ) -> Cell:
+    """If vectorized is True, then fn should be a BatchFunc, taking an (N, dim) array of points
+    and returning the N values.
+
+    Vertices are taken from store (a fresh VertexStore by default), so each one is evaluated only once.
+    If store.batched, the tree is refined one level at a time, with all new vertices of a level being
+    evaluated together.
+
+    refinement selects the order in which cells are split (see Refinement). With "priority", max_evals
+    additionally limits the number of vertices evaluated. criteria can stop the splitting of cells where fn
+    is already simple enough (see should_split). bounds (see BoundsFunc) skips cells where fn cannot be 0, even
+    before min_depth, and splits cells where it can be 0 even without a sign change at the vertices.
+    With levels, cells are split where fn crosses any of them instead of 0 (see plot_contours)"""
+    if refinement not in REFINEMENTS:
+        raise ValueError(f"Unknown refinement {refinement!r}, expected one of {REFINEMENTS}")
+    if levels is not None:
+        levels = sorted(levels)
+    if store is None:
+        store = VertexStore(fn, pmin, pmax, vectorized)
+    if refinement == "priority":
+        return build_tree_prioritized(dim, store, min_depth, max_cells, tol, max_evals, criteria, bounds, levels)
+    if max_evals is not None:
+        raise ValueError("max_evals requires refinement='priority'")
+    if store.batched:
+        return build_tree_batched(dim, store, min_depth, max_cells, tol, criteria, bounds, levels)
     branching_factor = 1 << dim
     # min_depth takes precedence over max_quads
     max_cells = max(branching_factor**min_depth, max_cells)
-    vertices = vertices_from_extremes(dim, pmin, pmax, fn)
+    vertices = store.root_vertices()
     # root's childDirection is 0, even though none is reasonable
     current_quad = root = Cell(dim, vertices, 0, [], None, 0)
     quad_queue = deque([root])
     leaf_count = 1
+    ranges = make_ranges(bounds)
 
     while len(quad_queue) > 0 and leaf_count < max_cells:
         current_quad = quad_queue.popleft()
-        if current_quad.depth < min_depth or should_descend_deep_cell(current_quad, tol):
-            current_quad.compute_children(fn)
+        if should_split(current_quad, min_depth, tol, store, criteria, ranges, levels):
+            current_quad.compute_children(store)
             quad_queue.extend(current_quad.children)
             # add 4 for the new quads, subtract 1 for the old quad not being a leaf anymore
             leaf_count += branching_factor - 1
     return root
+
+
+def build_tree_batched(
+    dim: int,
+    store: VertexStore,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    criteria: Sequence[RefinementCriterion] = (),
+    bounds: BoundsFunc | None = None,
+    levels: Sequence[float] | None = None,
+) -> Cell:
+    """Same tree as build_tree, but refined one whole breadth-first level at a time (see refine_tree).
+    Without bounds, all cells are split down to min_depth, so their vertices are evaluated together first
+    (see prefetch_grid)"""
+    if bounds is None:
+        prefetch_grid(store, min(min_depth, LATTICE_DEPTH - 1))
+    vertices = store.root_vertices(defer=True)
+    store.flush()
+    root = Cell(dim, vertices, 0, [], None, 0)
+    refine_tree(root, store, min_depth, max_cells, tol, criteria, bounds, levels)
+    return root
+
+
+def refine_tree(
+    root: Cell,
+    store: VertexStore,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    criteria: Sequence[RefinementCriterion] = (),
+    bounds: BoundsFunc | None = None,
+    levels: Sequence[float] | None = None,
+) -> None:
+    """Split and merge the cells under root into the tree that build_tree would build from its vertices,
+    refining one whole breadth-first level (frontier) at a time.
+
+    The breadth-first queue of build_tree visits all cells of one depth before any cell of the next depth,
+    and whether a cell is split only depends on its own vertices, so deferring the evaluation of a level's
+    new vertices until the end of that level does not change the resulting tree.
+
+    Cells that already have children keep them (and their vertices) if they should still be split, so
+    after the values of the vertices under root change, only the cells whose splits changed do any work"""
+    branching_factor = 1 << root.dim
+    max_cells = max(branching_factor ** max(min_depth - root.depth, 0), max_cells)
+    frontier = [root]
+    leaf_count = 1
+    ranges = make_ranges(bounds)
+
+    while len(frontier) > 0 and leaf_count < max_cells:
+        next_frontier: list[Cell] = []
+        prefetch_criteria(frontier, store, min_depth, tol, criteria, ranges, levels)
+        for cell in frontier:
+            if leaf_count < max_cells and should_split(cell, min_depth, tol, store, criteria, ranges, levels):
+                if not cell.children:
+                    cell.compute_children(store, defer=True)
+                next_frontier.extend(cell.children)
+                leaf_count += branching_factor - 1
+            else:
+                cell.children = []
+        store.flush()
+        frontier = next_frontier
+    # Out of budget
+    for cell in frontier:
+        cell.children = []
+
+
+def build_tree_prioritized(
+    dim: int,
+    store: VertexStore,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    bounds: BoundsFunc | None = None,
+    levels: Sequence[float] | None = None,
+) -> Cell:
+    """Same cells down to min_depth as build_tree, but then split the cells with the largest refinement_priority
+    first, until there are max_cells leaves or the next split would evaluate more than max_evals points in total.
+
+    With a tight budget, this spends it where the function bends instead of wherever breadth-first order
+    happens to get to first"""
+    branching_factor = 1 << dim
+    max_cells = max(branching_factor**min_depth, max_cells)
+    defer = store.batched
+    ranges = make_ranges(bounds)
+    if defer and ranges is None:
+        prefetch_grid(store, min(min_depth, LATTICE_DEPTH - 1))
+    root = Cell(dim, store.root_vertices(defer), 0, [], None, 0)
+    store.flush()
+    leaves = [root]
+    leaf_count = 1
+    # min_depth takes precedence over both budgets
+    for _ in range(min(min_depth, LATTICE_DEPTH - 1)):
+        if ranges is not None:
+            ranges.prefetch(leaves)
+        split = [cell for cell in leaves if ranges is None or ranges.may_contain_zero(cell)]
+        for cell in split:
+            cell.compute_children(store, defer)
+        store.flush()
+        leaf_count += len(split) * (branching_factor - 1)
+        leaves = [child for cell in split for child in cell.children]
+    # Entries are (-priority, tiebreak, cell), with the tiebreak keeping the order deterministic
+    heap: list[tuple[float, int, Cell]] = []
+    tiebreak = 0
+
+    def push(cells: list[Cell]) -> None:
+        nonlocal tiebreak
+        prefetch_criteria(cells, store, min_depth, tol, criteria, ranges, levels)
+        cells = [cell for cell in cells if should_split(cell, min_depth, tol, store, criteria, ranges, levels)]
+        for cell, priority in zip(cells, refinement_priorities(cells, store, tol)):
+            heapq.heappush(heap, (-priority, tiebreak, cell))
+            tiebreak += 1
+
+    if max_evals is None or len(store.points) + len(leaves) <= max_evals:
+        push(leaves)
+    while len(heap) > 0 and leaf_count < max_cells:
+        _, _, cell = heapq.heappop(heap)
+        if max_evals is not None and len(store.points) + count_new_vertices(cell, store) > max_evals:
+            break
+        cell.compute_children(store, defer)
+        store.flush()
+        leaf_count += branching_factor - 1
+        push(cell.children)
+    return root
+
+
+def refinement_priorities(cells: list[Cell], store: VertexStore, tol: np.ndarray) -> list[float]:
+    """How much splitting each cell is expected to help, for build_tree_prioritized.
+
+    This is the size of the cell (in multiples of tol), scaled by 1 + center_deviation, so a strongly
+    curved cell goes ahead of flat cells up to twice its size.
+
+    The centers are vertices of the children, and otherwise the duals of the cells, so evaluating them
+    is not wasted"""
+    centers = [store.midpoint(cell.vertices[0], cell.vertices[-1], store.batched) for cell in cells]
+    store.flush()
+    return [
+        float(np.max((cell.vertices[-1].pos - cell.vertices[0].pos) / tol)) * (1 + center_deviation(cell, center))
+        for cell, center in zip(cells, centers)
+    ]
+
+
+def count_new_vertices(cell: Cell, store: VertexStore) -> int:
+    """Upper bound on the number of points that splitting cell would add to store, including the centers
+    of the children evaluated by refinement_priorities"""
+    keys = {tuple((a + b) >> 1 for a, b in zip(v.key, w.key)) for v in cell.vertices for w in cell.vertices}
+    corner = cell.vertices[0].key
+    size = cell.vertices[-1].key[0] - corner[0]
+    for i in range(1 << cell.dim):
+        # Center of child i
+        keys.add(tuple(c + (2 * (i >> d & 1) + 1) * size // 4 for d, c in enumerate(corner)))
+    return sum(store.find(key) is None for key in keys)
@@ -0,0 +1,147 @@
+"""Contour maps: the isolines of one function at many levels, all traced over the same quadtree."""
+
+from __future__ import annotations
+
+from typing import Callable, Sequence
+
+import numpy as np
+
+from .cache import ValueCache
+from .cell import Cell, Refinement, RefinementCriterion, build_tree
+from .isoline import EDGE_DUAL_STEP, CurveTracer, Triangulator
+from .point import Func, Point, ValuedPoint, VertexStore
+from .roots import RootMethod
+from .stats import current_observer, evaluating, report_tree, stage
+
+
+class LevelCache(ValueCache):
+    """Values of fn kept in memory by position, returned minus level, so that stores for different levels
+    (see at_level) evaluate fn only once at each position they share, such as the duals of the quadtree"""
+
+    def __init__(self, level: float = 0.0, values: dict[bytes, float] | None = None) -> None:
+        self.level = level
+        self.values: dict[bytes, float] = {} if values is None else values
+
+    def at_level(self, level: float) -> LevelCache:
+        """A cache for level holding the same values as this one"""
+        return LevelCache(level, self.values)
+
+    def evaluate(self, positions: np.ndarray, compute: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        keys = [row.tobytes() for row in positions]
+        found = [self.values.get(key) for key in keys]
+        missing = [i for i, val in enumerate(found) if val is None]
+        observer = current_observer()
+        if observer is not None:
+            observer.cache_accessed("evaluations", len(keys) - len(missing), len(missing))
+        vals = np.array([np.nan if val is None else val for val in found], dtype=np.float64)
+        if missing:
+            vals[missing] = compute(positions[missing])
+            self.values.update((keys[i], float(vals[i])) for i in missing)
+        return vals - self.level
+
+
+def plot_contours(
+    fn: Func,
+    levels: Sequence[float],
+    pmin: Point,
+    pmax: Point,
+    min_depth: int = 5,
+    max_quads: int = 10000,
+    tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    root_method: RootMethod = "bisect",
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+) -> list[list[list[Point]]]:
+    """Get the curves of fn([x,y])=level for each of levels, in the same order, as lists of curves like those
+    returned by plot_isoline.
+
+    A single quadtree is built for all levels, split where fn crosses any of them, so max_quads is shared by
+    all levels. fn is evaluated once at each vertex of the quadtree and at each dual; only the search for the
+    curve along the edges it crosses is done per level. The other arguments have the same meaning as for
+    plot_isoline"""
+    pmin = np.asarray(pmin)
+    pmax = np.asarray(pmax)
+    tol = (pmax - pmin) / 1000 if tol is None else np.asarray(tol)
+    cache = LevelCache()
+    store = VertexStore(fn, pmin, pmax, vectorized, cache=cache)
+    with stage("tree"):
+        quadtree = build_tree(
+            2,
+            fn,
+            pmin,
+            pmax,
+            min_depth,
+            max_quads,
+            tol,
+            vectorized,
+            store,
+            refinement,
+            max_evals,
+            criteria,
+            levels=levels,
+        )
+    report_tree(quadtree)
+    pairs = list(Triangulator(quadtree, store.fn, tol, store, root_method, crossing_only=True).get_pairs())
+    with stage("duals"):
+        corners, midpoints, probes = pair_values(store, pairs)
+    points = store.points
+    vals = [(point, point.val) for point in points.values()]
+    contours = []
+    for level in levels:
+        # The vertices are shared by the stores of all levels, and hold the values of the current one
+        for point, val in vals:
+            point.val = val - level
+        level_store = VertexStore(fn, pmin, pmax, vectorized, cache=cache.at_level(level))
+        level_store.points = dict(points)
+        crossing = crossing_pairs(level, corners, midpoints, probes)
+        with stage("triangulate"):
+            triangles = Triangulator(
+                quadtree, level_store.fn, tol, level_store, root_method, crossing_only=True
+            ).triangulate(pair for pair, keep in zip(pairs, crossing) if keep)
+        with stage("trace"):
+            contours.append(CurveTracer(triangles, level_store.fn, tol).trace())
+    return contours
+
+
+def pair_values(
+    store: VertexStore, pairs: list[tuple[Cell, Cell, ValuedPoint, ValuedPoint]]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Values of fn for each pair (a, b, p1, p2) of Triangulator.get_pairs that do not depend on the level:
+    at p1, p2 and the duals of a and b (N, 4), at the midpoint of p1--p2 (N,), and at the points next to p1 and
+    p2 where Triangulator.compute_edge_dual estimates the slope of fn along p1--p2 (N, 2)"""
+    if not pairs:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros((0, 2))
+    position = store.position
+    midpoint_key = store.midpoint_key
+    pos1 = np.array([p1.pos for _, _, p1, _ in pairs])
+    pos2 = np.array([p2.pos for _, _, _, p2 in pairs])
+    dt = EDGE_DUAL_STEP
+    with evaluating("dual"):
+        duals = store.evaluate(
+            np.array(
+                [position(midpoint_key(c.vertices[0], c.vertices[-1])) for a, b, _, _ in pairs for c in (a, b)]
+                + [position(midpoint_key(p1, p2)) for _, _, p1, p2 in pairs]
+            )
+        )
+    with evaluating("edge_dual"):
+        probes = store.evaluate(np.concatenate([pos1 * (1 - dt) + pos2 * dt, pos1 * dt + pos2 * (1 - dt)]))
+    corners = np.empty((len(pairs), 4))
+    corners[:, 0] = [p1.val for _, _, p1, _ in pairs]
+    corners[:, 1] = [p2.val for _, _, _, p2 in pairs]
+    corners[:, 2:] = duals[: 2 * len(pairs)].reshape(-1, 2)
+    return corners, duals[2 * len(pairs) :], np.stack(np.split(probes, 2), axis=1)
+
+
+def crossing_pairs(level: float, corners: np.ndarray, midpoints: np.ndarray, probes: np.ndarray) -> np.ndarray:
+    """Which of the pairs with pair_values (corners, midpoints, probes) Triangulator.add_pair does not skip at
+    level: those with triangles on both sides of it"""
+    # (Group level with values below it, as NaN compares false)
+    above = corners > level
+    all_above = np.all(above, axis=1)
+    one_side = all_above | ~np.any(above, axis=1)
+    # p1 and p2 are on the same side, so the edge dual is the midpoint unless it is a lerp between the probes
+    lerp = (probes[:, 0] > level) != (probes[:, 1] > level)
+    return ~one_side | lerp | ((midpoints > level) != all_above)
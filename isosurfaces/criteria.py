@@ -0,0 +1,54 @@
+"""Built-in RefinementCriterion tests, to stop splitting cells in which the isoline is already simple.
+
+Pass them as criteria to the plotting functions. With several criteria, a cell is only left unsplit
+when all of them find it flat."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from .cell import Cell, RefinementCriterion, center_deviation
+from .point import Point, VertexStore
+
+
+@dataclass
+class LinearityTest(RefinementCriterion):
+    """Flat when fn at the center of the cell (its dual) is within threshold of the multilinear interpolation
+    of its vertices, measured as a distance relative to the size of the cell (see center_deviation).
+
+    The center is evaluated with the store, so it is shared with the children or the dual of the cell"""
+
+    threshold: float = 0.02
+
+    def prefetch(self, cells: list[Cell], store: VertexStore) -> None:
+        for cell in cells:
+            store.midpoint(cell.vertices[0], cell.vertices[-1], defer=True)
+        store.flush()
+
+    def is_flat(self, cell: Cell, store: VertexStore) -> bool:
+        center = store.midpoint(cell.vertices[0], cell.vertices[-1])
+        return center_deviation(cell, center) <= self.threshold
+
+
+@dataclass
+class GradientTest(RefinementCriterion):
+    """Flat when the gradients at all vertices of the cell point within max_angle (in radians) of their average.
+
+    gradient takes a point and returns the gradient of fn there, as an array of the same shape"""
+
+    gradient: Callable[[Point], np.ndarray]
+    max_angle: float = 0.1
+
+    def is_flat(self, cell: Cell, store: VertexStore) -> bool:
+        grads = np.array([self.gradient(v.pos) for v in cell.vertices], dtype=np.float64)
+        norms = np.linalg.norm(grads, axis=1)
+        if not np.all(norms > 0):
+            # The direction of the isoline is unknown
+            return False
+        units = grads / norms[:, np.newaxis]
+        mean = units.mean(axis=0)
+        length = np.linalg.norm(mean)
+        return bool(length > 0 and np.all(units @ mean >= length * np.cos(self.max_angle)))
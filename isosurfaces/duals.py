@@ -0,0 +1,140 @@
+"""Placing dual points using the gradient, instead of at the centers of cells.
+
+Based on the dual vertex placement of Manson and Schaefer's "Isosurfaces over simplicial partitions
+of multiresolution grids" (see Triangulator)."""
+
+from __future__ import annotations
+
+from typing import Callable, Literal
+
+import numpy as np
+
+from .cell import Cell, MinimalCell
+from .point import LatticeKey, Point, ValuedPoint, VertexStore
+from .stats import evaluating
+
+# - "midpoint": the center of each cell, face, and edge
+# - "qef": the minimizer of a quadratic error function built from the gradients (see QEFDuals)
+DualPlacement = Literal["midpoint", "qef"]
+DUAL_PLACEMENTS = ("midpoint", "qef")
+# Singular values of a QEF below this fraction of the largest are treated as 0, as in dual contouring
+QEF_CUTOFF = 0.1
+
+
+def central_differences(store: VertexStore, positions: np.ndarray, tol: np.ndarray) -> np.ndarray:
+    """Gradients (N, dim) of the store's function at positions (N, dim), from central differences
+    with a step of tol along each axis, all evaluated together"""
+    n, dim = positions.shape
+    offsets = np.concatenate([np.diag(tol), -np.diag(tol)])
+    with evaluating("gradient"):
+        vals = store.evaluate((positions[:, np.newaxis, :] + offsets).reshape(-1, dim)).reshape(n, 2 * dim)
+    return (vals[:, :dim] - vals[:, dim:]) / (2 * tol)
+
+
+class QEFDuals:
+    """Dual points minimizing a quadratic error function (QEF) built from the gradients at the vertices of a cell.
+
+    Each vertex p defines the tangent w = f(p) + ∇f(p)·(x - p) to the graph of fn, and the dual point is the
+    x within the cell where these tangents come closest to meeting, taking the least-squares solution nearest
+    the center where they are (nearly) parallel. This moves duals onto sharp features such as corners, which
+    midpoints only approach as cells get small. Duals that would land outside of their cell fall back to the
+    midpoint, so the simplices stay valid.
+
+    Gradients come from gradient if given (called like fn, so on an (N, dim) array if vectorized),
+    and otherwise from central_differences"""
+
+    def __init__(
+        self,
+        store: VertexStore,
+        tol: np.ndarray,
+        gradient: Callable[[Point], np.ndarray] | None = None,
+        vectorized: bool = False,
+    ) -> None:
+        self.store = store
+        self.tol = tol
+        self.gradient = gradient
+        self.vectorized = vectorized
+        self.gradients: dict[LatticeKey, np.ndarray] = {}
+
+    def prefetch(self, root: Cell) -> None:
+        """Compute the gradients at all vertices of the leaves under root together"""
+        points: dict[LatticeKey, ValuedPoint] = {}
+        cells = [root]
+        while cells:
+            cell = cells.pop()
+            if cell.children:
+                cells.extend(cell.children)
+            else:
+                for v in cell.vertices:
+                    points.setdefault(v.key, v)
+        self.compute_gradients([p for key, p in points.items() if key not in self.gradients])
+
+    def compute_gradients(self, points: list[ValuedPoint]) -> None:
+        if not points:
+            return
+        positions = np.array([p.pos for p in points], dtype=np.float64)
+        if self.gradient is None:
+            grads = central_differences(self.store, positions, self.tol)
+        elif self.vectorized:
+            grads = np.asarray(self.gradient(positions), dtype=np.float64)
+        else:
+            grads = np.array([self.gradient(pos) for pos in positions], dtype=np.float64)
+        for point, grad in zip(points, grads):
+            self.gradients[point.key] = grad
+
+    def dual(self, cell: MinimalCell) -> ValuedPoint:
+        # Unlike lattice keys, this has 2 * dim entries, so it identifies the cell without clashing with them
+        key = cell.vertices[0].key + cell.vertices[-1].key
+        return self.store.cached_dual(key, lambda: self.compute_dual(cell, key))
+
+    def compute_dual(self, cell: MinimalCell, key: tuple[int, ...]) -> ValuedPoint:
+        first, last = cell.vertices[0], cell.vertices[-1]
+        self.compute_gradients([v for v in cell.vertices if v.key not in self.gradients])
+        # Work in coordinates u from 0 to 1 along each axis of the cell (a face or edge spans fewer axes)
+        width = last.pos - first.pos
+        axes = np.nonzero(width)[0]
+        us = np.array([(v.pos[axes] - first.pos[axes]) / width[axes] for v in cell.vertices])
+        grads = np.array([self.gradients[v.key][axes] * width[axes] for v in cell.vertices])
+        vals = np.array([v.val for v in cell.vertices], dtype=np.float64)
+        if not (np.all(np.isfinite(grads)) and np.all(np.isfinite(vals))):
+            return self.store.dual(first, last)
+        # Scale values to be comparable to u, so the cutoff treats both alike
+        scale = np.max(np.abs(grads))
+        if scale == 0:
+            return self.store.dual(first, last)
+        grads /= scale
+        vals /= scale
+        # Unknowns (u, w), with one row per tangent: ∇f·u - w = ∇f·u_i - f_i
+        a = np.hstack([grads, -np.ones((len(vals), 1))])
+        b = np.sum(grads * us, axis=1) - vals
+        center = np.append(np.full(len(axes), 0.5), vals.mean())
+        left, singular, right = np.linalg.svd(a, full_matrices=False)
+        inverse = np.zeros_like(singular)
+        kept = singular > QEF_CUTOFF * singular[0]
+        inverse[kept] = 1 / singular[kept]
+        u = (center + right.T @ (inverse * (left.T @ (b - a @ center))))[: len(axes)]
+        if not np.all((u > 0) & (u < 1)):
+            return self.store.dual(first, last)
+        pos = first.pos.copy()
+        pos[axes] += u * width[axes]
+        return ValuedPoint(pos, None, key).calc(self.store.fn)
+
+
+def make_duals(
+    root: Cell,
+    store: VertexStore,
+    tol: np.ndarray,
+    placement: DualPlacement,
+    gradient: Callable[[Point], np.ndarray] | None,
+    vectorized: bool,
+) -> QEFDuals | None:
+    """QEFDuals for the tree under root with its gradients prefetched, or None for midpoints"""
+    if placement not in DUAL_PLACEMENTS:
+        raise ValueError(f"Unknown dual placement {placement!r}, expected one of {DUAL_PLACEMENTS}")
+    if placement == "midpoint":
+        if gradient is not None:
+            raise ValueError("gradient requires dual_placement='qef'")
+        return None
+    duals = QEFDuals(store, tol, gradient, vectorized)
+    duals.prefetch(root)
+    return duals
@@ -0,0 +1,391 @@
+"""Compiling algebraic expressions, given as strings or SymPy expressions, into vectorized functions.
+
+An expression such as "y * (x - y) ** 2 - 4 * x - 8" is parsed (with Python's syntax) into a small tree,
+differentiated symbolically, and turned into the source of a kernel that evaluates a whole (N, dim) array
+of points with NumPy, or one point at a time in a loop compiled by Numba, if it is installed."""
+
+from __future__ import annotations
+
+import ast
+import importlib.util
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Literal, Sequence, Union
+
+import numpy as np
+
+from . import interval
+from .cell import BoundsFunc
+from .point import Point
+
+# - "numpy": array operations over all points at once
+# - "numba": a loop over the points, compiled by numba.njit (parallel over the points)
+Backend = Literal["numpy", "numba"]
+BACKENDS = ("numpy", "numba")
+
+# Functions that may be called in expressions, by name (including the names SymPy prints), as the name
+# of the NumPy function that computes them
+FUNCTIONS = {
+    "sin": "sin",
+    "cos": "cos",
+    "tan": "tan",
+    "asin": "arcsin",
+    "arcsin": "arcsin",
+    "acos": "arccos",
+    "arccos": "arccos",
+    "atan": "arctan",
+    "arctan": "arctan",
+    "atan2": "arctan2",
+    "arctan2": "arctan2",
+    "sinh": "sinh",
+    "cosh": "cosh",
+    "tanh": "tanh",
+    "exp": "exp",
+    "log": "log",
+    "log10": "log10",
+    "sqrt": "sqrt",
+    "abs": "abs",
+    "Abs": "abs",
+    "sign": "sign",
+    "floor": "floor",
+    "ceil": "ceil",
+    "ceiling": "ceil",
+    "min": "minimum",
+    "Min": "minimum",
+    "max": "maximum",
+    "Max": "maximum",
+}
+CONSTANTS = {"pi": math.pi, "e": math.e, "E": math.e}
+BINARY_OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.Pow: "**"}
+
+
+@dataclass(frozen=True)
+class Num:
+    value: float
+
+
+@dataclass(frozen=True)
+class Var:
+    # Column of the variable in the (N, dim) array of points
+    index: int
+
+
+@dataclass(frozen=True)
+class Op:
+    # One of "+", "-", "*", "/", "**", or "neg" (with a single argument)
+    op: str
+    args: tuple[Expr, ...]
+
+
+@dataclass(frozen=True)
+class Call:
+    # Name of the NumPy function, from FUNCTIONS
+    name: str
+    args: tuple[Expr, ...]
+
+
+@dataclass(frozen=True)
+class Where:
+    """Value of when_less where left < right, and of otherwise elsewhere, for the derivatives of min and max"""
+
+    left: Expr
+    right: Expr
+    when_less: Expr
+    otherwise: Expr
+
+
+Expr = Union[Num, Var, Op, Call, Where]
+ZERO = Num(0.0)
+ONE = Num(1.0)
+
+
+def parse_expression(expression: str, variables: Sequence[str]) -> Expr:
+    """Parse expression, written with Python's syntax (so ** for powers), into an Expr over variables"""
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Could not parse expression {expression!r}: {e.msg}") from None
+    return convert_node(tree.body, list(variables))
+
+
+def convert_node(node: ast.AST, variables: list[str]) -> Expr:
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return Num(float(node.value))
+    if isinstance(node, ast.Name):
+        if node.id in variables:
+            return Var(variables.index(node.id))
+        if node.id in CONSTANTS:
+            return Num(CONSTANTS[node.id])
+        raise ValueError(f"Unknown name {node.id!r}, expected one of the variables {variables} or a constant")
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = convert_node(node.operand, variables)
+        return negate(operand) if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return Op(
+            BINARY_OPERATORS[type(node.op)], (convert_node(node.left, variables), convert_node(node.right, variables))
+        )
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        if node.func.id not in FUNCTIONS:
+            raise ValueError(f"Unknown function {node.func.id!r}")
+        name = FUNCTIONS[node.func.id]
+        args = tuple(convert_node(arg, variables) for arg in node.args)
+        arity = 2 if name in ("arctan2", "minimum", "maximum") else 1
+        if len(args) != arity:
+            raise ValueError(f"{node.func.id} takes {arity} argument{'s' * (arity > 1)}, not {len(args)}")
+        return Call(name, args)
+    raise ValueError(f"Unsupported syntax in expression: {type(node).__name__}")
+
+
+# Constructors that fold constants and identities, to keep derivatives short
+
+
+def add(a: Expr, b: Expr) -> Expr:
+    if a == ZERO:
+        return b
+    if b == ZERO:
+        return a
+    if isinstance(a, Num) and isinstance(b, Num):
+        return Num(a.value + b.value)
+    return Op("+", (a, b))
+
+
+def subtract(a: Expr, b: Expr) -> Expr:
+    if b == ZERO:
+        return a
+    if a == ZERO:
+        return negate(b)
+    if isinstance(a, Num) and isinstance(b, Num):
+        return Num(a.value - b.value)
+    return Op("-", (a, b))
+
+
+def multiply(a: Expr, b: Expr) -> Expr:
+    if a == ZERO or b == ZERO:
+        return ZERO
+    if a == ONE:
+        return b
+    if b == ONE:
+        return a
+    if isinstance(a, Num) and isinstance(b, Num):
+        return Num(a.value * b.value)
+    if b == Num(-1.0):
+        return negate(a)
+    return Op("*", (a, b))
+
+
+def divide(a: Expr, b: Expr) -> Expr:
+    if a == ZERO:
+        return ZERO
+    if b == ONE:
+        return a
+    return Op("/", (a, b))
+
+
+def power(a: Expr, b: Expr) -> Expr:
+    if b == ZERO:
+        return ONE
+    if b == ONE:
+        return a
+    return Op("**", (a, b))
+
+
+def negate(a: Expr) -> Expr:
+    if isinstance(a, Num):
+        return Num(-a.value)
+    if isinstance(a, Op) and a.op == "neg":
+        return a.args[0]
+    return Op("neg", (a,))
+
+
+def differentiate(expr: Expr, index: int) -> Expr:
+    """Partial derivative of expr with respect to variable index"""
+    if isinstance(expr, Num):
+        return ZERO
+    if isinstance(expr, Var):
+        return ONE if expr.index == index else ZERO
+    if isinstance(expr, Where):
+        return Where(expr.left, expr.right, differentiate(expr.when_less, index), differentiate(expr.otherwise, index))
+    args = expr.args
+    ds = [differentiate(arg, index) for arg in args]
+    if isinstance(expr, Op):
+        if expr.op == "neg":
+            return negate(ds[0])
+        a, b = args
+        da, db = ds
+        if expr.op == "+":
+            return add(da, db)
+        if expr.op == "-":
+            return subtract(da, db)
+        if expr.op == "*":
+            return add(multiply(da, b), multiply(a, db))
+        if expr.op == "/":
+            return divide(subtract(multiply(da, b), multiply(a, db)), power(b, Num(2.0)))
+        if isinstance(b, Num):
+            # a ** c
+            return multiply(multiply(b, power(a, Num(b.value - 1))), da)
+        # a ** b = exp(b log(a))
+        return multiply(expr, add(multiply(db, Call("log", (a,))), divide(multiply(b, da), a)))
+    a = args[0]
+    da = ds[0]
+    if expr.name == "arctan2":
+        # atan2(y, x)
+        y, x = args
+        dy, dx = ds
+        return divide(subtract(multiply(x, dy), multiply(y, dx)), add(power(x, Num(2.0)), power(y, Num(2.0))))
+    if expr.name in ("minimum", "maximum"):
+        b, db = args[1], ds[1]
+        return Where(a, b, da, db) if expr.name == "minimum" else Where(a, b, db, da)
+    if da == ZERO:
+        return ZERO
+    square = power(a, Num(2.0))
+    outer = {
+        "sin": lambda: Call("cos", (a,)),
+        "cos": lambda: negate(Call("sin", (a,))),
+        "tan": lambda: divide(ONE, power(Call("cos", (a,)), Num(2.0))),
+        "arcsin": lambda: divide(ONE, Call("sqrt", (subtract(ONE, square),))),
+        "arccos": lambda: negate(divide(ONE, Call("sqrt", (subtract(ONE, square),)))),
+        "arctan": lambda: divide(ONE, add(ONE, square)),
+        "sinh": lambda: Call("cosh", (a,)),
+        "cosh": lambda: Call("sinh", (a,)),
+        "tanh": lambda: subtract(ONE, power(expr, Num(2.0))),
+        "exp": lambda: expr,
+        "log": lambda: divide(ONE, a),
+        "log10": lambda: divide(ONE, multiply(a, Num(math.log(10)))),
+        "sqrt": lambda: divide(Num(0.5), expr),
+        "abs": lambda: Call("sign", (a,)),
+        # Piecewise constant
+        "sign": lambda: ZERO,
+        "floor": lambda: ZERO,
+        "ceil": lambda: ZERO,
+    }[expr.name]()
+    return multiply(outer, da)
+
+
+def to_source(expr: Expr, scalar: bool = False) -> str:
+    """Python source computing expr, with variable i named vi. If scalar is True, the source only has to work
+    on single numbers (as in a Numba loop) rather than arrays"""
+    if isinstance(expr, Num):
+        return repr(expr.value)
+    if isinstance(expr, Var):
+        return f"v{expr.index}"
+    if isinstance(expr, Where):
+        left, right, when_less, otherwise = (
+            to_source(e, scalar) for e in (expr.left, expr.right, expr.when_less, expr.otherwise)
+        )
+        if scalar:
+            return f"({when_less} if {left} < {right} else {otherwise})"
+        return f"np.where({left} < {right}, {when_less}, {otherwise})"
+    args = [to_source(arg, scalar) for arg in expr.args]
+    if isinstance(expr, Call):
+        return f"np.{expr.name}({', '.join(args)})"
+    if expr.op == "neg":
+        return f"(-{args[0]})"
+    return f"({args[0]} {expr.op} {args[1]})"
+
+
+def to_interval_source(expr: Expr) -> str:
+    """Python source computing an interval (see the interval module) containing the values of expr, with variable i
+    named vi and holding the interval of that coordinate"""
+    if isinstance(expr, Num):
+        return f"({expr.value!r}, {expr.value!r})"
+    if isinstance(expr, Var):
+        return f"v{expr.index}"
+    if isinstance(expr, Where):
+        raise ValueError("Where only appears in derivatives, which are not bounded")
+    args = ", ".join(to_interval_source(arg) for arg in expr.args)
+    if isinstance(expr, Call):
+        return f"interval.FUNCTIONS[{expr.name!r}]({args})"
+    name = {"+": "add", "-": "subtract", "*": "multiply", "/": "divide", "**": "power", "neg": "negate"}[expr.op]
+    return f"interval.{name}({args})"
+
+
+def kernel_source(name: str, exprs: list[Expr], dim: int, backend: Backend) -> str:
+    """Source of a function name(u) taking an (N, dim) array, and returning an (N,) array of the values of
+    exprs[0] if there is only one, or an (N, len(exprs)) array of all of them"""
+    columns = len(exprs) > 1
+    shape = f"(len(u), {len(exprs)})" if columns else "len(u)"
+    lines = [f"def {name}(u):", f"    out = np.empty({shape})"]
+    if backend == "numpy":
+        lines.extend(f"    v{i} = u[:, {i}]" for i in range(dim))
+        for k, expr in enumerate(exprs):
+            lines.append(f"    out[{':, ' + str(k) if columns else ':'}] = {to_source(expr)}")
+    else:
+        lines.append("    for i in numba.prange(len(u)):")
+        lines.extend(f"        v{i} = u[i, {i}]" for i in range(dim))
+        for k, expr in enumerate(exprs):
+            lines.append(f"        out[{'i, ' + str(k) if columns else 'i'}] = {to_source(expr, scalar=True)}")
+    lines.append("    return out")
+    return "\n".join(lines) + "\n"
+
+
+def build_kernel(name: str, exprs: list[Expr], dim: int, backend: Backend) -> Callable[[np.ndarray], np.ndarray]:
+    namespace: dict[str, Any] = {"np": np}
+    if backend == "numba":
+        import numba
+
+        namespace["numba"] = numba
+    exec(compile(kernel_source(name, exprs, dim, backend), f"<{name}>", "exec"), namespace)
+    kernel = namespace[name]
+    if backend == "numba":
+        kernel = numba.njit(parallel=True)(kernel)
+    return lambda u: kernel(np.ascontiguousarray(u, dtype=np.float64))
+
+
+def build_bounds_kernel(expr: Expr, dim: int) -> BoundsFunc:
+    source = "\n".join(
+        ["def bounds(lo, hi):"]
+        + [f"    v{i} = (lo[:, {i}], hi[:, {i}])" for i in range(dim)]
+        + [f"    return interval.broadcast({to_interval_source(expr)}, len(lo))"]
+    )
+    namespace: dict[str, Any] = {"np": np, "interval": interval}
+    exec(compile(source + "\n", "<bounds>", "exec"), namespace)
+    kernel = namespace["bounds"]
+    return lambda lo, hi: kernel(np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64))
+
+
+class CompiledExpression:
+    """An expression in the variables, compiled into a vectorized function (a BatchFunc), so pass
+    vectorized=True when plotting it. gradient takes the same (N, dim) arrays and returns the (N, dim)
+    gradients, for dual_placement="qef"; gradient_at takes a single point, as for criteria.GradientTest.
+    bounds takes the lower and upper corners (N, dim) of boxes and returns lower and upper bounds (N,) on the
+    values within each box, computed with interval arithmetic (and always with NumPy), for the bounds option
+    of the plotting functions.
+
+    expression is a string using Python's syntax, with the functions in FUNCTIONS and the constants pi and e,
+    or a SymPy expression (which is converted through its string form, so SymPy is not needed otherwise).
+    backend="numba" needs Numba installed, and compiles each kernel the first time it is called"""
+
+    def __init__(self, expression: Any, variables: Sequence[str] = ("x", "y"), backend: Backend = "numpy") -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if backend == "numba" and importlib.util.find_spec("numba") is None:
+            raise ImportError('backend="numba" requires numba to be installed')
+        self.expression = expression if isinstance(expression, str) else str(expression)
+        self.variables = tuple(str(v) for v in variables)
+        self.backend = backend
+        self.tree = parse_expression(self.expression, self.variables)
+        dim = len(self.variables)
+        self.fn = build_kernel("fn", [self.tree], dim, backend)
+        self.gradient = build_kernel("gradient", [differentiate(self.tree, i) for i in range(dim)], dim, backend)
+        self.bounds = build_bounds_kernel(self.tree, dim)
+
+    def __reduce__(self):
+        # Kernels do not pickle, so worker processes compile their own
+        return CompiledExpression, (self.expression, self.variables, self.backend)
+
+    def __repr__(self) -> str:
+        return f"CompiledExpression({self.expression!r}, {self.variables!r}, {self.backend!r})"
+
+    def __call__(self, points: np.ndarray) -> np.ndarray:
+        return self.fn(points)
+
+    def gradient_at(self, point: Point) -> np.ndarray:
+        return self.gradient(np.asarray(point)[np.newaxis])[0]
+
+
+def compile_expression(
+    expression: Any, variables: Sequence[str] = ("x", "y"), backend: Backend = "numpy"
+) -> CompiledExpression:
+    """Compile expression (a string or SymPy expression) in variables, such as ("x", "y", "z") for a surface.
+    See CompiledExpression"""
+    return CompiledExpression(expression, variables, backend)
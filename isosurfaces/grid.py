@@ -0,0 +1,53 @@
+"""Evaluating fn over a uniform grid of lattice points with a single call to VertexStore.evaluate.
+
+The grid at depth d holds the vertices of all cells of depth d, so it is the same as the vertices of a tree
+split uniformly down to d. The "grid" engine of the plotting functions marches its cells directly with
+array operations (see isoline.march_squares and isosurface.grid_mesh), and prefetch_grid lets the tree
+builders start from it instead (see build_tree)."""
+
+from __future__ import annotations
+
+from typing import Literal
+
+import numpy as np
+
+from .point import LATTICE_DEPTH, ValuedPoint, VertexStore
+
+# - "tree": adaptive quadtree/octree, refined where the isoline or isosurface is
+# - "grid": every cell of depth min_depth, marched with array operations. Fastest for cheap fn and dense output
+Engine = Literal["tree", "grid"]
+ENGINES = ("tree", "grid")
+
+
+def grid_keys(dim: int, depth: int) -> np.ndarray:
+    """Lattice keys of the grid at depth, as an array of shape (n + 1,) * dim + (dim,) with n = 2**depth,
+    indexed by the integer coordinates of each point along each axis"""
+    coords = np.arange((1 << depth) + 1, dtype=np.int64) << (LATTICE_DEPTH - depth)
+    return np.stack(np.meshgrid(*[coords] * dim, indexing="ij"), axis=-1)
+
+
+def grid_values(store: VertexStore, depth: int) -> tuple[np.ndarray, np.ndarray]:
+    """Positions (shape (n + 1,) * dim + (dim,)) and values (shape (n + 1,) * dim) of the grid at depth,
+    with positions the same as store.position gives for their keys"""
+    keys = grid_keys(store.dim, depth)
+    positions = store.pmin + keys * store.scale
+    values = store.evaluate(positions.reshape(-1, store.dim)).reshape(keys.shape[:-1])
+    return positions, values
+
+
+def prefetch_grid(store: VertexStore, depth: int) -> None:
+    """Add the grid at depth to the points of store, so that cells down to depth find their vertices evaluated"""
+    keys = grid_keys(store.dim, depth).reshape(-1, store.dim)
+    positions, values = grid_values(store, depth)
+    for key, pos, val in zip(map(tuple, keys.tolist()), positions.reshape(-1, store.dim), values.reshape(-1)):
+        store.points.setdefault(key, ValuedPoint(pos, val, key))
+
+
+def check_engine(engine: Engine, **tree_options: bool) -> None:
+    """Raise a ValueError if engine is unknown, or if it is "grid" and any of tree_options (which only apply
+    to the "tree" engine) is set"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+    used = [name for name, is_set in tree_options.items() if is_set]
+    if engine == "grid" and used:
+        raise ValueError(f"engine='grid' does not support {', '.join(used)}")
@@ -0,0 +1,165 @@
+"""Interval arithmetic on arrays, for bounding the values of an expression over boxes (see CompiledExpression.bounds).
+
+An interval is a pair (lo, hi) of arrays (or numbers) holding the bounds of many intervals at once. NaN in either
+bound means nothing is known about the value, and propagates. Bounds are computed in ordinary floating point
+rather than with outward rounding, so they may be off by a few ulps."""
+
+from __future__ import annotations
+
+from typing import Callable, Tuple, Union
+
+import numpy as np
+
+Bound = Union[float, np.ndarray]
+Interval = Tuple[Bound, Bound]
+UNBOUNDED: Interval = (-np.inf, np.inf)
+
+
+def contains(a: Interval, x: float) -> np.ndarray:
+    return (a[0] <= x) & (x <= a[1])
+
+
+def hull(a: Interval, b: Interval, use_b: np.ndarray) -> Interval:
+    """b where use_b, and a elsewhere"""
+    return np.where(use_b, b[0], a[0]), np.where(use_b, b[1], a[1])
+
+
+def broadcast(a: Interval, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """a as two float64 arrays of length n"""
+    return np.broadcast_to(np.asarray(a[0], dtype=np.float64), (n,)), np.broadcast_to(
+        np.asarray(a[1], dtype=np.float64), (n,)
+    )
+
+
+def add(a: Interval, b: Interval) -> Interval:
+    return a[0] + b[0], a[1] + b[1]
+
+
+def subtract(a: Interval, b: Interval) -> Interval:
+    return a[0] - b[1], a[1] - b[0]
+
+
+def negate(a: Interval) -> Interval:
+    return -a[1], -a[0]
+
+
+def multiply(a: Interval, b: Interval) -> Interval:
+    with np.errstate(invalid="ignore"):
+        products = [a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]]
+    # (0 * inf is NaN, which propagates)
+    return np.minimum.reduce(products), np.maximum.reduce(products)
+
+
+def divide(a: Interval, b: Interval) -> Interval:
+    with np.errstate(divide="ignore"):
+        inverse = (1 / b[1], 1 / b[0])
+    return hull(multiply(a, inverse), UNBOUNDED, contains(b, 0))
+
+
+def power(a: Interval, b: Interval) -> Interval:
+    """a ** b, for a constant exponent b (a float in both bounds) or else through exp(b log(a))"""
+    if not (np.ndim(b[0]) == 0 and np.ndim(b[1]) == 0 and b[0] == b[1]):
+        return exp(multiply(b, log(a)))
+    c = float(b[0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if c == int(c) and c > 0:
+            ends = (np.power(a[0], c), np.power(a[1], c))
+            if int(c) % 2 == 1:
+                return ends
+            return hull(
+                (np.minimum(ends[0], ends[1]), np.maximum(ends[0], ends[1])),
+                (0, np.maximum(ends[0], ends[1])),
+                contains(a, 0),
+            )
+        if c == int(c):
+            # Negative integer (c = 0 is folded away before this)
+            return divide((1, 1), power(a, (-c, -c)))
+        # Fractional powers are only defined for a ≥ 0, so NaN where a is entirely negative
+        lo = np.where(a[1] < 0, np.nan, np.maximum(a[0], 0))
+        ends = (np.power(lo, c), np.power(a[1], c))
+    return ends if c > 0 else (ends[1], ends[0])
+
+
+def increasing(f: Callable[[Bound], Bound]) -> Callable[[Interval], Interval]:
+    """Interval version of the increasing function f, which is NaN outside of its domain"""
+
+    def bounds(a: Interval) -> Interval:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return f(a[0]), f(a[1])
+
+    return bounds
+
+
+def decreasing(f: Callable[[Bound], Bound]) -> Callable[[Interval], Interval]:
+    return lambda a: increasing(f)((a[1], a[0]))
+
+
+def sin(a: Interval) -> Interval:
+    ends = (np.sin(a[0]), np.sin(a[1]))
+    lo, hi = np.minimum(*ends), np.maximum(*ends)
+    # The maxima at π/2 + 2πk and the minima at -π/2 + 2πk within a
+    has_max = np.ceil((a[0] - np.pi / 2) / (2 * np.pi)) <= np.floor((a[1] - np.pi / 2) / (2 * np.pi))
+    has_min = np.ceil((a[0] + np.pi / 2) / (2 * np.pi)) <= np.floor((a[1] + np.pi / 2) / (2 * np.pi))
+    return np.where(has_min, -1.0, lo), np.where(has_max, 1.0, hi)
+
+
+def cos(a: Interval) -> Interval:
+    return sin((a[0] + np.pi / 2, a[1] + np.pi / 2))
+
+
+def tan(a: Interval) -> Interval:
+    # Unbounded if a contains a pole at π/2 + πk
+    has_pole = np.ceil((a[0] - np.pi / 2) / np.pi) <= np.floor((a[1] - np.pi / 2) / np.pi)
+    return hull((np.tan(a[0]), np.tan(a[1])), UNBOUNDED, has_pole)
+
+
+def magnitude(a: Interval) -> Interval:
+    """abs(a)"""
+    ends = (np.abs(a[0]), np.abs(a[1]))
+    return np.where(contains(a, 0), 0.0, np.minimum(*ends)), np.maximum(*ends)
+
+
+def cosh(a: Interval) -> Interval:
+    return increasing(np.cosh)(magnitude(a))
+
+
+def minimum(a: Interval, b: Interval) -> Interval:
+    return np.minimum(a[0], b[0]), np.minimum(a[1], b[1])
+
+
+def maximum(a: Interval, b: Interval) -> Interval:
+    return np.maximum(a[0], b[0]), np.maximum(a[1], b[1])
+
+
+def arctan2(y: Interval, x: Interval) -> Interval:
+    # For x > 0, atan2(y, x) = atan(y / x); elsewhere only the range of atan2 is known
+    return hull((-np.pi, np.pi), arctan(divide(y, x)), x[0] > 0)
+
+
+exp = increasing(np.exp)
+log = increasing(np.log)
+arctan = increasing(np.arctan)
+
+# Interval versions of the functions in expression.FUNCTIONS, by NumPy name
+FUNCTIONS = {
+    "sin": sin,
+    "cos": cos,
+    "tan": tan,
+    "arcsin": increasing(np.arcsin),
+    "arccos": decreasing(np.arccos),
+    "arctan": arctan,
+    "arctan2": arctan2,
+    "sinh": increasing(np.sinh),
+    "cosh": cosh,
+    "tanh": increasing(np.tanh),
+    "exp": exp,
+    "log": log,
+    "log10": increasing(np.log10),
+    "sqrt": increasing(np.sqrt),
+    "abs": magnitude,
+    "sign": increasing(np.sign),
+    "floor": increasing(np.floor),
+    "ceil": increasing(np.ceil),
+    "minimum": minimum,
+    "maximum": maximum,
+}
@@ -1,11 +1,26 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Sequence
 
 import numpy as np
 
-from .cell import Cell, build_tree
-from .point import Func, Point, ValuedPoint, binary_search_zero
+from .array_tree import build_array_tree
+from .cache import EvaluationCache
+from .cell import BoundsFunc, Cell, Refinement, RefinementCriterion, build_tree, iter_adjacent_leaves, tree_store
+from .duals import DualPlacement, QEFDuals, make_duals
+from .grid import Engine, check_engine, grid_values
+from .parallel import make_store
+from .point import LATTICE_DEPTH, Func, Point, ValuedPoint, VertexStore
+from .roots import RootMethod, find_edge_zeros
+from .stats import evaluating, report_tree, stage
+
+# Fraction of an edge to step from each end when estimating the slope of fn along the edge (see compute_edge_dual)
+EDGE_DUAL_STEP = 0.01
+# Indices of the vertices (p1, p2) of the edge between adjacent leaves across each axis (see
+# Triangulator.get_pairs), on the side of the leaf before it if the two have the same depth, and on the
+# side of the leaf after it if that one is deeper
+SHARED_EDGES = (((3, 1), (2, 0)), ((2, 3), (0, 1)))
 
 
 def plot_isoline(
@@ -15,29 +30,182 @@ def plot_isoline(
     min_depth: int = 5,
     max_quads: int = 10000,
     tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    root_method: RootMethod = "bisect",
+    compact: bool = False,
+    workers: int | None = 1,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    dual_placement: DualPlacement = "midpoint",
+    gradient: Callable[[Point], np.ndarray] | None = None,
+    cache: EvaluationCache | None = None,
+    engine: Engine = "tree",
+    bounds: BoundsFunc | None = None,
 ) -> list[list[Point]]:
     """Get the curve representing fn([x,y])=0 on pmin[0] ≤ x ≤ pmax[0] ∩ pmin[1] ≤ y ≤ pmax[1]
-    Returns as a list of curves, where each curve is a list of points"""
+    Returns as a list of curves, where each curve is a list of points
+
+    If vectorized is True, fn instead takes an (N, 2) array of points and returns an array of N values.
+    root_method selects how the curve is located along each crossing edge (see roots.RootMethod).
+    If compact is True, the quadtree is stored as an ArrayTree, which takes much less memory for large trees.
+    If workers is not 1, fn is evaluated in that many processes (one per CPU if None), with the same result.
+    refinement="priority" splits the quads that look least linear first, stopping at max_quads or at max_evals
+    evaluations of fn while building the quadtree (see build_tree).
+    criteria (such as criteria.LinearityTest) stop splitting quads where the curve is already simple enough.
+    dual_placement="qef" places the dual of each quad using the gradient of fn (see QEFDuals), which keeps sharp
+    corners with larger quads. gradient computes it, called like fn; by default it uses finite differences.
+    If cache is given, values of fn are looked up in it before calling fn, and saved to it (see EvaluationCache).
+    engine="grid" marches all quads of depth min_depth with array operations instead of building a quadtree
+    (see march_squares), ignoring max_quads.
+    bounds (such as CompiledExpression.bounds) gives ranges of fn over boxes, to skip quads where fn cannot be 0
+    and to split quads where it can be 0 without changing sign at their vertices (see build_tree)"""
+    check_engine(
+        engine,
+        compact=compact,
+        refinement=refinement != "breadth",
+        max_evals=max_evals is not None,
+        criteria=bool(criteria),
+        dual_placement=dual_placement != "midpoint",
+        gradient=gradient is not None,
+        bounds=bounds is not None,
+    )
     pmin = np.asarray(pmin)
     pmax = np.asarray(pmax)
     if tol is None:
         tol = (pmax - pmin) / 1000
     else:
         tol = np.asarray(tol)
-    quadtree = build_tree(2, fn, pmin, pmax, min_depth, max_quads, tol)
-    triangles = Triangulator(quadtree, fn, tol).triangulate()
-    return CurveTracer(triangles, fn, tol).trace()
+    if compact and (refinement != "breadth" or max_evals is not None or criteria or bounds is not None):
+        raise ValueError("A compact tree can only be refined breadth-first, without max_evals, criteria, or bounds")
+    with make_store(fn, pmin, pmax, vectorized, workers, cache) as store:
+        if engine == "grid":
+            with stage("grid"):
+                return march_squares(store, min(min_depth, LATTICE_DEPTH - 1), tol, root_method)
+        with stage("tree"):
+            if compact:
+                quadtree = build_array_tree(2, fn, pmin, pmax, min_depth, max_quads, tol, vectorized, store).root()
+            else:
+                quadtree = build_tree(
+                    2,
+                    fn,
+                    pmin,
+                    pmax,
+                    min_depth,
+                    max_quads,
+                    tol,
+                    vectorized,
+                    store,
+                    refinement,
+                    max_evals,
+                    criteria,
+                    bounds,
+                )
+        report_tree(quadtree)
+        with stage("duals"):
+            duals = make_duals(quadtree, store, tol, dual_placement, gradient, vectorized)
+        with stage("triangulate"):
+            triangles = Triangulator(
+                quadtree, store.fn, tol, store, root_method, duals, crossing_only=True
+            ).triangulate()
+        with stage("trace"):
+            return CurveTracer(triangles, store.fn, tol).trace()
+
+
+def march_squares(store: VertexStore, depth: int, tol: np.ndarray, method: RootMethod = "bisect") -> list[list[Point]]:
+    """Curves of the store's function over all squares of the grid at depth (see grid_values), as returned by
+    CurveTracer: walking along a curve keeps positive values on the right, and closed curves end at their start.
+
+    The two crossings of the isoline on a square with opposite corners of one sign (a saddle) are connected
+    around the negative corners if the center of the square is positive, as the center triangles do in
+    Triangulator, and around the positive corners otherwise"""
+    positions, values = grid_values(store, depth)
+    n = 1 << depth
+    # (Group 0 with negatives)
+    signs = values > 0
+    # Edges along x (from point (i, j) to (i + 1, j)) and along y (from (i, j) to (i, j + 1)), numbered together
+    x_edges = np.arange(n * (n + 1)).reshape(n, n + 1)
+    y_edges = n * (n + 1) + np.arange((n + 1) * n).reshape(n + 1, n)
+    # Corners and sides of each square, counterclockwise from the bottom left, where side k goes from corner k
+    # to corner k + 1
+    corners = np.stack([signs[:-1, :-1], signs[1:, :-1], signs[1:, 1:], signs[:-1, 1:]], axis=-1).reshape(-1, 4)
+    sides = np.stack([x_edges[:, :-1], y_edges[1:], x_edges[:, 1:], y_edges[:-1]], axis=-1).reshape(-1, 4)
+    following = np.roll(corners, -1, axis=1)
+    rising = ~corners & following
+    falling = corners & ~following
+    # Saddles whose center is positive connect each rising side to the falling side before it instead of after it
+    backwards = np.zeros(len(corners), dtype=bool)
+    saddles = np.nonzero((corners[:, 0] == corners[:, 2]) & (corners[:, 1] == corners[:, 3]) & rising.any(axis=1))[0]
+    if len(saddles) > 0:
+        center_keys = (2 * np.stack(np.divmod(saddles, n), axis=-1) + 1) << (LATTICE_DEPTH - depth - 1)
+        with evaluating("dual"):
+            backwards[saddles] = store.evaluate(store.pmin + center_keys * store.scale) > 0
+    # Each segment goes from a rising side to the nearest falling side (in its direction around the square)
+    starts = []
+    ends = []
+    for k in range(4):
+        squares = np.nonzero(rising[:, k])[0]
+        step = np.where(backwards[squares], -1, 1)
+        partner = np.full(len(squares), -1)
+        for distance in (1, 2, 3):
+            side = (k + step * distance) % 4
+            found = (partner < 0) & falling[squares, side]
+            partner[found] = side[found]
+        starts.append(sides[squares, k])
+        ends.append(sides[squares, partner])
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    # Find the zero along each crossing edge, given by the indices of its ends in the flattened grid
+    crossing = np.unique(np.concatenate([starts, ends]))
+    along_y = crossing >= n * (n + 1)
+    y_index = crossing - n * (n + 1)
+    index1 = np.where(along_y, y_index + y_index // n, crossing)
+    index2 = index1 + np.where(along_y, 1, n + 1)
+    flat_positions = positions.reshape(-1, 2)
+    flat_values = values.reshape(-1)
+    points, _, is_zero = store.map_chunks(
+        find_edge_zeros,
+        [flat_positions[index1], flat_values[index1], flat_positions[index2], flat_values[index2]],
+        tol,
+        method,
+    )
+    # As in Triangulator, the curve is broken where there is no zero (such as at an asymptote)
+    linked = is_zero[np.searchsorted(crossing, starts)] & is_zero[np.searchsorted(crossing, ends)]
+    next_edge = dict(zip(starts[linked].tolist(), ends[linked].tolist()))
+    return trace_segments(next_edge, dict(zip(crossing.tolist(), points)))
+
+
+def trace_segments(next_edge: dict[int, int], point_of: dict[int, Point]) -> list[list[Point]]:
+    """Join the segments from each edge to next_edge[edge] into curves of the points of the edges"""
+    curves = []
+    has_prev = set(next_edge.values())
+    # Open curves first, from their starts, then closed curves from any point
+    heads = [edge for edge in next_edge if edge not in has_prev]
+    heads.reverse()
+    while next_edge:
+        head = heads.pop() if heads else next(iter(next_edge))
+        curve = [point_of[head]]
+        edge = head
+        while edge in next_edge:
+            edge = next_edge.pop(edge)
+            curve.append(point_of[edge])
+        curves.append(curve)
+    return curves
 
 
-@dataclass
 class Triangle:
-    vertices: list[ValuedPoint]
-    """ The order of triangle "next" is such that, when walking along the isoline in the direction of next,
+    """The order of triangle "next" is such that, when walking along the isoline in the direction of next,
     you keep positive function values on your right and negative function values on your left."""
-    next: Triangle | None = None
-    next_bisect_point: ValuedPoint | None = None
-    prev: Triangle | None = None
-    visited: bool = False
+
+    # There is one of these for each triangle kept by Triangulator, so they are kept small
+    __slots__ = ("vertices", "next", "next_bisect_point", "prev", "visited")
+
+    def __init__(self, vertices: tuple[ValuedPoint, ValuedPoint, ValuedPoint]) -> None:
+        self.vertices = vertices
+        self.next: Triangle | None = None
+        self.next_bisect_point: ValuedPoint | None = None
+        self.prev: Triangle | None = None
+        self.visited = False
 
 
 def four_triangles(
@@ -45,13 +213,21 @@ def four_triangles(
 ) -> tuple[Triangle, Triangle, Triangle, Triangle]:
     """a,b,c,d should be clockwise oriented, with center on the inside of that quad"""
     return (
-        Triangle([a, b, center]),
-        Triangle([b, c, center]),
-        Triangle([c, d, center]),
-        Triangle([d, a, center]),
+        Triangle((a, b, center)),
+        Triangle((b, c, center)),
+        Triangle((c, d, center)),
+        Triangle((d, a, center)),
     )
 
 
+def hanging_key(vertex: ValuedPoint, quad: Cell) -> int:
+    """Id of the edge from vertex (a corner of quad) to the dual of quad: four times its midpoint on the lattice
+    of the store, taking the center of quad for its dual, with the coordinates packed into one integer"""
+    (x0, y0), (x1, y1), (x, y) = quad.vertices[0].key, quad.vertices[-1].key, vertex.key
+    # Each coordinate is less than 4 << LATTICE_DEPTH
+    return (2 * x + x0 + x1) << (LATTICE_DEPTH + 2) | (2 * y + y0 + y1)
+
+
 class Triangulator:
     """While triangulating, also compute the isolines.
 
@@ -61,101 +237,172 @@ class Triangulator:
     Based on Manson, Josiah, and Scott Schaefer. "Isosurfaces
     over simplicial partitions of multiresolution grids." Computer Graphics Forum.
     Vol. 29. No. 2. Oxford, UK: Blackwell Publishing Ltd, 2010.
-    (https://people.engr.tamu.edu/schaefer/research/iso_simplicial.pdf), but this
-    does not currently implement placing dual vertices based on the gradient.
+    (https://people.engr.tamu.edu/schaefer/research/iso_simplicial.pdf). Quad duals are placed
+    based on the gradient if given duals (see QEFDuals), and at the centers of quads otherwise.
     """
 
-    def __init__(self, root: Cell, fn: Func, tol: np.ndarray) -> None:
+    def __init__(
+        self,
+        root: Cell,
+        fn: Func,
+        tol: np.ndarray,
+        store: VertexStore | None = None,
+        root_method: RootMethod = "bisect",
+        duals: QEFDuals | None = None,
+        crossing_only: bool = False,
+    ) -> None:
+        """store should be the VertexStore the tree was built with, so that duals can reuse its points.
+
+        If crossing_only is True, only the triangles that the isoline may cross (with vertices of both signs) are
+        kept, which saves time and memory without changing the curves traced from the result"""
         self.triangles: list[Triangle] = []
-        self.hanging_next: dict[bytes, Triangle] = {}
+        # Triangles waiting for the triangle across their hanging edge, by hanging_key
+        self.hanging_next: dict[int, Triangle] = {}
+        # Arguments of set_next calls whose edges have yet to be searched for a zero
+        self.pending_next: list[tuple[Triangle, Triangle, ValuedPoint, ValuedPoint]] = []
         self.root = root
         self.fn = fn
         self.tol = tol
-
-    def triangulate(self) -> list[Triangle]:
-        self.triangulate_inside(self.root)
+        self.store = tree_store(root, fn) if store is None else store
+        self.root_method = root_method
+        self.duals = duals
+        self.crossing_only = crossing_only
+
+    def triangulate(self, pairs: Iterable[tuple[Cell, Cell, ValuedPoint, ValuedPoint]] | None = None) -> list[Triangle]:
+        """pairs, if given, are some of get_pairs in the same order, leaving out only pairs that add_pair skips
+        (see plot_contours)"""
+        pairs = iter(self.get_pairs() if pairs is None else pairs)
+        # Each pair caches at most 4 duals (2 faces, 1 edge, and the midpoint of the edge), so the duals
+        # prefetched for a chunk are all still cached when its triangles are added
+        step = max(1, self.store.max_duals // 4)
+        for chunk in iter(lambda: list(islice(pairs, step)), []):
+            if self.store.batched:
+                self.prefetch_duals(chunk)
+            for a, b, p1, p2 in chunk:
+                self.add_pair(a, b, p1, p2)
+        self.link_pending_next()
         return self.triangles
 
-    def triangulate_inside(self, quad: Cell) -> None:
-        if quad.children:
-            for child in quad.children:
-                self.triangulate_inside(child)
-            self.triangulate_crossing_row(quad.children[0], quad.children[1])
-            self.triangulate_crossing_row(quad.children[2], quad.children[3])
-            self.triangulate_crossing_col(quad.children[0], quad.children[2])
-            self.triangulate_crossing_col(quad.children[1], quad.children[3])
-
-    def triangulate_crossing_row(self, a: Cell, b: Cell) -> None:
-        """Quad b should be to the right (greater x values) than quad a"""
-        if a.children and b.children:
-            self.triangulate_crossing_row(a.children[1], b.children[0])
-            self.triangulate_crossing_row(a.children[3], b.children[2])
-        elif a.children:
-            self.triangulate_crossing_row(a.children[1], b)
-            self.triangulate_crossing_row(a.children[3], b)
-        elif b.children:
-            self.triangulate_crossing_row(a, b.children[0])
-            self.triangulate_crossing_row(a, b.children[2])
-        else:
-            # a and b are minimal 2-cells
-            face_dual_a = self.get_face_dual(a)
-            face_dual_b = self.get_face_dual(b)
-            # Add the four triangles from the centers of a and b to the shared edge between them
+    def get_pairs(self) -> Iterator[tuple[Cell, Cell, ValuedPoint, ValuedPoint]]:
+        """Arguments (a, b, p1, p2) to pass to add_pair, for every pair of adjacent leaves"""
+        for a, b, axis in iter_adjacent_leaves(self.root):
+            # The edge is a side of the smaller quad (b if it is deeper, a otherwise)
             if a.depth < b.depth:
-                # b is smaller
-                edge_dual = self.get_edge_dual(b.vertices[2], b.vertices[0])
-                triangles = four_triangles(b.vertices[2], face_dual_b, b.vertices[0], face_dual_a, edge_dual)
+                i, j = SHARED_EDGES[axis][1]
+                yield a, b, b.vertices[i], b.vertices[j]
             else:
-                edge_dual = self.get_edge_dual(a.vertices[3], a.vertices[1])
-                triangles = four_triangles(a.vertices[3], face_dual_b, a.vertices[1], face_dual_a, edge_dual)
-            self.add_four_triangles(triangles)
-
-    def triangulate_crossing_col(self, a: Cell, b: Cell) -> None:
-        """Mostly a copy-paste of triangulate_crossing_row. For n-dimensions, want to pass a
-        dir index into a shared triangulate_crossing_dir function instead"""
-        if a.children and b.children:
-            self.triangulate_crossing_col(a.children[2], b.children[0])
-            self.triangulate_crossing_col(a.children[3], b.children[1])
-        elif a.children:
-            self.triangulate_crossing_col(a.children[2], b)
-            self.triangulate_crossing_col(a.children[3], b)
-        elif b.children:
-            self.triangulate_crossing_col(a, b.children[0])
-            self.triangulate_crossing_col(a, b.children[1])
+                i, j = SHARED_EDGES[axis][0]
+                yield a, b, a.vertices[i], a.vertices[j]
+
+    def add_pair(self, a: Cell, b: Cell, p1: ValuedPoint, p2: ValuedPoint) -> None:
+        """Add the four triangles from the centers of leaves a and b to the edge p1--p2 between them,
+        where p1 and p2 are in the order of four_triangles"""
+        face_dual_a = self.get_face_dual(a)
+        face_dual_b = self.get_face_dual(b)
+        edge_dual = self.get_edge_dual(p1, p2)
+        triangles: list[Triangle | None]
+        if self.crossing_only:
+            # (Group 0 with negatives) Triangles of a single sign cannot be linked to any other
+            corners = (p1, face_dual_b, p2, face_dual_a)
+            signs = [v.val > 0 for v in corners]
+            center = edge_dual.val > 0
+            if signs[0] == signs[1] == signs[2] == signs[3] == center:
+                return
+            triangles = [
+                None
+                if signs[k] == signs[(k + 1) % 4] == center
+                else Triangle((corners[k], corners[(k + 1) % 4], edge_dual))
+                for k in range(4)
+            ]
         else:
-            # a and b are minimal 2-cells
-            face_dual_a = self.get_face_dual(a)
-            face_dual_b = self.get_face_dual(b)
-            # Add the four triangles from the centers of a and b to the shared edge between them
-            if a.depth < b.depth:
-                # b is smaller
-                edge_dual = self.get_edge_dual(b.vertices[0], b.vertices[1])
-                triangles = four_triangles(b.vertices[0], face_dual_b, b.vertices[1], face_dual_a, edge_dual)
+            triangles = list(four_triangles(p1, face_dual_b, p2, face_dual_a, edge_dual))
+        # The hanging edge of each triangle goes from p1 or p2 to the dual of a or b (see next_sandwich_triangles)
+        hanging = ((p1, b), (p2, b), (p2, a), (p1, a))
+        for k in (1, 2, 3, 0):
+            if triangles[k] is not None:
+                self.next_sandwich_triangles(triangles[k - 1], triangles[k], triangles[(k + 1) % 4], *hanging[k])
+        self.triangles.extend(triangle for triangle in triangles if triangle is not None)
+
+    def prefetch_duals(self, pairs: list[tuple[Cell, Cell, ValuedPoint, ValuedPoint]]) -> None:
+        """Evaluate the duals that add_pair will need for pairs together, into the store's cache of duals.
+        The points are the same as add_pair would evaluate one at a time (see compute_edge_dual)"""
+        store = self.store
+        if self.duals is None:
+            store.prefetch([store.midpoint_key(c.vertices[0], c.vertices[-1]) for a, b, _, _ in pairs for c in (a, b)])
+        edges = {(p1.key, p2.key): (p1, p2) for _, _, p1, p2 in pairs}
+        edges = [edge for key, edge in edges.items() if key not in store.duals]
+        if edges:
+            with evaluating("edge_dual"):
+                self.prefetch_edge_duals(edges)
+
+    def prefetch_edge_duals(self, edges: list[tuple[ValuedPoint, ValuedPoint]]) -> None:
+        """The part of prefetch_duals for the duals of edges p1--p2 that are not cached yet"""
+        store = self.store
+        pos1 = np.array([p1.pos for p1, _ in edges])
+        pos2 = np.array([p2.pos for _, p2 in edges])
+        # (Group 0 with negatives) Edges crossing the isoline take the midpoint
+        midpoint = np.array([(p1.val > 0) != (p2.val > 0) for p1, p2 in edges])
+        df1 = np.zeros(len(edges))
+        df2 = np.zeros(len(edges))
+        same = ~midpoint
+        if np.any(same):
+            dt = EDGE_DUAL_STEP
+            df = store.evaluate(
+                np.concatenate([pos1[same] * (1 - dt) + pos2[same] * dt, pos1[same] * dt + pos2[same] * (1 - dt)])
+            )
+            df1[same], df2[same] = np.split(df, 2)
+            midpoint[same] = (df1[same] > 0) == (df2[same] > 0)
+        store.prefetch([store.midpoint_key(p1, p2) for (p1, p2), mid in zip(edges, midpoint) if mid])
+        # The rest are intersected as in ValuedPoint.intersectZero
+        lerp = ~midpoint
+        intersections = iter(())
+        if np.any(lerp):
+            denom = df1[lerp] - df2[lerp]
+            k1 = (-df2[lerp] / denom)[:, np.newaxis]
+            k2 = (df1[lerp] / denom)[:, np.newaxis]
+            pts = k1 * pos1[lerp] + k2 * pos2[lerp]
+            intersections = zip(pts, store.evaluate(pts))
+        for (p1, p2), mid in zip(edges, midpoint):
+            if mid:
+                store.cached_dual((p1.key, p2.key), lambda: store.dual(p1, p2))
             else:
-                edge_dual = self.get_edge_dual(a.vertices[2], a.vertices[3])
-                triangles = four_triangles(a.vertices[2], face_dual_b, a.vertices[3], face_dual_a, edge_dual)
-            self.add_four_triangles(triangles)
-
-    def add_four_triangles(self, triangles: tuple[Triangle, Triangle, Triangle, Triangle]) -> None:
-        for i in range(4):
-            self.next_sandwich_triangles(triangles[i], triangles[(i + 1) % 4], triangles[(i + 2) % 4])
-        self.triangles.extend(triangles)
+                pt, val = next(intersections)
+                store.cached_dual((p1.key, p2.key), lambda: ValuedPoint(pt, val))
 
     def set_next(self, tri1: Triangle, tri2: Triangle, vpos: ValuedPoint, vneg: ValuedPoint) -> None:
         if not vpos.val > 0 >= vneg.val:
             return
-        intersection, is_zero = binary_search_zero(vpos, vneg, self.fn, self.tol)
-        if not is_zero:
+        # Linking waits until all edges are known, so that their zeros can be found together
+        self.pending_next.append((tri1, tri2, vpos, vneg))
+
+    def link_pending_next(self) -> None:
+        """Search the edges of all pending set_next calls (with store.map_chunks), in the order of the calls,
+        and link the triangles across those with a zero"""
+        pending = self.pending_next
+        self.pending_next = []
+        if not pending:
             return
-        tri1.next_bisect_point = intersection
-        tri1.next = tri2
-        tri2.prev = tri1
-
-    def next_sandwich_triangles(self, a: Triangle, b: Triangle, c: Triangle) -> None:
+        pos1 = np.array([vpos.pos for _, _, vpos, _ in pending])
+        val1 = np.array([vpos.val for _, _, vpos, _ in pending], dtype=np.float64)
+        pos2 = np.array([vneg.pos for _, _, _, vneg in pending])
+        val2 = np.array([vneg.val for _, _, _, vneg in pending], dtype=np.float64)
+        points, vals, is_zero = self.store.map_chunks(
+            find_edge_zeros, [pos1, val1, pos2, val2], self.tol, self.root_method, False
+        )
+        for (tri1, tri2, _, _), point, val, zero in zip(pending, points, vals, is_zero):
+            if zero:
+                tri1.next_bisect_point = ValuedPoint(point, val)
+                tri1.next = tri2
+                tri2.prev = tri1
+
+    def next_sandwich_triangles(
+        self, a: Triangle | None, b: Triangle, c: Triangle | None, vertex: ValuedPoint, quad: Cell
+    ) -> None:
         """Find the "next" triangle for the triangle b. See Triangle for a description of the curve orientation.
 
         We assume the triangles are oriented such that they share common vertices center←a[2]≡b[2]≡c[2]
-        and x←a[1]≡b[0], y←b[1]≡c[0]"""
+        and x←a[1]≡b[0], y←b[1]≡c[0]. The hanging edge x--y goes from vertex to the dual of quad.
+        a or c may be None where crossing_only left them out, since b is never linked to those"""
 
         center = b.vertices[2]
         x = b.vertices[0]
@@ -171,29 +418,31 @@ class Triangulator:
 
         # More difficult connections: complete a hanging connection
         # or wait for another triangle to complete this
-        # We index using (double) the midpoint of the hanging edge
-        id = (x.pos + y.pos).data.tobytes()
-
         # (Group 0 with negatives)
         if y.val > 0 >= x.val:
-            if id in self.hanging_next:
-                self.set_next(b, self.hanging_next[id], y, x)
-                del self.hanging_next[id]
+            id = hanging_key(vertex, quad)
+            other = self.hanging_next.pop(id, None)
+            if other is not None:
+                self.set_next(b, other, y, x)
             else:
                 self.hanging_next[id] = b
         elif y.val <= 0 < x.val:
-            if id in self.hanging_next:
-                self.set_next(self.hanging_next[id], b, x, y)
-                del self.hanging_next[id]
+            id = hanging_key(vertex, quad)
+            other = self.hanging_next.pop(id, None)
+            if other is not None:
+                self.set_next(other, b, x, y)
             else:
                 self.hanging_next[id] = b
 
     def get_edge_dual(self, p1: ValuedPoint, p2: ValuedPoint) -> ValuedPoint:
         """Returns the dual point on an edge p1--p2"""
+        return self.store.cached_dual((p1.key, p2.key), lambda: self.compute_edge_dual(p1, p2), "edge_dual")
+
+    def compute_edge_dual(self, p1: ValuedPoint, p2: ValuedPoint) -> ValuedPoint:
         if (p1.val > 0) != (p2.val > 0):
             # The edge crosses the isoline, so take the midpoint
-            return ValuedPoint.midpoint(p1, p2, self.fn)
-        dt = 0.01
+            return self.store.dual(p1, p2)
+        dt = EDGE_DUAL_STEP
         # We intersect the planes with normals <∇f(p1), -1> and <∇f(p2), -1>
         # move slightly from p1 to p2. df = ∆f, so ∆f/∆t = 100*df1 near p1
         df1 = self.fn(p1.pos * (1 - dt) + p2.pos * dt)
@@ -203,7 +452,7 @@ class Triangulator:
         if (df1 > 0) == (df2 > 0):
             # The function either increases → ← or ← →, so a lerp would shoot out of bounds
             # Take the midpoint
-            return ValuedPoint.midpoint(p1, p2, self.fn)
+            return self.store.dual(p1, p2)
         else:
             # Increases → 0 → or ← 0 ←
             v1 = ValuedPoint(p1.pos, df1)
@@ -211,8 +460,9 @@ class Triangulator:
             return ValuedPoint.intersectZero(v1, v2, self.fn)
 
     def get_face_dual(self, quad: Cell) -> ValuedPoint:
-        # TODO: proper face dual
-        return ValuedPoint.midpoint(quad.vertices[0], quad.vertices[-1], self.fn)
+        if self.duals is not None:
+            return self.duals.dual(quad)
+        return quad.get_dual(self.store)
 
 
 class CurveTracer:
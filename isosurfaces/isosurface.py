@@ -1,11 +1,32 @@
 from __future__ import annotations
 
-from typing import Iterator
+from dataclasses import dataclass
+from itertools import islice, permutations
+from typing import Callable, Iterator, Sequence, TypeVar
 
 import numpy as np
 
-from .cell import Cell, MinimalCell, build_tree
-from .point import Func, Point, ValuedPoint, binary_search_zero
+from .array_tree import build_array_tree
+from .cache import EvaluationCache
+from .cell import (
+    BoundsFunc,
+    Cell,
+    CellIndex,
+    MinimalCell,
+    Refinement,
+    RefinementCriterion,
+    build_tree,
+    iter_leaves,
+    tree_store,
+)
+from .duals import DualPlacement, QEFDuals, central_differences, make_duals
+from .grid import Engine, check_engine, grid_values
+from .parallel import make_store
+from .point import LATTICE_DEPTH, BatchFunc, Func, LatticeKey, Point, ValuedPoint, VertexStore
+from .roots import RootMethod, find_edge_zeros, find_zero, find_zeros
+from .stats import report_tree, stage
+
+T = TypeVar("T")
 
 
 def plot_isosurface(
@@ -15,23 +36,347 @@ def plot_isosurface(
     min_depth: int = 5,
     max_cells: int = 10000,
     tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    root_method: RootMethod = "bisect",
+    compact: bool = False,
+    workers: int | None = 1,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    dual_placement: DualPlacement = "midpoint",
+    gradient: Callable[[Point], np.ndarray] | None = None,
+    cache: EvaluationCache | None = None,
+    engine: Engine = "tree",
+    bounds: BoundsFunc | None = None,
 ):
     """Returns the surface representing fn([x,y,z])=0 on
-    pmin[0] ≤ x ≤ pmax[0] ∩ pmin[1] ≤ y ≤ pmax[1] ∩ pmin[2] ≤ z ≤ pmax[2]"""
+    pmin[0] ≤ x ≤ pmax[0] ∩ pmin[1] ≤ y ≤ pmax[1] ∩ pmin[2] ≤ z ≤ pmax[2]
+
+    If vectorized is True, fn instead takes an (N, 3) array of points and returns an array of N values.
+    root_method selects how the surface is located along each crossing edge (see roots.RootMethod).
+    If compact is True, the octree is stored as an ArrayTree, which takes much less memory for large trees.
+    If workers is not 1, fn is evaluated in that many processes (one per CPU if None), with the same result.
+    refinement="priority" splits the cells that look least linear first, stopping at max_cells or at max_evals
+    evaluations of fn while building the octree (see build_tree).
+    criteria (such as criteria.LinearityTest) stop splitting cells where the surface is already simple enough.
+    dual_placement="qef" places duals using the gradient of fn (see QEFDuals), which keeps sharp edges and
+    corners with larger cells. gradient computes it, called like fn; by default it uses finite differences.
+    If cache is given, values of fn are looked up in it before calling fn, and saved to it (see EvaluationCache).
+    engine="grid" marches all cubes of depth min_depth with array operations instead of building an octree
+    (see grid_mesh), ignoring max_cells. There are then no simplices to return, so the first list is empty.
+    bounds (such as CompiledExpression.bounds) gives ranges of fn over boxes, to skip cells where fn cannot be 0
+    and to split cells where it can be 0 without changing sign at their vertices (see build_tree)"""
+    if engine != "tree":
+        mesh = build_grid_mesh(
+            fn,
+            pmin,
+            pmax,
+            min_depth,
+            tol,
+            vectorized,
+            root_method,
+            workers,
+            cache,
+            False,
+            engine,
+            compact,
+            refinement,
+            max_evals,
+            criteria,
+            dual_placement,
+            gradient,
+            bounds,
+        )
+        return [], [list(face) for face in mesh.vertices[mesh.faces]]
+    octtree, store, tol = build_octree(
+        fn,
+        pmin,
+        pmax,
+        min_depth,
+        max_cells,
+        tol,
+        vectorized,
+        compact,
+        workers,
+        refinement,
+        max_evals,
+        criteria,
+        cache,
+        bounds,
+    )
+    with store:
+        with stage("duals"):
+            duals = make_duals(octtree, store, tol, dual_placement, gradient, vectorized)
+        with stage("simplices"):
+            simplices = list(SimplexGenerator(octtree, store.fn, store, duals).get_simplices())
+        with stage("march"):
+            if not store.batched:
+                faces = []
+                for simplex in simplices:
+                    face_list = march_simplex(simplex, store.fn, tol, root_method)
+                    if face_list is not None:
+                        faces.extend(face_list)
+                return simplices, faces
+            triangles = store.map_chunks(march_task, simplex_arrays(simplices), tol, root_method)
+            return simplices, [list(triangle) for triangle in triangles]
+
+
+@dataclass
+class IsosurfaceMesh:
+    # float64 array of shape (V, 3)
+    vertices: np.ndarray
+    # int32 array of shape (F, 3) of indices into vertices
+    faces: np.ndarray
+    # float64 array of shape (V, 3) of unit normals pointing towards positive values, if requested
+    normals: np.ndarray | None = None
+
+
+def plot_isosurface_mesh(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    min_depth: int = 5,
+    max_cells: int = 10000,
+    tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    normals: bool = False,
+    root_method: RootMethod = "bisect",
+    compact: bool = False,
+    workers: int | None = 1,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    dual_placement: DualPlacement = "midpoint",
+    gradient: Callable[[Point], np.ndarray] | None = None,
+    cache: EvaluationCache | None = None,
+    engine: Engine = "tree",
+    bounds: BoundsFunc | None = None,
+) -> IsosurfaceMesh:
+    """Same surface as plot_isosurface, but as an indexed mesh, where faces sharing a vertex share its index.
+    If normals is True, also estimate the normal at each vertex from the gradient of fn"""
+    if engine != "tree":
+        return build_grid_mesh(
+            fn,
+            pmin,
+            pmax,
+            min_depth,
+            tol,
+            vectorized,
+            root_method,
+            workers,
+            cache,
+            normals,
+            engine,
+            compact,
+            refinement,
+            max_evals,
+            criteria,
+            dual_placement,
+            gradient,
+            bounds,
+        )
+    octtree, store, tol = build_octree(
+        fn,
+        pmin,
+        pmax,
+        min_depth,
+        max_cells,
+        tol,
+        vectorized,
+        compact,
+        workers,
+        refinement,
+        max_evals,
+        criteria,
+        cache,
+        bounds,
+    )
+    with store:
+        with stage("duals"):
+            duals = make_duals(octtree, store, tol, dual_placement, gradient, vectorized)
+        builder = MeshBuilder(store, tol, root_method)
+        with stage("simplices"):
+            for simplex in SimplexGenerator(octtree, store.fn, store, duals).get_simplices():
+                builder.add_simplex(simplex)
+        with stage("march"):
+            mesh = builder.get_mesh()
+        if normals:
+            with stage("normals"):
+                mesh.normals = vertex_normals(mesh.vertices, store, tol)
+        return mesh
+
+
+def iter_isosurface_faces(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    min_depth: int = 5,
+    max_cells: int = 10000,
+    tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    batch_size: int = 4096,
+    root_method: RootMethod = "bisect",
+    compact: bool = False,
+    workers: int | None = 1,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    dual_placement: DualPlacement = "midpoint",
+    gradient: Callable[[Point], np.ndarray] | None = None,
+    cache: EvaluationCache | None = None,
+    engine: Engine = "tree",
+    bounds: BoundsFunc | None = None,
+) -> Iterator[np.ndarray]:
+    """Same faces as plot_isosurface, but yielded while the octree is traversed instead of collected in a list.
+
+    Faces come in float64 blocks of shape (batch_size, 3, 3) (the last block may be shorter),
+    where block[i] holds the three vertices of a triangle"""
+    if engine != "tree":
+        mesh = build_grid_mesh(
+            fn,
+            pmin,
+            pmax,
+            min_depth,
+            tol,
+            vectorized,
+            root_method,
+            workers,
+            cache,
+            False,
+            engine,
+            compact,
+            refinement,
+            max_evals,
+            criteria,
+            dual_placement,
+            gradient,
+            bounds,
+        )
+        faces = mesh.vertices[mesh.faces]
+        for start in range(0, len(faces), batch_size):
+            yield faces[start : start + batch_size]
+        return
+    octtree, store, tol = build_octree(
+        fn,
+        pmin,
+        pmax,
+        min_depth,
+        max_cells,
+        tol,
+        vectorized,
+        compact,
+        workers,
+        refinement,
+        max_evals,
+        criteria,
+        cache,
+        bounds,
+    )
+    with store:
+        with stage("duals"):
+            duals = make_duals(octtree, store, tol, dual_placement, gradient, vectorized)
+        simplices = SimplexGenerator(octtree, store.fn, store, duals).get_simplices()
+        if not store.batched:
+            face_lists = (march_simplex(simplex, store.fn, tol, root_method) for simplex in simplices)
+        else:
+            # March batch_size simplices at a time
+            chunks = iter(lambda: list(islice(simplices, batch_size)), [])
+            face_lists = (store.map_chunks(march_task, simplex_arrays(chunk), tol, root_method) for chunk in chunks)
+        block = np.empty((batch_size, 3, 3))
+        count = 0
+        for face_list in face_lists:
+            if face_list is not None:
+                for face in face_list:
+                    block[count] = face
+                    count += 1
+                    if count == batch_size:
+                        yield block
+                        block = np.empty((batch_size, 3, 3))
+                        count = 0
+        if count > 0:
+            yield block[:count]
+
+
+def build_octree(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray | None,
+    vectorized: bool,
+    compact: bool = False,
+    workers: int | None = 1,
+    refinement: Refinement = "breadth",
+    max_evals: int | None = None,
+    criteria: Sequence[RefinementCriterion] = (),
+    cache: EvaluationCache | None = None,
+    bounds: BoundsFunc | None = None,
+) -> tuple[Cell, VertexStore, np.ndarray]:
+    """Returns the octree, the VertexStore of its vertices (to be closed by the caller),
+    and tol (filled in with its default)"""
     pmin = np.asarray(pmin)
     pmax = np.asarray(pmax)
     if tol is None:
         tol = (pmax - pmin) / 1000
     else:
         tol = np.asarray(tol)
-    octtree = build_tree(3, fn, pmin, pmax, min_depth, max_cells, tol)
-    simplices = list(SimplexGenerator(octtree, fn).get_simplices())
-    faces = []
-    for simplex in simplices:
-        face_list = march_simplex(simplex, fn, tol)
-        if face_list is not None:
-            faces.extend(face_list)
-    return simplices, faces
+    if compact and (refinement != "breadth" or max_evals is not None or criteria or bounds is not None):
+        raise ValueError("A compact tree can only be refined breadth-first, without max_evals, criteria, or bounds")
+    store = make_store(fn, pmin, pmax, vectorized, workers, cache)
+    with stage("tree"):
+        if compact:
+            octtree = build_array_tree(3, fn, pmin, pmax, min_depth, max_cells, tol, vectorized, store).root()
+        else:
+            octtree = build_tree(
+                3, fn, pmin, pmax, min_depth, max_cells, tol, vectorized, store, refinement, max_evals, criteria, bounds
+            )
+    report_tree(octtree)
+    return octtree, store, tol
+
+
+def build_grid_mesh(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    depth: int,
+    tol: np.ndarray | None,
+    vectorized: bool,
+    root_method: RootMethod,
+    workers: int | None,
+    cache: EvaluationCache | None,
+    normals: bool,
+    engine: Engine,
+    compact: bool,
+    refinement: Refinement,
+    max_evals: int | None,
+    criteria: Sequence[RefinementCriterion],
+    dual_placement: DualPlacement,
+    gradient: Callable[[Point], np.ndarray] | None,
+    bounds: BoundsFunc | None,
+) -> IsosurfaceMesh:
+    """grid_mesh for the plotting functions, after checking engine (which should not be "tree") and that none of
+    the options of the "tree" engine are set"""
+    check_engine(
+        engine,
+        compact=compact,
+        refinement=refinement != "breadth",
+        max_evals=max_evals is not None,
+        criteria=bool(criteria),
+        dual_placement=dual_placement != "midpoint",
+        gradient=gradient is not None,
+        bounds=bounds is not None,
+    )
+    pmin = np.asarray(pmin)
+    pmax = np.asarray(pmax)
+    tol = (pmax - pmin) / 1000 if tol is None else np.asarray(tol)
+    with make_store(fn, pmin, pmax, vectorized, workers, cache) as store:
+        with stage("grid"):
+            mesh = grid_mesh(store, min(depth, LATTICE_DEPTH - 1), tol, root_method)
+        if normals:
+            with stage("normals"):
+                mesh.normals = vertex_normals(mesh.vertices, store, tol)
+        return mesh
 
 
 TETRAHEDRON_TABLE: dict[int, list[tuple[int, int]]] = {
@@ -46,6 +391,24 @@ TETRAHEDRON_TABLE: dict[int, list[tuple[int, int]]] = {
 }
 
 
+def build_case_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """TETRAHEDRON_TABLE as arrays indexed by all 16 cases, for march_simplices. Returns
+
+    - edges: (16, 4, 2) vertex indices of each crossing edge, padded with (0, 0)
+    - edge_counts: (16,) number of crossing edges
+    - triangles: (16, 2, 3) indices into edges of each triangle, as in polygon_triangles"""
+    edges = np.zeros((16, 4, 2), dtype=np.intp)
+    edge_counts = np.zeros(16, dtype=np.intp)
+    triangles = np.zeros((16, 2, 3), dtype=np.intp)
+    for id in range(16):
+        case = TETRAHEDRON_TABLE[id] if id in TETRAHEDRON_TABLE else TETRAHEDRON_TABLE[0b1111 ^ id]
+        edge_counts[id] = len(case)
+        if case:
+            edges[id, : len(case)] = case
+            triangles[id, : len(case) - 2] = polygon_triangles(list(range(len(case))))
+    return edges, edge_counts, triangles
+
+
 def march_indices(simplex: list[ValuedPoint]) -> list[tuple[int, int]]:
     """Assumes the simplex is a tetrahedron, so this is marching tetrahedrons"""
     id = 0
@@ -59,47 +422,267 @@ def march_indices(simplex: list[ValuedPoint]) -> list[tuple[int, int]]:
 
 
 def march_simplex(
-    simplex: list[ValuedPoint], fn: Func, tol: np.ndarray
-) -> list[list[Point]] | tuple[list[Point], list[Point]]:
+    simplex: list[ValuedPoint], fn: Func, tol: np.ndarray, method: RootMethod = "bisect"
+) -> list[list[Point]] | None:
     indices = march_indices(simplex)
     if indices:
         points: list[Point] = []
         for i, j in indices:
-            intersection, is_zero = binary_search_zero(simplex[i], simplex[j], fn, tol)
+            intersection, is_zero = find_zero(simplex[i], simplex[j], fn, tol, method)
             assert is_zero
             points.append(intersection.pos)
-        if len(points) == 3:
-            # Single triangle
-            return [points]
-        else:
-            # quadrilateral (two triangles)
-            return [points[0], points[1], points[3]], [points[1], points[2], points[3]]
+        return polygon_triangles(points)
+
+
+def polygon_triangles(polygon: list[T]) -> list[list[T]]:
+    """Split the polygon from marching a tetrahedron into triangles"""
+    if len(polygon) == 3:
+        # Single triangle
+        return [polygon]
+    else:
+        # quadrilateral (two triangles)
+        return [[polygon[0], polygon[1], polygon[3]], [polygon[1], polygon[2], polygon[3]]]
+
+
+CASE_EDGES, CASE_EDGE_COUNTS, CASE_TRIANGLES = build_case_tables()
+
+
+def march_simplices(
+    positions: np.ndarray, values: np.ndarray, fn: BatchFunc, tol: np.ndarray, method: RootMethod = "bisect"
+) -> np.ndarray:
+    """Vectorized march_simplex over N tetrahedra, given as positions of shape (N, 4, 3) and values of shape (N, 4).
+    All crossing edges are searched together, with one call to the vectorized fn per root-finding step.
+
+    Returns the triangles as an array of shape (M, 3, 3), in the same order as repeated calls to march_simplex"""
+    # (Group 0 with negatives)
+    cases = (values > 0) @ np.array([8, 4, 2, 1])
+    # One entry per crossing edge
+    edge_counts = CASE_EDGE_COUNTS[cases]
+    edge_simplex = np.repeat(np.arange(len(cases)), edge_counts)
+    edge_starts = np.cumsum(edge_counts) - edge_counts
+    edge_slot = np.arange(len(edge_simplex)) - edge_starts[edge_simplex]
+    ij = CASE_EDGES[cases[edge_simplex], edge_slot]
+    i, j = ij[:, 0], ij[:, 1]
+    points, _, is_zero = find_zeros(
+        positions[edge_simplex, i],
+        values[edge_simplex, i],
+        positions[edge_simplex, j],
+        values[edge_simplex, j],
+        fn,
+        tol,
+        method,
+    )
+    assert np.all(is_zero)
+    # One entry per triangle: a quadrilateral (4 crossing edges) is two triangles
+    triangle_counts = edge_counts - 2 * (edge_counts > 0)
+    triangle_simplex = np.repeat(np.arange(len(cases)), triangle_counts)
+    triangle_starts = np.cumsum(triangle_counts) - triangle_counts
+    triangle_slot = np.arange(len(triangle_simplex)) - triangle_starts[triangle_simplex]
+    corners = CASE_TRIANGLES[cases[triangle_simplex], triangle_slot] + edge_starts[triangle_simplex, np.newaxis]
+    return points[corners]
+
+
+def march_task(store: VertexStore, positions: np.ndarray, values: np.ndarray, tol: np.ndarray, method: RootMethod):
+    """march_simplices with the function of store, for use with store.map_chunks.
+    If the function is not vectorized, each simplex is marched with march_simplex instead"""
+    if store.batch_fn is not None:
+        return march_simplices(positions, values, store.batch_fn, tol, method)
+    faces = []
+    for simplex_positions, simplex_values in zip(positions, values):
+        simplex = [ValuedPoint(pos, val) for pos, val in zip(simplex_positions, simplex_values)]
+        face_list = march_simplex(simplex, store.fn, tol, method)
+        if face_list is not None:
+            faces.extend(face_list)
+    return np.array(faces, dtype=np.float64).reshape(-1, 3, 3)
+
+
+def simplex_arrays(simplices: list[list[ValuedPoint]]) -> tuple[np.ndarray, np.ndarray]:
+    """Positions (N, 4, 3) and values (N, 4) of the simplices, as taken by march_simplices"""
+    positions = np.array([[v.pos for v in simplex] for simplex in simplices], dtype=np.float64).reshape(-1, 4, 3)
+    values = np.array([[v.val for v in simplex] for simplex in simplices], dtype=np.float64).reshape(-1, 4)
+    return positions, values
+
+
+class MeshBuilder:
+    """Marches simplices into an indexed mesh.
+
+    Each vertex of the mesh is the zero on an edge between two lattice points, so vertices are
+    deduplicated by the lattice keys of that edge instead of by their (floating-point) positions.
+    Where fn is exactly 0 at a lattice point, that point is the vertex of every edge ending there,
+    keyed and stored as the edge from the point to itself, and triangles collapsed by it are dropped.
+    The other zeros are all found together (with store.map_chunks) in get_mesh."""
+
+    def __init__(self, store: VertexStore, tol: np.ndarray, method: RootMethod = "bisect") -> None:
+        self.store = store
+        self.tol = tol
+        self.method = method
+        self.vertex_ids: dict[tuple[LatticeKey, LatticeKey], int] = {}
+        # The edge of each vertex, by index
+        self.edges: list[tuple[ValuedPoint, ValuedPoint]] = []
+        self.faces: list[list[int]] = []
+
+    def add_simplex(self, simplex: list[ValuedPoint]) -> None:
+        indices = march_indices(simplex)
+        if indices:
+            polygon = [self.get_vertex_id(simplex[i], simplex[j]) for i, j in indices]
+            self.faces.extend(triangle for triangle in polygon_triangles(polygon) if len(set(triangle)) == 3)
+
+    def get_vertex_id(self, p1: ValuedPoint, p2: ValuedPoint) -> int:
+        if p1.val == 0:
+            p2 = p1
+        elif p2.val == 0:
+            p1 = p2
+        edge = (p1.key, p2.key) if p1.key < p2.key else (p2.key, p1.key)
+        id = self.vertex_ids.get(edge)
+        if id is None:
+            id = self.vertex_ids[edge] = len(self.edges)
+            self.edges.append((p1, p2))
+        return id
+
+    def get_mesh(self) -> IsosurfaceMesh:
+        pos1 = np.array([p1.pos for p1, _ in self.edges], dtype=np.float64).reshape(-1, 3)
+        val1 = np.array([p1.val for p1, _ in self.edges], dtype=np.float64)
+        pos2 = np.array([p2.pos for _, p2 in self.edges], dtype=np.float64).reshape(-1, 3)
+        val2 = np.array([p2.val for _, p2 in self.edges], dtype=np.float64)
+        vertices = pos1.copy()
+        search = np.array([p1 is not p2 for p1, p2 in self.edges], dtype=bool)
+        if np.any(search):
+            vertices[search], _, is_zero = self.store.map_chunks(
+                find_edge_zeros, [pos1[search], val1[search], pos2[search], val2[search]], self.tol, self.method
+            )
+            assert np.all(is_zero)
+        return IsosurfaceMesh(vertices, np.array(self.faces, dtype=np.int32).reshape(-1, 3))
+
+
+def vertex_normals(vertices: np.ndarray, store: VertexStore, tol: np.ndarray) -> np.ndarray:
+    """Unit normals at the given positions, from the central-difference gradient of the store's function"""
+    grad = central_differences(store, vertices, tol)
+    norm = np.linalg.norm(grad, axis=1, keepdims=True)
+    return np.divide(grad, norm, out=np.zeros_like(grad), where=norm > 0)
+
+
+# Corners (bit d set for the far side along axis d) of the 6 tetrahedra that each cube of a grid is split into.
+# Each one goes from corner 0 to corner 7 along one axis at a time, so neighbouring cubes split their shared
+# faces the same way
+GRID_TETRAHEDRA = np.array([[0, 1 << a, (1 << a) | (1 << b), 7] for a, b in permutations(range(3), 2)])
+
+
+def grid_mesh(store: VertexStore, depth: int, tol: np.ndarray, method: RootMethod = "bisect") -> IsosurfaceMesh:
+    """Marching tetrahedra over all cubes of the grid at depth (see grid_values), with each cube split into
+    GRID_TETRAHEDRA. Vertices of the mesh are shared between faces, as from MeshBuilder"""
+    positions, values = grid_values(store, depth)
+    n = 1 << depth
+    flat_positions = positions.reshape(-1, 3)
+    flat_values = values.reshape(-1)
+    # (Group 0 with negatives)
+    signs = flat_values > 0
+    # Index in the flattened grid of corner 0 of each cube, and offsets to its other corners
+    cubes = np.arange(n + 1) * (n + 1) ** 2
+    cubes = (cubes[:-1, None, None] + (n + 1) * np.arange(n)[:, None] + np.arange(n)).reshape(-1)
+    offsets = np.array([(c & 1) * (n + 1) ** 2 + (c >> 1 & 1) * (n + 1) + (c >> 2 & 1) for c in range(8)])
+    corner_signs = signs[cubes[:, np.newaxis] + offsets]
+    cubes = cubes[np.any(corner_signs != corner_signs[:, :1], axis=1)]
+    # Corners of each tetrahedron of the crossing cubes, like simplices
+    tetrahedra = (cubes[:, np.newaxis, np.newaxis] + offsets[GRID_TETRAHEDRA]).reshape(-1, 4)
+    cases = signs[tetrahedra] @ np.array([8, 4, 2, 1])
+    tetrahedra = tetrahedra[CASE_EDGE_COUNTS[cases] > 0]
+    cases = cases[CASE_EDGE_COUNTS[cases] > 0]
+    # One entry per crossing edge of each tetrahedron, as in march_simplices
+    edge_counts = CASE_EDGE_COUNTS[cases]
+    edge_tetrahedron = np.repeat(np.arange(len(cases)), edge_counts)
+    edge_starts = np.cumsum(edge_counts) - edge_counts
+    edge_slot = np.arange(len(edge_tetrahedron)) - edge_starts[edge_tetrahedron]
+    ij = CASE_EDGES[cases[edge_tetrahedron], edge_slot]
+    ends1 = tetrahedra[edge_tetrahedron, ij[:, 0]]
+    ends2 = tetrahedra[edge_tetrahedron, ij[:, 1]]
+    # Tetrahedra sharing an edge share its vertex. As in MeshBuilder, a grid point where fn is exactly 0 is the
+    # vertex of every edge ending there, keyed as the edge from the point to itself
+    ends1, ends2 = np.where(flat_values[ends2] == 0, ends2, ends1), np.where(flat_values[ends1] == 0, ends1, ends2)
+    edges, vertex_ids = np.unique(
+        np.minimum(ends1, ends2) * len(flat_values) + np.maximum(ends1, ends2), return_inverse=True
+    )
+    index1, index2 = np.divmod(edges, len(flat_values))
+    vertices = flat_positions[index1]
+    search = index1 != index2
+    if np.any(search):
+        vertices[search], _, is_zero = store.map_chunks(
+            find_edge_zeros,
+            [
+                vertices[search],
+                flat_values[index1[search]],
+                flat_positions[index2[search]],
+                flat_values[index2[search]],
+            ],
+            tol,
+            method,
+        )
+        assert np.all(is_zero)
+    triangle_counts = edge_counts - 2
+    triangle_tetrahedron = np.repeat(np.arange(len(cases)), triangle_counts)
+    triangle_starts = np.cumsum(triangle_counts) - triangle_counts
+    triangle_slot = np.arange(len(triangle_tetrahedron)) - triangle_starts[triangle_tetrahedron]
+    corners = CASE_TRIANGLES[cases[triangle_tetrahedron], triangle_slot] + edge_starts[triangle_tetrahedron, np.newaxis]
+    faces = vertex_ids.reshape(-1)[corners].reshape(-1, 3)
+    # Drop the triangles collapsed by a zero at a grid point
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    return IsosurfaceMesh(vertices, faces.astype(np.int32))
 
 
 class SimplexGenerator:
-    def __init__(self, root: Cell, fn: Func) -> None:
+    def __init__(
+        self,
+        root: Cell,
+        fn: Func,
+        store: VertexStore | None = None,
+        duals: QEFDuals | None = None,
+        index: CellIndex | None = None,
+    ) -> None:
+        """store should be the VertexStore the tree was built with, so that duals can reuse its points.
+        Duals are placed with duals if given (see QEFDuals), and at the centers of cells, faces, and edges otherwise.
+        index finds the cells across faces, root.build_index() by default"""
         self.root = root
         self.fn = fn
+        self.store = tree_store(root, fn) if store is None else store
+        self.duals = duals
+        self.index = root.build_index() if index is None else index
 
     def get_simplices(self) -> Iterator[list[ValuedPoint]]:
-        return self.get_simplices_within(self.root)
+        faces = self.get_faces_within(self.root)
+        # Each face needs at most 6 duals (volume, face, and 4 edges), so the duals prefetched for a chunk
+        # are all still cached when its simplices are generated
+        step = max(1, self.store.max_duals // 6)
+        for chunk in iter(lambda: list(islice(faces, step)), []):
+            if self.store.batched and self.duals is None:
+                self.prefetch_duals(chunk)
+            for volume, face in chunk:
+                yield from self.get_simplices_between_face(volume, face)
 
-    def get_simplices_within(self, oct: Cell) -> Iterator[list[ValuedPoint]]:
-        if oct.children:
-            for child in oct.children:
-                yield from self.get_simplices_within(child)
-        else:
+    def prefetch_duals(self, faces: list[tuple[Cell, MinimalCell]]) -> None:
+        """Evaluate the midpoint duals of faces together, into the store's cache of duals"""
+        cells: list[MinimalCell] = []
+        for volume, face in faces:
+            cells.extend([volume, face])
+            cells.extend(face.get_subcell(i % 2, i // 2) for i in range(4))
+        self.store.prefetch([self.store.midpoint_key(cell.vertices[0], cell.vertices[-1]) for cell in cells])
+
+    def get_faces_within(self, oct: Cell) -> Iterator[tuple[Cell, MinimalCell]]:
+        """Pairs (volume, face) to pass to get_simplices_between_face, leaf by leaf of oct"""
+        for leaf in iter_leaves(oct):
             for axis in [0, 1, 2]:
                 for dir in [0, 1]:
-                    adj = oct.walk_leaves_in_direction(axis, dir)
-                    for leaf in adj:
-                        if leaf is None:
-                            # e.g. this is the rightmost cell with direction to the right
-                            yield from self.get_simplices_between_face(oct, oct.get_subcell(axis, dir))
-                        else:
-                            yield from self.get_simplices_between(oct, leaf, axis, dir)
-
-    def get_simplices_between(self, a: Cell, b: Cell, axis: int, dir: int) -> Iterator[list[ValuedPoint]]:
+                    adj = self.index.walk_in_direction(leaf, axis, dir)
+                    if adj is None:
+                        # e.g. this is the rightmost cell with direction to the right
+                        yield leaf, leaf.get_subcell(axis, dir)
+                    elif adj.children:
+                        # The leaves across this face are deeper, so they emit the faces they share with leaf
+                        continue
+                    elif adj.depth < leaf.depth or dir == 1:
+                        # Emit each shared face only once: from the deeper leaf,
+                        # or from the leaf on the negative side when both have the same depth
+                        yield from self.get_faces_between(leaf, adj, axis, dir)
+
+    def get_faces_between(self, a: Cell, b: Cell, axis: int, dir: int) -> Iterator[tuple[Cell, MinimalCell]]:
         """
         Parameters axis and dir are same as Cell.get_leaves_in_direction.
         They denote the direction a→b
@@ -110,7 +693,7 @@ class SimplexGenerator:
         # Now b is the same depth or deeper (smaller) than a
         face = b.get_subcell(axis, 1 - dir)
         for volume in [a, b]:
-            yield from self.get_simplices_between_face(volume, face)
+            yield volume, face
 
     def get_simplices_between_face(self, volume: Cell, face: MinimalCell) -> Iterator[list[ValuedPoint]]:
         # Each simplex comes from:
@@ -118,12 +701,15 @@ class SimplexGenerator:
         #   1 face dual
         #   1 edge dual (of an edge of their shared face)
         #   1 vertex dual (of a vertex of that edge)
+        volume_dual = self.get_dual(volume)
+        face_dual = self.get_dual(face)
         for i in range(4):
             edge = face.get_subcell(i % 2, i // 2)
+            edge_dual = self.get_dual(edge)
             for v in edge.vertices:
-                yield [
-                    volume.get_dual(self.fn),
-                    face.get_dual(self.fn),
-                    edge.get_dual(self.fn),
-                    v,
-                ]
+                yield [volume_dual, face_dual, edge_dual, v]
+
+    def get_dual(self, cell: MinimalCell) -> ValuedPoint:
+        if self.duals is not None:
+            return self.duals.dual(cell)
+        return cell.get_dual(self.store)
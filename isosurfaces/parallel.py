@@ -0,0 +1,246 @@
+"""Evaluating fn concurrently: in a pool of worker processes, or as an async function awaited in an event loop.
+
+A ProcessPoolStore or AsyncStore is a drop-in VertexStore: building the tree evaluates each level's new
+vertices together (see VertexStore.flush), and the plotting functions find zeros along crossing edges
+concurrently (see VertexStore.map_chunks). The tree, the order of work, and every evaluated point are the
+same as with a plain VertexStore, so the output is identical to the serial path."""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Sequence
+
+import numpy as np
+
+from .cache import EvaluationCache
+from .point import MAX_DUALS, Func, Point, T, VertexStore
+from .stats import current_purpose
+
+# Fewer rows than this are not worth sending to another process
+MIN_CHUNK = 256
+# Chunks per worker, so that workers finishing early can pick up more
+CHUNKS_PER_WORKER = 4
+# Default number of calls of an async fn awaited at once
+MAX_IN_FLIGHT = 64
+
+# An async Func (or BatchFunc, if vectorized)
+AsyncFunc = Callable[[Point], Awaitable[float]]
+
+# The store each worker process evaluates fn with, set by init_worker
+worker_store: VertexStore | None = None
+# Which of the functions given to ProcessPoolStore.set_fn worker_store evaluates
+worker_generation = 0
+
+
+def init_worker(fn: Func, pmin: Point, pmax: Point, vectorized: bool, cache: EvaluationCache | None) -> None:
+    global worker_store
+    worker_store = VertexStore(fn, pmin, pmax, vectorized, cache=cache)
+
+
+def run_task(
+    task: Callable[..., T], arrays: Sequence[np.ndarray], args: tuple, generation: int = 0, fn: bytes | None = None
+) -> T:
+    """task on worker_store, after switching it to the pickled fn of generation if it has an older one"""
+    global worker_generation
+    if generation != worker_generation:
+        worker_store.set_fn(pickle.loads(fn))
+        worker_generation = generation
+    return task(worker_store, *arrays, *args)
+
+
+def evaluate_task(store: VertexStore, positions: np.ndarray) -> np.ndarray:
+    return VertexStore.evaluate_uncached(store, positions)
+
+
+class ProcessPoolStore(VertexStore):
+    """VertexStore that evaluates points in batches spread over a pool of worker processes.
+
+    Workers are forked where the platform allows it, so fn can be anything (such as a lambda).
+    Elsewhere fn is pickled to start each worker. set_fn sends a new fn to the running workers if it can be
+    pickled, and otherwise restarts them. Use as a context manager, or call close() when done"""
+
+    def __init__(
+        self,
+        fn: Func,
+        pmin: Point,
+        pmax: Point,
+        vectorized: bool = False,
+        workers: int | None = None,
+        max_duals: int = MAX_DUALS,
+        cache: EvaluationCache | None = None,
+    ) -> None:
+        """workers defaults to one per CPU. With a cache, the workers only read from it, and the values they
+        compute for evaluate are added to it by this process"""
+        super().__init__(fn, pmin, pmax, vectorized, max_duals, cache)
+        self.pmax = pmax
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = self.start_workers(fn)
+        # The fn the workers evaluate, as a generation sent along with each task and its pickle (see run_task)
+        self.generation = 0
+        self.pickled_fn: bytes | None = None
+
+    def start_workers(self, fn: Func) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        args = (fn, self.pmin, self.pmax, self.vectorized, self.cache)
+        return ProcessPoolExecutor(self.workers, context, init_worker, args)
+
+    def set_fn(self, fn: Func) -> None:
+        super().set_fn(fn)
+        if not hasattr(self, "executor"):
+            # Called from __init__, before the workers exist
+            return
+        try:
+            self.pickled_fn = pickle.dumps(fn)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # e.g. a lambda, which the workers can only get by being forked again
+            self.executor.shutdown()
+            self.executor = self.start_workers(fn)
+            self.generation = 0
+            self.pickled_fn = None
+            return
+        self.generation += 1
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        super().close()
+
+    @property
+    def batched(self) -> bool:
+        return True
+
+    def evaluate_uncached(self, positions: np.ndarray) -> np.ndarray:
+        return self.map_chunks(evaluate_task, [positions])
+
+    def map_chunks(self, task: Callable[..., T], arrays: Sequence[np.ndarray], *args) -> T:
+        n = len(arrays[0])
+        chunks = min(CHUNKS_PER_WORKER * self.workers, n // MIN_CHUNK)
+        if chunks <= 1:
+            return task(self, *arrays, *args)
+        if task is evaluate_task and self.observer is not None:
+            # The workers' evaluations are not counted where they happen
+            self.observer.evaluated(current_purpose(), n)
+        futures = [
+            self.executor.submit(run_task, task, chunk, args, self.generation, self.pickled_fn)
+            for chunk in split_rows(arrays, chunks)
+        ]
+        return concatenate_results([future.result() for future in futures])
+
+
+@dataclass
+class AsyncFunction:
+    """An async fn, made callable from threads other than the one running loop, which is where it is awaited.
+    At most max_in_flight calls are awaited at once.
+
+    Construct it from a coroutine running in loop"""
+
+    fn: AsyncFunc
+    loop: asyncio.AbstractEventLoop
+    max_in_flight: int = MAX_IN_FLIGHT
+    semaphore: asyncio.Semaphore = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    def __call__(self, p: Point) -> Any:
+        """fn(p), blocking until it is done"""
+        return asyncio.run_coroutine_threadsafe(self.limited(p), self.loop).result()
+
+    def map(self, positions: np.ndarray) -> np.ndarray:
+        """fn at each of positions, awaited concurrently, blocking until all are done"""
+        return np.array(asyncio.run_coroutine_threadsafe(self.gather(positions), self.loop).result(), dtype=np.float64)
+
+    async def limited(self, p: Point) -> Any:
+        async with self.semaphore:
+            return await self.fn(p)
+
+    async def gather(self, positions: np.ndarray) -> list[float]:
+        return await asyncio.gather(*(self.limited(p) for p in positions))
+
+
+class AsyncStore(VertexStore):
+    """VertexStore that evaluates an AsyncFunction, awaiting the points of each batch concurrently.
+
+    map_chunks runs chunks of rows in threads, so that up to fn.max_in_flight searches along edges
+    can wait on fn at once. Use it from a thread other than the one running fn.loop, as a context manager,
+    or call close() when done"""
+
+    def __init__(
+        self,
+        fn: AsyncFunction,
+        pmin: Point,
+        pmax: Point,
+        vectorized: bool = False,
+        max_duals: int = MAX_DUALS,
+        cache: EvaluationCache | None = None,
+    ) -> None:
+        """If vectorized is True, fn takes an (N, dim) array of points, and each batch is a single call"""
+        super().__init__(fn, pmin, pmax, vectorized, max_duals, cache)
+        self.executor = ThreadPoolExecutor(fn.max_in_flight)
+
+    def set_fn(self, fn: AsyncFunction) -> None:
+        super().set_fn(fn)
+        self.async_fn = fn
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        super().close()
+
+    @property
+    def batched(self) -> bool:
+        return True
+
+    def evaluate_uncached(self, positions: np.ndarray) -> np.ndarray:
+        if self.uncached_batch_fn is not None:
+            return np.asarray(self.uncached_batch_fn(positions), dtype=np.float64)
+        if self.observer is not None:
+            self.observer.evaluated(current_purpose(), len(positions))
+        return self.async_fn.map(positions)
+
+    def map_chunks(self, task: Callable[..., T], arrays: Sequence[np.ndarray], *args) -> T:
+        chunks = min(self.async_fn.max_in_flight, len(arrays[0]))
+        if chunks <= 1:
+            return task(self, *arrays, *args)
+        # Each chunk runs in a copy of the calling context, so that it reports to the same observer (see stats)
+        futures = [
+            self.executor.submit(contextvars.copy_context().run, task, self, *chunk, *args)
+            for chunk in split_rows(arrays, chunks)
+        ]
+        return concatenate_results([future.result() for future in futures])
+
+
+def split_rows(arrays: Sequence[np.ndarray], chunks: int) -> list[list[np.ndarray]]:
+    """arrays split into chunks consecutive ranges of rows, for VertexStore.map_chunks"""
+    bounds = np.linspace(0, len(arrays[0]), chunks + 1).astype(int)
+    return [[a[start:end] for a in arrays] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def concatenate_results(results: list[T]) -> T:
+    """Joins the results of a task called on each chunk from split_rows"""
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+    return np.concatenate(results)
+
+
+def make_store(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    vectorized: bool = False,
+    workers: int | None = 1,
+    cache: EvaluationCache | None = None,
+) -> VertexStore:
+    """A plain VertexStore if workers is 1, otherwise a ProcessPoolStore with that many workers
+    (or one per CPU if workers is None). An AsyncStore if fn is an AsyncFunction"""
+    if isinstance(fn, AsyncFunction):
+        if workers != 1:
+            raise ValueError("An async fn is awaited in its event loop, so workers must be 1")
+        return AsyncStore(fn, pmin, pmax, vectorized, cache=cache)
+    if workers == 1:
+        return VertexStore(fn, pmin, pmax, vectorized, cache=cache)
+    return ProcessPoolStore(fn, pmin, pmax, vectorized, workers, cache=cache)
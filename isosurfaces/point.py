@@ -1,13 +1,34 @@
 # to support ValuedPoint type inside ValuedPoint
 from __future__ import annotations
 
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Hashable, Sequence, Tuple, TypeVar
 
 import numpy as np
 
+from .stats import counted, current_observer, evaluating
+
+if TYPE_CHECKING:
+    from .cache import ValueCache
+
 Point = np.ndarray
 Func = Callable[[Point], float]
+# Vectorized form of Func: takes an (N, dim) array of points and returns the N values
+BatchFunc = Callable[[np.ndarray], np.ndarray]
+# Integer coordinates of a point on the lattice formed by subdividing the root cell LATTICE_DEPTH times
+LatticeKey = Tuple[int, ...]
+# Cells deeper than this would have vertices closer together than float64 can distinguish anyway
+LATTICE_DEPTH = 52
+# Default number of dual points a VertexStore remembers
+MAX_DUALS = 1 << 16
+
+T = TypeVar("T")
+
+
+def scalar_fn(fn: BatchFunc) -> Func:
+    """Adapt a vectorized function to be called on a single point"""
+    return lambda p: fn(p[np.newaxis])[0]
 
 
 @dataclass
@@ -16,6 +37,8 @@ class ValuedPoint:
 
     pos: Point
     val: float = None
+    # Only set for points on the lattice of a VertexStore
+    key: LatticeKey | None = None
 
     def calc(self, fn: Func) -> ValuedPoint:
         self.val = fn(self.pos)
@@ -43,22 +66,187 @@ def binary_search_zero(p1: ValuedPoint, p2: ValuedPoint, fn: Func, tol: np.ndarr
     """Returns a pair `(point, is_zero: bool)`
 
     Use is_zero to make sure it's not an asymptote like at x=0 on f(x,y) = 1/(xy) - 1"""
-    if np.all(np.abs(p2.pos - p1.pos) < tol):
-        # Binary search stop condition: too small to matter
-        pt = ValuedPoint.intersectZero(p1, p2, fn)
-        is_zero: bool = pt.val == 0 or (
-            np.sign(pt.val - p1.val) == np.sign(p2.val - pt.val)
-            # Just want to prevent ≈inf from registering as a zero
-            and np.abs(pt.val < 1e200)
-        )
-        return pt, is_zero
-    else:
+    while not np.all(np.abs(p2.pos - p1.pos) < tol):
         # binary search
         mid = ValuedPoint.midpoint(p1, p2, fn)
         if mid.val == 0:
             return mid, True
         # (Group 0 with negatives)
         elif (mid.val > 0) == (p1.val > 0):
-            return binary_search_zero(mid, p2, fn, tol)
+            p1 = mid
         else:
-            return binary_search_zero(p1, mid, fn, tol)
+            p2 = mid
+    # Binary search stop condition: too small to matter
+    pt = ValuedPoint.intersectZero(p1, p2, fn)
+    is_zero: bool = pt.val == 0 or (
+        np.sign(pt.val - p1.val) == np.sign(p2.val - pt.val)
+        # Just want to prevent ≈inf from registering as a zero
+        and np.abs(pt.val) < 1e200
+    )
+    return pt, is_zero
+
+
+class VertexStore:
+    """Function values of lattice points, so that each lattice point is evaluated at most once.
+
+    Every vertex of a cell in the tree lies on the lattice, and so does every midpoint of two vertices,
+    which is how cells, faces, and edges compute their duals. Points are shared by identity between
+    all of the cells that use them.
+
+    Vertices of the tree are kept for the lifetime of the store, while dual points are kept in a
+    least-recently-used cache of at most max_duals points."""
+
+    def __init__(
+        self,
+        fn: Func,
+        pmin: Point,
+        pmax: Point,
+        vectorized: bool = False,
+        max_duals: int = MAX_DUALS,
+        cache: ValueCache | None = None,
+    ) -> None:
+        """If vectorized is True, fn is a BatchFunc, used to evaluate deferred points all at once.
+        If cache is given, all evaluations of fn go through it.
+        Evaluations are reported to the observer active when the store is created, if any (see stats.observe)"""
+        self.cache = cache
+        self.vectorized = vectorized
+        self.set_fn(fn)
+        self.dim = len(pmin)
+        self.pmin = pmin
+        self.scale = (pmax - pmin) / (1 << LATTICE_DEPTH)
+        self.points: dict[LatticeKey, ValuedPoint] = {}
+        self.pending: list[ValuedPoint] = []
+        self.duals: OrderedDict[Hashable, ValuedPoint] = OrderedDict()
+        self.max_duals = max_duals
+        # Where to look for vertices of the tree that are not kept in points, such as in an ArrayTree
+        self.lookup: Callable[[LatticeKey], ValuedPoint | None] | None = None
+
+    def set_fn(self, fn: Func) -> None:
+        """Evaluate fn from now on, reporting to the observer active now. Points already evaluated keep their
+        values"""
+        self.observer = current_observer()
+        vectorized = self.vectorized
+        if self.observer is not None:
+            fn = counted(fn, vectorized, self.observer)
+        # What evaluate_uncached calls
+        self.uncached_batch_fn: BatchFunc | None = fn if vectorized else None
+        self.uncached_fn: Func = scalar_fn(fn) if vectorized else fn
+        if self.cache is not None:
+            fn = self.cache.wrap(fn, vectorized)
+        self.batch_fn: BatchFunc | None = fn if vectorized else None
+        self.fn: Func = scalar_fn(fn) if vectorized else fn
+
+    def __enter__(self) -> VertexStore:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release any resources held for evaluating fn"""
+        if self.cache is not None:
+            self.cache.flush()
+
+    @property
+    def batched(self) -> bool:
+        """Whether evaluating many points at once (see flush and evaluate) is faster than one at a time"""
+        return self.batch_fn is not None
+
+    def evaluate(self, positions: np.ndarray) -> np.ndarray:
+        """Values (N,) at the positions (N, dim), in a single call if fn is vectorized"""
+        if self.cache is not None:
+            return self.cache.evaluate(positions, self.evaluate_uncached)
+        return self.evaluate_uncached(positions)
+
+    def evaluate_uncached(self, positions: np.ndarray) -> np.ndarray:
+        """Same as evaluate, without going through the cache"""
+        if self.uncached_batch_fn is not None:
+            return np.asarray(self.uncached_batch_fn(positions), dtype=np.float64)
+        return np.array([self.uncached_fn(p) for p in positions], dtype=np.float64)
+
+    def map_chunks(self, task: Callable[..., T], arrays: Sequence[np.ndarray], *args) -> T:
+        """Returns task(self, *arrays, *args).
+
+        task must treat each row (along the first axis) of arrays independently, and return an array or
+        tuple of arrays with results in the same row order, because subclasses may instead call it on
+        consecutive chunks of rows and concatenate the results"""
+        return task(self, *arrays, *args)
+
+    def position(self, key: LatticeKey) -> Point:
+        return self.pmin + np.array(key) * self.scale
+
+    def get(self, key: LatticeKey, defer: bool = False) -> ValuedPoint:
+        """If defer is True, a new point is not evaluated until the next flush()"""
+        point = self.points.get(key)
+        if point is None:
+            point = self.points[key] = ValuedPoint(self.position(key), None, key)
+            if defer:
+                self.pending.append(point)
+            else:
+                point.calc(self.fn)
+        return point
+
+    def find(self, key: LatticeKey) -> ValuedPoint | None:
+        """Returns the vertex of the tree at key, if there is one"""
+        point = self.points.get(key)
+        if point is None and self.lookup is not None:
+            return self.lookup(key)
+        return point
+
+    def flush(self) -> None:
+        """Evaluate all deferred points together with evaluate"""
+        if self.pending:
+            vals = self.evaluate(np.array([p.pos for p in self.pending]))
+            for point, val in zip(self.pending, vals):
+                point.val = val
+        self.pending = []
+
+    @staticmethod
+    def midpoint_key(p1: ValuedPoint, p2: ValuedPoint) -> LatticeKey:
+        return tuple((a + b) >> 1 for a, b in zip(p1.key, p2.key))
+
+    def midpoint(self, p1: ValuedPoint, p2: ValuedPoint, defer: bool = False) -> ValuedPoint:
+        return self.get(self.midpoint_key(p1, p2), defer)
+
+    def dual(self, p1: ValuedPoint, p2: ValuedPoint) -> ValuedPoint:
+        """Midpoint of p1 and p2, for use as a dual point rather than as a vertex of the tree"""
+        key = self.midpoint_key(p1, p2)
+        point = self.find(key)
+        if point is not None:
+            return point
+        return self.cached_dual(key, lambda: ValuedPoint(self.position(key), None, key).calc(self.fn))
+
+    def cached_dual(self, key: Hashable, compute: Callable[[], ValuedPoint], purpose: str = "dual") -> ValuedPoint:
+        """Returns the dual point cached under key, calling compute() to create it if it is missing.
+        purpose is what its evaluations of fn are for (see stats.PURPOSES)"""
+        point = self.duals.get(key)
+        if self.observer is not None:
+            self.observer.cache_accessed("duals", int(point is not None), int(point is None))
+        if point is None:
+            if self.observer is None:
+                point = compute()
+            else:
+                with evaluating(purpose):
+                    point = compute()
+            self.duals[key] = point
+            if len(self.duals) > self.max_duals:
+                self.duals.popitem(last=False)
+        else:
+            self.duals.move_to_end(key)
+        return point
+
+    def prefetch(self, keys: Sequence[LatticeKey]) -> None:
+        """Evaluate the points at keys that are neither vertices nor cached duals together, as duals"""
+        keys = [key for key in dict.fromkeys(keys) if key not in self.duals and self.find(key) is None]
+        if keys:
+            positions = np.array([self.position(key) for key in keys])
+            with evaluating("dual"):
+                vals = self.evaluate(positions)
+            for key, pos, val in zip(keys, positions, vals):
+                self.cached_dual(key, lambda: ValuedPoint(pos, val, key))
+
+    def root_vertices(self, defer: bool = False) -> list[ValuedPoint]:
+        """Vertices of the cell [pmin, pmax], in the same order as MinimalCell.vertices"""
+        return [
+            self.get(tuple((i >> d & 1) << LATTICE_DEPTH for d in range(self.dim)), defer) for i in range(1 << self.dim)
+        ]
@@ -0,0 +1,271 @@
+"""Batched root finding along edges.
+
+Every method keeps a bracket [a, b] of parameters along the edge pos1--pos2, with the function having
+a different sign (grouping 0 with negatives) at each end, and refines all unfinished edges together
+with one call to the vectorized function per step. Refinement stops once the bracket is smaller than
+tol along every axis, and the zero of the secant line through the final bracket is taken as the root,
+exactly as in binary_search_zero."""
+
+from __future__ import annotations
+
+from typing import Callable, Literal
+
+import numpy as np
+
+from .point import BatchFunc, Func, ValuedPoint, VertexStore, binary_search_zero
+from .stats import current_observer, evaluating
+
+# - "bisect": halve the bracket every step. Same points as binary_search_zero
+# - "illinois": regula falsi, halving the value kept at an endpoint that is retained twice in a row
+# - "brent": Brent's method, combining inverse quadratic interpolation, secant steps, and bisection
+RootMethod = Literal["bisect", "illinois", "brent"]
+ROOT_METHODS = ("bisect", "illinois", "brent")
+# Evaluates the points at the given parameters of the given edges, and records any exact zeros
+Evaluator = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def find_zero(
+    p1: ValuedPoint, p2: ValuedPoint, fn: Func, tol: np.ndarray, method: RootMethod = "bisect"
+) -> tuple[ValuedPoint, bool]:
+    """Same as binary_search_zero, but using the given method"""
+    if method == "bisect":
+        observer = current_observer()
+        if observer is None:
+            return binary_search_zero(p1, p2, fn, tol)
+        evaluations = 0
+
+        def counted_fn(p: np.ndarray) -> float:
+            nonlocal evaluations
+            evaluations += 1
+            return fn(p)
+
+        with evaluating("root"):
+            result = binary_search_zero(p1, p2, counted_fn, tol)
+        observer.roots_found(np.array([evaluations]))
+        return result
+    points, vals, is_zero = find_zeros(
+        p1.pos[np.newaxis],
+        np.array([p1.val]),
+        p2.pos[np.newaxis],
+        np.array([p2.val]),
+        lambda pts: np.array([fn(p) for p in pts]),
+        tol,
+        method,
+    )
+    return ValuedPoint(points[0], vals[0]), bool(is_zero[0])
+
+
+def find_edge_zeros(
+    store: VertexStore,
+    pos1: np.ndarray,
+    val1: np.ndarray,
+    pos2: np.ndarray,
+    val2: np.ndarray,
+    tol: np.ndarray,
+    method: RootMethod = "bisect",
+    vectorized: bool = True,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Same as find_zeros using the function of store, for use with store.map_chunks.
+
+    If vectorized is False, or the function is not vectorized, each edge is searched with find_zero instead"""
+    if vectorized and store.batch_fn is not None:
+        return find_zeros(pos1, val1, pos2, val2, store.batch_fn, tol, method)
+    results = [
+        find_zero(ValuedPoint(p1, v1), ValuedPoint(p2, v2), store.fn, tol, method)
+        for p1, v1, p2, v2 in zip(pos1, val1, pos2, val2)
+    ]
+    points = np.array([point.pos for point, _ in results], dtype=np.float64).reshape(-1, pos1.shape[1])
+    vals = np.array([point.val for point, _ in results], dtype=np.float64)
+    is_zero = np.array([is_zero for _, is_zero in results], dtype=bool)
+    return points, vals, is_zero
+
+
+def find_zeros(
+    pos1: np.ndarray,
+    val1: np.ndarray,
+    pos2: np.ndarray,
+    val2: np.ndarray,
+    fn: BatchFunc,
+    tol: np.ndarray,
+    method: RootMethod = "bisect",
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized find_zero over N edges pos1[k]--pos2[k] (arrays of shape (N, dim) and (N,))
+
+    Returns a triple `(points, vals, is_zero)` of arrays of shape (N, dim), (N,), and (N,).
+    Use is_zero to make sure it's not an asymptote like at x=0 on f(x,y) = 1/(xy) - 1"""
+    if method not in ROOT_METHODS:
+        raise ValueError(f"Unknown root finding method {method!r}, expected one of {ROOT_METHODS}")
+    with evaluating("root"):
+        return search_zeros(pos1, val1, pos2, val2, fn, tol, method)
+
+
+def search_zeros(
+    pos1: np.ndarray,
+    val1: np.ndarray,
+    pos2: np.ndarray,
+    val2: np.ndarray,
+    fn: BatchFunc,
+    tol: np.ndarray,
+    method: RootMethod,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """find_zeros, after checking method"""
+    pos1 = np.asarray(pos1, dtype=np.float64)
+    direction = np.asarray(pos2, dtype=np.float64) - pos1
+    n = len(pos1)
+    # A bracket narrower than t_tol (in parameter space) is smaller than tol along every axis
+    with np.errstate(divide="ignore"):
+        t_tol = np.min(np.where(direction != 0, tol / np.abs(direction), np.inf), axis=1, initial=np.inf)
+    t = np.zeros(n)
+    val = np.asarray(val1, dtype=np.float64).copy()
+    exact = np.zeros(n, dtype=bool)
+    # Evaluations of fn spent on each edge
+    evaluations = np.zeros(n, dtype=np.int64)
+
+    def evaluate(idx: np.ndarray, x: np.ndarray) -> np.ndarray:
+        evaluations[idx] += 1
+        fx = np.asarray(fn(pos1[idx] + x[:, np.newaxis] * direction[idx]), dtype=np.float64)
+        # Edges where a step hit exactly 0 are finished
+        is_exact = fx == 0
+        exact[idx[is_exact]] = True
+        t[idx[is_exact]] = x[is_exact]
+        val[idx[is_exact]] = 0
+        return fx
+
+    a, fa = np.zeros(n), val.copy()
+    b, fb = np.ones(n), np.asarray(val2, dtype=np.float64).copy()
+    if method == "brent":
+        brent(a, fa, b, fb, t_tol, exact, evaluate)
+    else:
+        bracketing(a, fa, b, fb, t_tol, exact, evaluate, method == "illinois")
+
+    points = pos1 + t[:, np.newaxis] * direction
+    inexact = np.nonzero(~exact)[0]
+    if len(inexact) > 0:
+        # Binary search stop condition: too small to matter. Find the zero of the secant line
+        denom = fa[inexact] - fb[inexact]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k1 = -fb[inexact] / denom
+            k2 = fa[inexact] / denom
+        pt = k1[:, np.newaxis] * (pos1[inexact] + a[inexact, np.newaxis] * direction[inexact])
+        pt += k2[:, np.newaxis] * (pos1[inexact] + b[inexact, np.newaxis] * direction[inexact])
+        points[inexact] = pt
+        val[inexact] = fn(pt)
+        evaluations[inexact] += 1
+    between = np.sign(val - fa) == np.sign(fb - val)
+    if method != "bisect":
+        # Interpolating methods can converge onto one end of the bracket, where rounding may put the secant
+        # point's value just outside the bracket. Still accept it if it is no larger than at either end
+        # (which never happens near an asymptote) or if it is zero up to rounding
+        scale = np.maximum(np.abs(val1), np.abs(val2))
+        between |= np.abs(val) <= np.maximum(np.minimum(np.abs(fa), np.abs(fb)), 64 * np.finfo(np.float64).eps * scale)
+    is_zero = exact | (val == 0)
+    # Just want to prevent ≈inf from registering as a zero
+    is_zero |= ~exact & between & (np.abs(val) < 1e200)
+    observer = current_observer()
+    if observer is not None:
+        observer.roots_found(evaluations)
+    return points, val, is_zero
+
+
+def bracketing(
+    a: np.ndarray,
+    fa: np.ndarray,
+    b: np.ndarray,
+    fb: np.ndarray,
+    t_tol: np.ndarray,
+    exact: np.ndarray,
+    evaluate: Evaluator,
+    illinois: bool,
+) -> None:
+    """Bisection or Illinois-modified regula falsi, updating the brackets a < b in place"""
+    # The values used for the secant step, which the Illinois modification scales down
+    ga, gb = fa.copy(), fb.copy()
+    # Which end was replaced in the previous step: 0 for a, 1 for b, -1 for neither
+    last = np.full(len(a), -1)
+    active = np.nonzero(~exact & (b - a >= t_tol))[0]
+    while len(active) > 0:
+        i = active
+        mid = (a[i] + b[i]) / 2
+        if illinois:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = (a[i] * gb[i] - b[i] * ga[i]) / (gb[i] - ga[i])
+            # Stay at least half of t_tol inside the bracket, so both ends keep closing in
+            margin = np.minimum(t_tol[i], b[i] - a[i]) / 2
+            x = np.clip(x, a[i] + margin, b[i] - margin)
+            # Fall back to bisection when the values are infinite or undefined
+            x = np.where(np.isfinite(x), x, mid)
+        else:
+            x = mid
+        fx = evaluate(i, x)
+        # (Group 0 with negatives)
+        replace_a = (fx > 0) == (fa[i] > 0)
+        ra, rb = i[replace_a], i[~replace_a]
+        a[ra], fa[ra], ga[ra] = x[replace_a], fx[replace_a], fx[replace_a]
+        b[rb], fb[rb], gb[rb] = x[~replace_a], fx[~replace_a], fx[~replace_a]
+        if illinois:
+            # The other end was retained twice in a row, so halve its value to speed up convergence
+            gb[ra[last[ra] == 0]] /= 2
+            ga[rb[last[rb] == 1]] /= 2
+            last[ra] = 0
+            last[rb] = 1
+        active = i[~exact[i] & (b[i] - a[i] >= t_tol[i])]
+
+
+def brent(
+    a: np.ndarray,
+    fa: np.ndarray,
+    b: np.ndarray,
+    fb: np.ndarray,
+    t_tol: np.ndarray,
+    exact: np.ndarray,
+    evaluate: Evaluator,
+) -> None:
+    """Brent's method (as in Numerical Recipes' zbrent), leaving the final brackets in a, b"""
+    # b is the best estimate, c the other end of the bracket, and a the previous value of b
+    c, fc = b.copy(), fb.copy()
+    # d is the latest step, and e the one before
+    d = np.zeros(len(a))
+    e = np.zeros(len(a))
+    active = np.nonzero(~exact)[0]
+    while True:
+        i = active
+        # (Group 0 with negatives) Make sure b and c bracket the zero
+        same = (fb[i] > 0) == (fc[i] > 0)
+        j = i[same]
+        c[j], fc[j] = a[j], fa[j]
+        d[j] = e[j] = b[j] - a[j]
+        # Make b the end with the smaller value
+        swap = np.abs(fc[i]) < np.abs(fb[i])
+        j = i[swap]
+        a[j], fa[j] = b[j], fb[j]
+        b[j], fb[j] = c[j], fc[j]
+        c[j], fc[j] = a[j], fa[j]
+        tol1 = 2 * np.finfo(np.float64).eps * np.abs(b[i]) + 0.5 * t_tol[i]
+        xm = 0.5 * (c[i] - b[i])
+        keep = np.abs(xm) >= tol1
+        i, tol1, xm = i[keep], tol1[keep], xm[keep]
+        if len(i) == 0:
+            break
+        # Try interpolation, falling back to bisection
+        step = xm.copy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            interpolate = (np.abs(e[i]) >= tol1) & (np.abs(fa[i]) > np.abs(fb[i]))
+            s = fb[i] / fa[i]
+            q_ = fa[i] / fc[i]
+            r = fb[i] / fc[i]
+            secant = a[i] == c[i]
+            p = np.where(secant, 2 * xm * s, s * (2 * xm * q_ * (q_ - r) - (b[i] - a[i]) * (r - 1)))
+            q = np.where(secant, 1 - s, (q_ - 1) * (r - 1) * (s - 1))
+            q = np.where(p > 0, -q, q)
+            p = np.abs(p)
+            accept = interpolate & (2 * p < np.minimum(3 * xm * q - np.abs(tol1 * q), np.abs(e[i] * q)))
+            step[accept] = p[accept] / q[accept]
+        e[i] = np.where(accept, d[i], xm)
+        d[i] = step
+        a[i], fa[i] = b[i], fb[i]
+        x = b[i] + np.where(np.abs(step) > tol1, step, np.where(xm >= 0, tol1, -tol1))
+        fx = evaluate(i, x)
+        b[i], fb[i] = x, fx
+        active = i[~exact[i]]
+    # Leave the final bracket as (a, b), for the secant step and the is_zero check
+    a[:], fa[:] = c, fc
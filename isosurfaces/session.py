@@ -0,0 +1,123 @@
+"""Plotting a family of functions, such as the frames of an animation, reusing work between them."""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+from .cell import BoundsFunc, Cell, RefinementCriterion, refine_tree
+from .isoline import CurveTracer, Triangulator
+from .parallel import make_store
+from .point import Func, LatticeKey, Point, ValuedPoint, VertexStore
+from .roots import RootMethod
+from .stats import report_tree, stage
+
+
+class IsolineSession:
+    """Plots isolines of one function after another over the same region, like plot_isoline
+    with the same arguments, but keeping the quadtree and its points from one plot to the next.
+
+    Each plot re-evaluates the kept points together through the store (in a single batch, if vectorized),
+    then splits and merges only the quads where fn changed enough to change the quadtree
+    (see refine_tree), and only triangulates between quads that the isoline passes between.
+    This pays off when consecutive functions are similar, as in an animation of f(x, y; t).
+
+    The store, and with workers its pool of processes, is created by the first plot and kept until close().
+    Functions that can be pickled are sent to the running workers, while others (such as lambdas) restart them.
+    Use the session as a context manager, or call close() when done.
+
+    The curves are the same as plot_isoline would return for each function"""
+
+    def __init__(
+        self,
+        pmin: Point,
+        pmax: Point,
+        min_depth: int = 5,
+        max_quads: int = 10000,
+        tol: np.ndarray | None = None,
+        vectorized: bool = False,
+        root_method: RootMethod = "bisect",
+        workers: int | None = 1,
+        criteria: Sequence[RefinementCriterion] = (),
+    ) -> None:
+        """The arguments have the same meaning as for plot_isoline"""
+        self.pmin = np.asarray(pmin)
+        self.pmax = np.asarray(pmax)
+        self.tol = (self.pmax - self.pmin) / 1000 if tol is None else np.asarray(tol)
+        self.min_depth = min_depth
+        self.max_quads = max_quads
+        self.vectorized = vectorized
+        self.root_method = root_method
+        self.workers = workers
+        self.criteria = criteria
+        self.root: Cell | None = None
+        # The vertices of the quadtree and the centers of its leaves, by lattice key
+        self.points: dict[LatticeKey, ValuedPoint] = {}
+        self.store: VertexStore | None = None
+
+    def __enter__(self) -> IsolineSession:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the store, such as its worker processes. A later plot creates a new one"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def plot(self, fn: Func, bounds: BoundsFunc | None = None) -> list[list[Point]]:
+        """Get the curves of fn([x,y])=0, as plot_isoline does. bounds, if given, has to bound this fn"""
+        store = self.use_store(fn)
+        self.reevaluate(store)
+        if self.root is None:
+            self.root = Cell(2, store.root_vertices(defer=True), 0, [], None, 0)
+            store.flush()
+        with stage("tree"):
+            refine_tree(self.root, store, self.min_depth, self.max_quads, self.tol, self.criteria, bounds)
+            self.points = store.points = self.collect_points(store)
+        report_tree(self.root)
+        with stage("triangulate"):
+            triangles = Triangulator(
+                self.root, store.fn, self.tol, store, self.root_method, crossing_only=True
+            ).triangulate()
+        with stage("trace"):
+            return CurveTracer(triangles, store.fn, self.tol).trace()
+
+    def use_store(self, fn: Func) -> VertexStore:
+        """The store of the session, created on first use, switched to evaluating fn"""
+        if self.store is None:
+            self.store = make_store(fn, self.pmin, self.pmax, self.vectorized, self.workers)
+        else:
+            self.store.set_fn(fn)
+            # The cached duals have values of the previous function
+            self.store.duals.clear()
+        return self.store
+
+    def reevaluate(self, store: VertexStore) -> None:
+        """Evaluate all kept points with the store's function, and give them to the store"""
+        store.points = self.points
+        points = list(self.points.values())
+        if points:
+            vals = store.evaluate(np.array([p.pos for p in points]))
+            for point, val in zip(points, vals):
+                point.val = val
+
+    def collect_points(self, store: VertexStore) -> dict[LatticeKey, ValuedPoint]:
+        """The points to keep for the next plot: vertices of the quadtree, which drops the vertices of merged quads,
+        and the centers of its leaves (their duals), which are evaluated here along with the other points"""
+        points: dict[LatticeKey, ValuedPoint] = {}
+        cells = [self.root]
+        while cells:
+            cell = cells.pop()
+            for v in cell.vertices:
+                points[v.key] = v
+            if cell.children:
+                cells.extend(cell.children)
+            else:
+                center = store.midpoint(cell.vertices[0], cell.vertices[-1], defer=True)
+                points[center.key] = center
+        store.flush()
+        return points
@@ -0,0 +1,187 @@
+"""Instrumentation of the plotting functions: the time spent in each stage, evaluations of fn by purpose,
+leaves of the tree by depth, evaluations spent searching each edge for a zero, and cache hit rates.
+
+Nothing is recorded unless an observer is active, which observe() makes it for the plotting functions called
+within it (in the same thread, or in the threads of the async plotting functions). They report to it through
+the methods of PlotObserver, which PlotStats implements by adding everything up. When no observer is active,
+each place that reports costs a single check.
+
+Evaluations of fn in worker processes (with workers other than 1) are only counted for batches of points,
+not for the searches for zeros that run in the workers."""
+
+from __future__ import annotations
+
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Iterator, TypeVar
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .cell import Cell
+
+T = TypeVar("T")
+
+# What evaluations of fn are for:
+# - "vertex": vertices of the tree (and the points the tree is refined by, such as centers for LinearityTest)
+# - "dual": dual points, such as the centers of cells, faces, and edges
+# - "edge_dual": points near the ends of an edge, probing the slope of fn to place its dual (see compute_edge_dual)
+# - "gradient": central differences, for QEF duals and normals
+# - "root": steps of the searches for zeros along edges
+PURPOSES = ("vertex", "dual", "edge_dual", "gradient", "root")
+
+_observer: ContextVar[PlotObserver | None] = ContextVar("observer", default=None)
+_purpose: ContextVar[str] = ContextVar("purpose", default="vertex")
+
+
+class PlotObserver:
+    """Receives reports from the plotting functions while active (see observe). Every method does nothing here,
+    so subclasses (such as PlotStats, or one forwarding to a tracer) override the ones they need"""
+
+    def stage_started(self, name: str) -> None:
+        pass
+
+    def stage_finished(self, name: str, seconds: float) -> None:
+        pass
+
+    def evaluated(self, purpose: str, count: int) -> None:
+        """fn was evaluated at count points, for purpose (one of PURPOSES)"""
+
+    def tree_built(self, root: Cell) -> None:
+        """The tree (or a tile of it) is complete, and about to be triangulated"""
+
+    def roots_found(self, evaluations: np.ndarray) -> None:
+        """Edges were searched for zeros, with evaluations[k] evaluations of fn spent on edge k"""
+
+    def cache_accessed(self, name: str, hits: int, misses: int) -> None:
+        """Lookups in a cache: "duals" for the dual points of a VertexStore, or "evaluations" for an
+        EvaluationCache"""
+
+
+class PlotStats(PlotObserver):
+    """Totals of everything reported, over all plots made while it is active"""
+
+    def __init__(self) -> None:
+        # Seconds spent in each stage
+        self.stage_times: dict[str, float] = {}
+        # Evaluations of fn by purpose
+        self.evaluations: Counter[str] = Counter()
+        # Leaves of the tree by depth
+        self.leaves: Counter[int] = Counter()
+        # Edges searched for zeros, by the number of evaluations of fn spent on each
+        self.root_evaluations: Counter[int] = Counter()
+        self.cache_hits: Counter[str] = Counter()
+        self.cache_misses: Counter[str] = Counter()
+
+    def stage_finished(self, name: str, seconds: float) -> None:
+        self.stage_times[name] = self.stage_times.get(name, 0.0) + seconds
+
+    def evaluated(self, purpose: str, count: int) -> None:
+        self.evaluations[purpose] += count
+
+    def tree_built(self, root: Cell) -> None:
+        cells = [root]
+        while cells:
+            cell = cells.pop()
+            if cell.children:
+                cells.extend(cell.children)
+            else:
+                self.leaves[cell.depth] += 1
+
+    def roots_found(self, evaluations: np.ndarray) -> None:
+        counts, number = np.unique(evaluations, return_counts=True)
+        self.root_evaluations.update(dict(zip(counts.tolist(), number.tolist())))
+
+    def cache_accessed(self, name: str, hits: int, misses: int) -> None:
+        self.cache_hits[name] += hits
+        self.cache_misses[name] += misses
+
+    def hit_rate(self, name: str) -> float | None:
+        """Fraction of lookups in the cache name that were hits, or None if there were none"""
+        lookups = self.cache_hits[name] + self.cache_misses[name]
+        return self.cache_hits[name] / lookups if lookups else None
+
+    def summary(self) -> str:
+        lines = [f"{name}: {seconds:.3f}s" for name, seconds in self.stage_times.items()]
+        lines.append(f"evaluations: {sum(self.evaluations.values())} ({format_counts(self.evaluations)})")
+        if self.leaves:
+            lines.append(f"leaves by depth: {format_counts(dict(sorted(self.leaves.items())))}")
+        edges = sum(self.root_evaluations.values())
+        if edges:
+            mean = sum(k * n for k, n in self.root_evaluations.items()) / edges
+            lines.append(f"root searches: {edges} edges, {mean:.1f} evaluations per edge")
+        for name in self.cache_hits.keys() | self.cache_misses.keys():
+            lines.append(f"{name} cache: {self.hit_rate(name):.1%} hits")
+        return "\n".join(lines)
+
+
+def format_counts(counts: dict) -> str:
+    return ", ".join(f"{key}: {value}" for key, value in counts.items())
+
+
+@contextmanager
+def observe(observer: PlotObserver) -> Iterator[PlotObserver]:
+    """Make observer the one the plotting functions report to, within the with block"""
+    token = _observer.set(observer)
+    try:
+        yield observer
+    finally:
+        _observer.reset(token)
+
+
+def current_observer() -> PlotObserver | None:
+    return _observer.get()
+
+
+def current_purpose() -> str:
+    return _purpose.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the with block as the stage name, if an observer is active"""
+    observer = _observer.get()
+    if observer is None:
+        yield
+        return
+    observer.stage_started(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observer.stage_finished(name, time.perf_counter() - start)
+
+
+@contextmanager
+def evaluating(purpose: str) -> Iterator[None]:
+    """Count the evaluations of fn within the with block as being for purpose"""
+    token = _purpose.set(purpose)
+    try:
+        yield
+    finally:
+        _purpose.reset(token)
+
+
+def report_tree(root: Cell) -> None:
+    observer = _observer.get()
+    if observer is not None:
+        observer.tree_built(root)
+
+
+def counted(fn: Callable[..., T], vectorized: bool, observer: PlotObserver) -> Callable[..., T]:
+    """fn (a BatchFunc if vectorized), reporting each call to observer as evaluations"""
+    if vectorized:
+
+        def batch_fn(positions: np.ndarray) -> T:
+            observer.evaluated(_purpose.get(), len(positions))
+            return fn(positions)
+
+        return batch_fn
+
+    def counted_fn(p: np.ndarray) -> T:
+        observer.evaluated(_purpose.get(), 1)
+        return fn(p)
+
+    return counted_fn
@@ -0,0 +1,329 @@
+"""Writing the isosurface of a domain too large to hold in memory, one tile (brick) at a time.
+
+The domain is split into the 8**tile_depth cells of depth tile_depth, and each tile gets its own octree
+(a subtree of the octree of the whole domain, on the same lattice), which is triangulated, written to a
+MeshSink, and dropped before the next tile is built. Peak memory then grows with the size of a tile, plus
+what is kept of the boundaries between tiles, rather than with the whole output."""
+
+from __future__ import annotations
+
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from itertools import product
+from typing import BinaryIO, Sequence, Tuple
+
+import numpy as np
+
+from .cache import EvaluationCache
+from .cell import BoundsFunc, Cell, CellIndex, RefinementCriterion, refine_tree
+from .isosurface import MeshBuilder, SimplexGenerator
+from .parallel import make_store
+from .point import LATTICE_DEPTH, Func, LatticeKey, Point, VertexStore
+from .roots import RootMethod
+from .stats import report_tree, stage
+
+# A cell of the octree of the whole domain, as its depth and its integer coordinates at that depth
+CellId = Tuple[int, Tuple[int, ...]]
+# Tile coordinates, along with an axis and a direction (0 for -, 1 for +) across one of its sides
+TileSide = Tuple[Tuple[int, ...], int, int]
+# Width of the counts in a PlySink header, which are filled in on close
+PLY_COUNT_WIDTH = 10
+
+
+class MeshSink(ABC):
+    """Destination for the blocks of an indexed mesh written by write_isosurface_tiled"""
+
+    def __enter__(self) -> MeshSink:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @abstractmethod
+    def write(self, vertices: np.ndarray, faces: np.ndarray) -> None:
+        """Append vertices, an (N, 3) float64 array, and faces, an (M, 3) array of indices into all vertices
+        written so far (including these). Faces only refer to vertices already written"""
+
+    def close(self) -> None:
+        """Finish writing"""
+
+
+class ObjSink(MeshSink):
+    """Writes a Wavefront OBJ file as blocks arrive"""
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "w")
+
+    def write(self, vertices: np.ndarray, faces: np.ndarray) -> None:
+        np.savetxt(self.file, vertices, fmt="v %.17g %.17g %.17g")
+        # OBJ indices start at 1
+        np.savetxt(self.file, faces + 1, fmt="f %d %d %d")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class PlySink(MeshSink):
+    """Writes a binary little-endian PLY file. Vertices go straight to the file, while faces (which PLY puts
+    after all vertices) are spooled to a temporary file and appended on close"""
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "wb")
+        self.faces: BinaryIO = tempfile.TemporaryFile()
+        self.vertex_count = 0
+        self.face_count = 0
+        self.file.write(self.header().encode())
+
+    def header(self) -> str:
+        return (
+            "ply\n"
+            "format binary_little_endian 1.0\n"
+            f"element vertex {self.vertex_count:0{PLY_COUNT_WIDTH}d}\n"
+            "property double x\n"
+            "property double y\n"
+            "property double z\n"
+            f"element face {self.face_count:0{PLY_COUNT_WIDTH}d}\n"
+            "property list uchar int vertex_indices\n"
+            "end_header\n"
+        )
+
+    def write(self, vertices: np.ndarray, faces: np.ndarray) -> None:
+        self.file.write(np.ascontiguousarray(vertices, dtype="<f8").tobytes())
+        records = np.empty(len(faces), dtype=[("count", "u1"), ("indices", "<i4", (3,))])
+        records["count"] = 3
+        records["indices"] = faces
+        self.faces.write(records.tobytes())
+        self.vertex_count += len(vertices)
+        self.face_count += len(faces)
+
+    def close(self) -> None:
+        self.faces.seek(0)
+        shutil.copyfileobj(self.faces, self.file)
+        self.faces.close()
+        # The header keeps its length, since the counts are padded to a fixed width
+        self.file.seek(0)
+        self.file.write(self.header().encode())
+        self.file.close()
+
+
+def write_isosurface_tiled(
+    fn: Func,
+    pmin: Point,
+    pmax: Point,
+    sink: MeshSink,
+    tile_depth: int = 2,
+    min_depth: int = 5,
+    max_cells: int = 10000,
+    tol: np.ndarray | None = None,
+    vectorized: bool = False,
+    root_method: RootMethod = "bisect",
+    workers: int | None = 1,
+    criteria: Sequence[RefinementCriterion] = (),
+    cache: EvaluationCache | None = None,
+    bounds: BoundsFunc | None = None,
+) -> tuple[int, int]:
+    """Writes the same kind of indexed mesh as plot_isosurface_mesh to sink, one tile at a time,
+    and returns the numbers of vertices and faces written.
+
+    The domain is split into 2**tile_depth tiles along each axis, each refined as build_tree would
+    (with max_cells leaves per tile) and then, along the sides it shares with other tiles, split further
+    wherever the tile across is finer (see balance_tiles). Both tiles then triangulate their shared side
+    the same way, and the vertices on it are written only once, so the mesh has no cracks between tiles.
+
+    Finding where to split takes a first pass over all tiles that only keeps the cells along their sides,
+    so each tile is built twice and fn is evaluated about twice as often as by plot_isosurface_mesh,
+    unless cache is given (see EvaluationCache). The other arguments are as for plot_isosurface_mesh"""
+    pmin = np.asarray(pmin)
+    pmax = np.asarray(pmax)
+    tol = (pmax - pmin) / 1000 if tol is None else np.asarray(tol)
+    if not 0 <= tile_depth < LATTICE_DEPTH:
+        raise ValueError(f"tile_depth must be between 0 and {LATTICE_DEPTH - 1}")
+    tiles = list(product(range(1 << tile_depth), repeat=3))
+    with make_store(fn, pmin, pmax, vectorized, workers, cache) as store:
+        with stage("balance"):
+            sides: dict[tuple[int, ...], set[CellId]] = {}
+            for tile in tiles:
+                root = build_tile(store, tile, tile_depth, min_depth, max_cells, tol, criteria, bounds)
+                sides[tile] = {(leaf.depth, leaf.get_coords()) for leaf in side_leaves(root, tile_depth)}
+                release_tile(store)
+            forced = balance_tiles(sides, tile_depth)
+            del sides
+        writer = TileWriter(sink, tile_depth)
+        for tile in tiles:
+            with stage("tree"):
+                root = build_tile(store, tile, tile_depth, min_depth, max_cells, tol, criteria, bounds)
+                for depth, coords in forced[tile]:
+                    force_cell(root, store, depth, coords)
+                store.flush()
+            report_tree(root)
+            builder = MeshBuilder(store, tol, root_method)
+            with stage("simplices"):
+                for simplex in SimplexGenerator(root, store.fn, store, index=TileCellIndex(root)).get_simplices():
+                    builder.add_simplex(simplex)
+            with stage("write"):
+                writer.write(builder)
+            release_tile(store)
+        return writer.vertex_count, writer.face_count
+
+
+def build_tile(
+    store: VertexStore,
+    tile: tuple[int, ...],
+    tile_depth: int,
+    min_depth: int,
+    max_cells: int,
+    tol: np.ndarray,
+    criteria: Sequence[RefinementCriterion],
+    bounds: BoundsFunc | None,
+) -> Cell:
+    """The subtree that build_tree would build under the cell tile of depth tile_depth, with at most
+    max_cells leaves"""
+    shift = LATTICE_DEPTH - tile_depth
+    vertices = [
+        store.get(tuple((c + (i >> d & 1)) << shift for d, c in enumerate(tile)), defer=True)
+        for i in range(1 << len(tile))
+    ]
+    store.flush()
+    root = Cell(len(tile), vertices, tile_depth, [], None, 0)
+    refine_tree(root, store, min_depth, max_cells, tol, criteria, bounds)
+    return root
+
+
+class TileCellIndex(CellIndex):
+    """CellIndex of the subtree under a tile root, where the sides of the tile are the boundary"""
+
+    def __init__(self, root: Cell) -> None:
+        super().__init__(root)
+        self.root_depth = root.depth
+        self.root_coords = root.get_coords()
+
+    def walk_in_direction(self, cell: Cell, axis: int, dir: int) -> Cell | None:
+        coord = cell.get_coords()[axis] + (1 if dir else -1)
+        if coord >> (cell.depth - self.root_depth) != self.root_coords[axis]:
+            # The neighbour is in another tile
+            return None
+        return super().walk_in_direction(cell, axis, dir)
+
+
+def release_tile(store: VertexStore) -> None:
+    """Drop the points of the last tile from store"""
+    store.points = {}
+    store.duals.clear()
+
+
+def tile_sides(depth: int, coords: tuple[int, ...], tile_depth: int) -> list[TileSide]:
+    """Sides shared with another tile that the cell (depth, coords) touches, as (tile, axis, dir)"""
+    shift = depth - tile_depth
+    tile = tuple(c >> shift for c in coords)
+    last = (1 << tile_depth) - 1
+    sides = []
+    for axis, c in enumerate(coords):
+        if c == tile[axis] << shift and tile[axis] > 0:
+            sides.append((tile, axis, 0))
+        if c + 1 == (tile[axis] + 1) << shift and tile[axis] < last:
+            sides.append((tile, axis, 1))
+    return sides
+
+
+def side_leaves(root: Cell, tile_depth: int) -> list[Cell]:
+    """Leaves under the tile root that touch a side shared with another tile"""
+    leaves = []
+    cells = [root]
+    while cells:
+        cell = cells.pop()
+        if not tile_sides(cell.depth, cell.get_coords(), tile_depth):
+            continue
+        if cell.children:
+            cells.extend(cell.children)
+        else:
+            leaves.append(cell)
+    return leaves
+
+
+def balance_tiles(sides: dict[tuple[int, ...], set[CellId]], tile_depth: int) -> dict[tuple[int, ...], list[CellId]]:
+    """Cells that each tile has to be split down to, so that the leaves on both sides of each shared side match.
+
+    sides holds the leaves of each tile that touch its shared sides, and is updated with the splits. Across each
+    shared side, the tile whose leaf is coarser gets split down to the leaf across. Splits can make a tile finer
+    along another of its sides, so this repeats until no tile needs another split"""
+    forced: dict[tuple[int, ...], list[CellId]] = {tile: [] for tile in sides}
+    changed = True
+    while changed:
+        changed = False
+        for tile, leaves in sides.items():
+            for depth, coords in list(leaves):
+                for _, axis, dir in tile_sides(depth, coords, tile_depth):
+                    # The cell of the same size across the side, which the tile across needs to have
+                    across = list(coords)
+                    across[axis] += 1 if dir else -1
+                    across_tile = tuple(c >> (depth - tile_depth) for c in across)
+                    if split_down_to(sides[across_tile], depth, tuple(across), tile_depth):
+                        forced[across_tile].append((depth, tuple(across)))
+                        changed = True
+    return forced
+
+
+def split_down_to(leaves: set[CellId], depth: int, coords: tuple[int, ...], tile_depth: int) -> bool:
+    """Split the leaf containing the cell (depth, coords) in leaves, if it is larger, down to that cell,
+    keeping the new leaves that touch a shared side. Returns whether there was anything to split"""
+    for ancestor_depth in range(depth - 1, tile_depth - 1, -1):
+        ancestor = tuple(c >> (depth - ancestor_depth) for c in coords)
+        if (ancestor_depth, ancestor) in leaves:
+            break
+    else:
+        # Already split at least as far
+        return False
+    for split_depth in range(ancestor_depth, depth):
+        leaves.remove((split_depth, tuple(c >> (depth - split_depth) for c in coords)))
+        for i in range(1 << len(coords)):
+            child = tuple((c >> (depth - split_depth) << 1) | (i >> d & 1) for d, c in enumerate(coords))
+            if tile_sides(split_depth + 1, child, tile_depth):
+                leaves.add((split_depth + 1, child))
+    return True
+
+
+def force_cell(root: Cell, store: VertexStore, depth: int, coords: tuple[int, ...]) -> None:
+    """Split the cells under root on the way down to the cell (depth, coords), deferring their new vertices"""
+    cell = root
+    while cell.depth < depth:
+        if not cell.children:
+            cell.compute_children(store, defer=True)
+        shift = depth - cell.depth - 1
+        # Child i is at the far side along axis d when bit d of i is set
+        cell = cell.children[sum((c >> shift & 1) << d for d, c in enumerate(coords))]
+
+
+class TileWriter:
+    """Writes the meshes of tiles to a sink with indices into the whole mesh, writing each vertex on a side shared
+    between tiles only once"""
+
+    def __init__(self, sink: MeshSink, tile_depth: int) -> None:
+        self.sink = sink
+        self.tile_size = 1 << (LATTICE_DEPTH - tile_depth)
+        self.vertex_count = 0
+        self.face_count = 0
+        # Index of each vertex written on a shared side, by the lattice keys of its edge
+        self.shared: dict[tuple[LatticeKey, LatticeKey], int] = {}
+
+    def write(self, builder: MeshBuilder) -> None:
+        mesh = builder.get_mesh()
+        ids = np.empty(len(builder.edges), dtype=np.int64)
+        new: list[int] = []
+        for i, (p1, p2) in enumerate(builder.edges):
+            edge = (p1.key, p2.key) if p1.key < p2.key else (p2.key, p1.key)
+            shared = self.is_shared(*edge)
+            id = self.shared.get(edge) if shared else None
+            if id is None:
+                id = self.vertex_count + len(new)
+                new.append(i)
+                if shared:
+                    self.shared[edge] = id
+            ids[i] = id
+        self.sink.write(mesh.vertices[new], ids[mesh.faces])
+        self.vertex_count += len(new)
+        self.face_count += len(mesh.faces)
+
+    def is_shared(self, key1: LatticeKey, key2: LatticeKey) -> bool:
+        """Whether the edge key1--key2 lies on a side shared between tiles"""
+        return any(a == b and a % self.tile_size == 0 and 0 < a < 1 << LATTICE_DEPTH for a, b in zip(key1, key2))
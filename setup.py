@@ -43,4 +43,5 @@ setup(
     include_package_data=True,
     package_data={"isosurfaces": ["py.typed"]},
     install_requires=["numpy"],
+    extras_require={"numba": ["numba"]},
 )